@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff")
+
+# Keys of `Main.template_folders`, repeated so the parent process can validate
+# arguments without loading the OCR models
+DOCUMENT_TYPES = ("invoice", "prescription", "labreport")
+
+_check = None  # `Main.CHECK`, imported inside each worker
+
+
+def find_images(directory, recursive=False):
+    """
+    Lists the image files of a directory.
+
+    Args:
+        directory (str): Directory to scan.
+        recursive (bool, optional): Also scan sub-directories. Defaults to False.
+
+    Returns:
+        list: Sorted image paths.
+    """
+
+    paths = []
+    for root, folders, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not recursive:
+            break
+        folders.sort()
+    return sorted(paths)
+
+
+def read_manifest(path, document_type=None):
+    """
+    Reads a manifest of images to check.
+
+    Every non-empty line is either an image path, or a JSON object with a "path" and
+    optionally a "document_type" overriding the command line one.
+
+    Args:
+        path (str): Manifest file.
+        document_type (str, optional): Document type of lines that do not name one.
+
+    Returns:
+        list: (image path, document type) tuples, in manifest order.
+    """
+
+    tasks = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                tasks.append((entry["path"], entry.get("document_type", document_type)))
+            else:
+                tasks.append((line, document_type))
+    return tasks
+
+
+def completed_tasks(output):
+    """
+    Reads the images already checked by an earlier, possibly interrupted, run.
+
+    Args:
+        output (str): JSON Lines output of the earlier run.
+
+    Returns:
+        set: (image path, document type) tuples with a verdict; images that failed
+             with an error, or were checked as another document type, are checked again.
+    """
+
+    done = set()
+    if not os.path.isfile(output):
+        return done
+    with open(output) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Line cut off by the interruption
+            if record.get("error") is None:
+                done.add((record["path"], record.get("document_type")))
+    return done
+
+
+def load_templates(document_types):
+    """
+    Loads the template stores of the given document types, building or refreshing them if needed.
+
+    Besides the descriptor store and layout index, this covers what the configured
+    match mode reads (FLANN index, clusters or coarse pyramid store). Called once in
+    the parent before the pool starts, so the workers only open up-to-date files
+    instead of racing to build them.
+
+    Args:
+        document_types (list): Document types of the batch.
+    """
+
+    import Main
+    from Descriptor_Store import get_descriptor_store
+    from Feature_Extraction import match_profile, coarse_profile
+    from Layout_Hash import get_layout_index
+
+    for document_type in document_types:
+        folder = Main.template_folders[document_type]
+        engine = Main.select_engine(document_type)
+        get_descriptor_store(folder, engine=engine)
+        get_layout_index(folder)
+        if Main.MATCH_MODE == "global":
+            from Template_Index import get_template_index
+            get_template_index(folder, engine)
+        elif Main.MATCH_MODE == "cluster":
+            from Template_Clusters import get_template_clusters
+            get_template_clusters(folder, engine)
+        elif Main.MATCH_MODE == "pyramid":
+            get_descriptor_store(folder, engine=engine, profile=coarse_profile(match_profile(folder)))
+
+
+def _init_worker(document_types, template_threads, use_cache):
+    # Runs once per worker process: one warm OCR reader and the template stores of
+    # every document type in the batch (already built by the parent), opened before
+    # the first file arrives
+    global _check
+    os.environ.setdefault("OMP_NUM_THREADS", "1")  # One process per core already
+    os.environ["OCR_READER_POOL_SIZE"] = "1"
+    os.environ["CHECK_TEMPLATE_THREADS"] = str(template_threads)
+    if not use_cache:
+        os.environ["CHECK_CACHE"] = "0"
+
+    import cv2
+    import Main
+    from OCR_Reader_Pool import get_reader_pool
+
+    cv2.setNumThreads(1)
+    get_reader_pool().warm_up()
+    load_templates(document_types)
+    _check = Main.CHECK
+
+
+def _check_file(task):
+    # Runs in a worker: check one file and describe the outcome as one output record
+    path, document_type = task
+    start = time.perf_counter()
+    record = {"path": path, "document_type": document_type, "result": None, "accepted": None, "error": None}
+    try:
+        record["result"] = _check(document_type, path)
+        record["accepted"] = record["result"].startswith("ACCEPTED")
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.perf_counter() - start, 4)
+    record["worker"] = os.getpid()
+    return record
+
+
+def run_batch(tasks, output, workers, template_threads=1, use_cache=True, resume=True, chunksize=1):
+    """
+    Checks many images on a process pool and streams one JSON line per image.
+
+    Args:
+        tasks (list): (image path, document type) tuples.
+        output (str): JSON Lines file the records are appended to.
+        workers (int): Number of worker processes.
+        template_threads (int, optional): Template matching threads per worker. Defaults to 1.
+        use_cache (bool, optional): Use the result cache in the workers. Defaults to True.
+        resume (bool, optional): Skip images already recorded in `output`. Defaults to True.
+        chunksize (int, optional): Images handed to a worker at a time. Defaults to 1.
+
+    Returns:
+        dict: Counts of checked, accepted, rejected, failed and skipped images and the elapsed time.
+    """
+
+    summary = {"checked": 0, "accepted": 0, "rejected": 0, "errors": 0, "skipped": 0}
+    if resume:
+        done = completed_tasks(output)
+        summary["skipped"] = sum(1 for task in tasks if tuple(task) in done)
+        tasks = [task for task in tasks if tuple(task) not in done]
+    elif os.path.exists(output):
+        os.remove(output)
+
+    # Drop a record cut off by an interruption so the output stays valid JSON Lines
+    if os.path.isfile(output):
+        with open(output, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    start = time.perf_counter()
+    if tasks:
+        document_types = sorted({document_type for _, document_type in tasks})
+        load_templates(document_types)  # Built once here; the workers only open them
+        # Spawned workers do not inherit the parent's threads (OCR and OpenCV thread pools are not fork-safe)
+        context = multiprocessing.get_context("spawn")
+        with open(output, "a") as f, context.Pool(
+            workers, initializer=_init_worker, initargs=(document_types, template_threads, use_cache)
+        ) as pool:
+            for record in pool.imap_unordered(_check_file, tasks, chunksize=chunksize):
+                f.write(json.dumps(record) + "\n")
+                f.flush()  # Every finished image survives an interruption
+                summary["checked"] += 1
+                if record["error"]:
+                    summary["errors"] += 1
+                elif record["accepted"]:
+                    summary["accepted"] += 1
+                else:
+                    summary["rejected"] += 1
+                if summary["checked"] % 100 == 0:
+                    rate = summary["checked"] / (time.perf_counter() - start)
+                    print(f"{summary['checked']}/{len(tasks)} checked ({rate:.1f}/s)", file=sys.stderr, flush=True)
+
+    summary["seconds"] = round(time.perf_counter() - start, 1)
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check a directory or manifest of document images offline.")
+    parser.add_argument("input", help="directory of images, or a manifest file (one path or JSON object per line)")
+    parser.add_argument("--document-type", choices=DOCUMENT_TYPES,
+                        help="document type of every image (manifest lines may override it)")
+    parser.add_argument("--output", required=True, help="JSON Lines file the results are appended to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="worker processes (default: number of CPUs)")
+    parser.add_argument("--template-threads", type=int, default=1,
+                        help="template matching threads per worker (default: 1)")
+    parser.add_argument("--chunksize", type=int, default=1, help="images handed to a worker at a time")
+    parser.add_argument("--recursive", action="store_true", help="also scan sub-directories")
+    parser.add_argument("--no-resume", action="store_true", help="start over instead of skipping checked images")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the result cache")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if os.path.isdir(args.input):
+        if args.document_type is None:
+            raise SystemExit("--document-type is required when checking a directory")
+        tasks = [(path, args.document_type) for path in find_images(args.input, args.recursive)]
+    else:
+        tasks = read_manifest(args.input, args.document_type)
+
+    invalid = [path for path, document_type in tasks if document_type not in DOCUMENT_TYPES]
+    if invalid:
+        raise SystemExit(f"no valid document type for {len(invalid)} images, e.g. {invalid[0]}")
+
+    summary = run_batch(
+        tasks,
+        args.output,
+        max(1, args.workers),
+        template_threads=args.template_threads,
+        use_cache=not args.no_cache,
+        resume=not args.no_resume,
+        chunksize=args.chunksize,
+    )
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
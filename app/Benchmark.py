@@ -0,0 +1,646 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import platform
+import resource
+import tempfile
+
+# Benchmarks measure the pipeline itself, never the result cache, and do not record their
+# repeated inputs as uploads
+os.environ["CHECK_CACHE"] = "0"
+os.environ["CHECK_UPLOAD_HISTORY"] = "0"
+
+import cv2
+import numpy as np
+from Image_Loading import decode_image
+from Convert_To_Png import convert_to_png
+from Pre_Processing import preprocess_image, correct_skew
+from Feature_Extraction import prepare_image, load_template, match_profile, profile_tag
+from Descriptor_Store import resolve_template_folder, get_descriptor_store
+from Template_Matching import detect_and_match_features, compare_image_with_templates
+from Layout_Hash import layout_hash, hamming_distances, get_layout_index
+
+# Stages that can be benchmarked, in report order
+STAGES = [
+    "convert_to_png",
+    "correct_skew",
+    "preprocess_image",
+    "process_ocr",
+    "classify_document",
+    "detect_and_match_features",
+    "compare_image_with_templates",
+    "check",
+    "layout_distances",
+    "store_memory",
+]
+
+# Same document type -> template folder mapping as `Main.template_folders`, repeated
+# here so the template benchmarks also run where EasyOCR is not installed
+TEMPLATE_FOLDERS = {"invoice": "INVOICES", "prescription": "PRESCRIPTIONS", "labreport": "LABREPORTS"}
+
+# Stages that need EasyOCR; they are skipped (and reported as such) when it is not installed
+OCR_STAGES = ("process_ocr", "classify_document", "check")
+
+SAMPLE_FOLDER = "SAMPLE_IMAGES"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp")
+
+# Subsets of a template library are symlinked here, one folder per size, so their
+# descriptor stores are built once and reused by later runs
+SUBSET_ROOT = os.path.join(tempfile.gettempdir(), "document-check-benchmark")
+
+
+def load_samples(folder=SAMPLE_FOLDER, limit=None):
+    """
+    Reads the bundled sample images.
+
+    Args:
+        folder (str, optional): Name or path of the sample folder. Defaults to SAMPLE_FOLDER.
+        limit (int, optional): Largest number of images used.
+
+    Returns:
+        list: (file name, encoded bytes, decoded image) tuples, sorted by file name.
+    """
+
+    folder = resolve_template_folder(folder)
+    samples = []
+    for filename in sorted(os.listdir(folder)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        with open(os.path.join(folder, filename), "rb") as f:
+            data = f.read()
+        image = decode_image(data)
+        if image is not None:
+            samples.append((filename, data, image))
+    return samples[:limit] if limit else samples
+
+
+def template_subset(template_folder, size):
+    """
+    Returns a template folder holding the first `size` templates of a library.
+
+    Args:
+        template_folder (str): Name of the full template folder (e.g. "INVOICES").
+        size (int or None): Number of templates; None for the whole library.
+
+    Returns:
+        str: Path of a folder with `size` templates (the library itself for None).
+    """
+
+    folder = resolve_template_folder(template_folder)
+    names = sorted(name for name in os.listdir(folder) if name.endswith(".png"))
+    if size is None or size >= len(names):
+        return folder
+
+    subset = os.path.join(SUBSET_ROOT, f"{os.path.basename(folder)}_{size}")
+    os.makedirs(subset, exist_ok=True)
+    wanted = set(names[:size])
+    for name in os.listdir(subset):
+        if name not in wanted:
+            os.remove(os.path.join(subset, name))
+    for name in wanted:
+        link = os.path.join(subset, name)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(folder, name), link)
+    return subset
+
+
+# Rotations (degrees) applied to the samples for the correct_skew accuracy check
+SKEW_ANGLES = (-4, -2.5, -1, 0, 1.5, 3)
+
+
+def legacy_correct_skew(image):
+    """
+    The projection search `Pre_Processing.correct_skew` used before its rewrite, kept as a baseline.
+
+    It rotates the thresholded page by 90 degrees on every iteration instead of by the
+    candidate angle, so its scores do not depend on the angle and it returns -5 degrees.
+
+    Args:
+        image (np.ndarray): Grayscale or BGR image.
+
+    Returns:
+        tuple: The rotated image and the chosen angle in degrees.
+    """
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+    thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    h, w = thresh.shape
+    scores = []
+    angles = np.arange(-5, 6, 1)
+    for _ in angles:
+        rotated = cv2.rotate(thresh, cv2.ROTATE_90_CLOCKWISE, dst=thresh)
+        hist = np.sum(rotated, axis=1, dtype=float)
+        scores.append(np.sum((hist[1:] - hist[:-1]) ** 2, dtype=float))
+    best_angle = angles[scores.index(max(scores))]
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), best_angle, 1.0)
+    return cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE), best_angle
+
+
+def rotate(image, angle):
+    # Skew a page by `angle` degrees, as a scanner would
+    h, w = image.shape[:2]
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    return cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+def skew_errors(function, images, angles=SKEW_ANGLES):
+    """
+    Measures how far a skew corrector's angle is from the applied rotation.
+
+    Args:
+        function (callable): Returns (image, angle) like `correct_skew`.
+        images (list): Straight sample images.
+        angles (tuple, optional): Rotations applied to every image. Defaults to SKEW_ANGLES.
+
+    Returns:
+        dict: Mean and median absolute error in degrees, and the fraction of cases left unrotated.
+    """
+
+    errors, unrotated = [], 0
+    for image in images:
+        for angle in angles:
+            _, estimate = function(rotate(image, angle))
+            errors.append(abs(float(estimate) + angle))  # The correction undoes the rotation
+            unrotated += estimate == 0
+    return {
+        "mean_abs_error_deg": round(float(np.mean(errors)), 2),
+        "median_abs_error_deg": round(float(np.median(errors)), 2),
+        "unrotated": round(unrotated / len(errors), 3),
+    }
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process so far (ru_maxrss is in KiB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure(name, stage, params, function, inputs, repeat, warmup=1):
+    """
+    Times `function` on every input, `repeat` times.
+
+    Args:
+        name (str): Unique case name, used to compare against a baseline.
+        stage (str): The benchmarked stage.
+        params (dict): Parameters of the case (library size, threads...).
+        function (callable): Called once per input.
+        inputs (list): Inputs of the case.
+        repeat (int): Number of timed passes over the inputs.
+        warmup (int, optional): Untimed passes run first (model loads, index builds). Defaults to 1.
+
+    Returns:
+        dict: Call count, latency percentiles (ms), throughput and peak RSS of the case.
+    """
+
+    for _ in range(warmup):
+        for item in inputs:
+            function(item)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            call_start = time.perf_counter()
+            function(item)
+            latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    case = {
+        "name": name,
+        "stage": stage,
+        "params": params,
+        "calls": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "throughput_per_s": round(len(latencies) / elapsed, 3) if elapsed else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(
+        f"{name:<60} p50 {case['p50_ms']:>10.2f} ms  p95 {case['p95_ms']:>10.2f} ms  "
+        f"{case['throughput_per_s']:>8.2f}/s  rss {case['peak_rss_mb']:.0f} MB",
+        flush=True,
+    )
+    return case
+
+
+def distance_summary(distances, limit):
+    """
+    Summarises a distribution of layout-hash distances.
+
+    Args:
+        distances (list): Hamming distances to the nearest template.
+        limit (int or None): Distance above which the layout gate would reject.
+
+    Returns:
+        dict: Count, minimum, 5th/50th/95th percentiles, maximum and the fraction above `limit`.
+    """
+
+    distances = np.array(distances, dtype=np.float64)
+    if len(distances) == 0:
+        return {"count": 0}
+    return {
+        "count": len(distances),
+        "min": int(distances.min()),
+        "p5": round(float(np.percentile(distances, 5)), 1),
+        "p50": round(float(np.percentile(distances, 50)), 1),
+        "p95": round(float(np.percentile(distances, 95)), 1),
+        "max": int(distances.max()),
+        "rejected": None if limit is None else round(float((distances > limit).mean()), 3),
+    }
+
+
+def layout_distances(document_type, images, limit=None):
+    """
+    Measures how far pages are from the nearest template layout of a document type.
+
+    Three distributions are compared: every template against the rest of its own
+    library (leave-one-out; near-identical scans make this optimistic for real
+    uploads), the templates of the other document types, and the sample images.
+    A layout threshold is only useful where the first and second barely overlap.
+
+    Args:
+        document_type (str): Document type whose templates are the index.
+        images (list): Decoded sample images.
+        limit (int, optional): Threshold whose rejection rates are reported (e.g. `CHECK_LAYOUT_MAX_DISTANCE`).
+
+    Returns:
+        dict: A report case with the three distance summaries.
+    """
+
+    index = get_layout_index(TEMPLATE_FOLDERS[document_type])
+    same = []
+    for position, value in enumerate(index.hashes):
+        distances = hamming_distances(index.hashes, int(value)).astype(np.int64)
+        distances[position] = 64  # Not itself
+        same.append(int(distances.min()))
+    other = [
+        index.nearest(int(value))[1]
+        for other_type, folder in TEMPLATE_FOLDERS.items() if other_type != document_type
+        for value in get_layout_index(folder).hashes
+    ]
+    samples = [index.nearest(layout_hash(image))[1] for image in images]
+
+    case = {
+        "name": f"layout_distances[{document_type}]",
+        "stage": "layout_distances",
+        "params": {"document_type": document_type, "limit": limit},
+        "distances": {
+            "same_type_templates": distance_summary(same, limit),
+            "other_type_templates": distance_summary(other, limit),
+            "samples": distance_summary(samples, limit),
+        },
+    }
+    for kind, summary in case["distances"].items():
+        print(
+            f"{case['name'] + ' ' + kind:<60} p5 {summary['p5']:>5} p50 {summary['p50']:>5} "
+            f"p95 {summary['p95']:>5} max {summary['max']:>3}  rejected {summary['rejected']}",
+            flush=True,
+        )
+    return case
+
+
+def store_memory(template_folder, match_mode, threshold=15, samples=SAMPLE_FOLDER, limit=None):
+    """
+    Measures the memory a process needs to match the samples against a template store.
+
+    Meant to run in a fresh process (see `store_memory_cases`): the descriptor format
+    is read from CHECK_DESCRIPTOR_FORMAT at import, and peak RSS is per process.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+        match_mode (str): Match mode, e.g. "exhaustive" or "global".
+        threshold (int, optional): Good-match threshold. Defaults to 15.
+        samples (str, optional): Folder of input images. Defaults to SAMPLE_FOLDER.
+        limit (int, optional): Largest number of sample images used.
+
+    Returns:
+        dict: Store size on disk, size of the private matching copy, peak RSS before and
+              after matching (MB) and the matching time (s).
+    """
+
+    images = [image for _, _, image in load_samples(samples, limit)]
+    baseline = peak_rss_mb()
+    store = get_descriptor_store(template_folder)
+    start = time.perf_counter()
+    for image in images:
+        compare_image_with_templates(image, template_folder, threshold, num_threads=1, match_mode=match_mode)
+    private = store._matching if store._matching is not None and store._matching is not store.descriptors else None
+    return {
+        "store_mb": round(store.descriptors.nbytes / 1e6, 1),
+        "private_copy_mb": round(private.nbytes / 1e6, 1) if private is not None else 0.0,
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+
+
+def store_memory_cases(args):
+    """
+    Runs `store_memory` in a fresh process per descriptor format, match mode and library size.
+
+    Every format gets its own store root under SUBSET_ROOT, so measuring float32 does
+    not rebuild the uint8 store the application uses.
+
+    Args:
+        args (argparse.Namespace): Parsed command line options.
+
+    Returns:
+        list: One report case per combination.
+    """
+
+    cases = []
+    app_directory = os.path.dirname(os.path.abspath(__file__))
+    for size in args.library_sizes:
+        folder = template_subset(TEMPLATE_FOLDERS[args.document_type], size)
+        for descriptor_format in ("uint8", "float32"):
+            for match_mode in ("exhaustive", "global"):
+                env = dict(
+                    os.environ,
+                    CHECK_DESCRIPTOR_FORMAT=descriptor_format,
+                    CHECK_STORE_ROOT=os.path.join(SUBSET_ROOT, f"store-{descriptor_format}"),
+                )
+                code = (
+                    "import json, Benchmark; print(json.dumps(Benchmark.store_memory("
+                    f"{folder!r}, {match_mode!r}, {args.threshold}, {args.samples!r}, {args.limit!r})))"
+                )
+                # Built outside the measured process, which only opens the store
+                build = f"import Descriptor_Store; Descriptor_Store.build_descriptor_store({folder!r})"
+                subprocess.run([sys.executable, "-c", build], env=env, cwd=app_directory, check=True)
+                output = subprocess.run(
+                    [sys.executable, "-c", code], env=env, cwd=app_directory, check=True, capture_output=True, text=True
+                ).stdout
+                measured = json.loads(output.strip().splitlines()[-1])
+                library = len(os.listdir(folder)) if size is None else size
+                case = {
+                    "name": f"store_memory[library={library},format={descriptor_format},mode={match_mode}]",
+                    "stage": "store_memory",
+                    "params": {"library_size": library, "format": descriptor_format, "match_mode": match_mode},
+                    **measured,
+                }
+                print(
+                    f"{case['name']:<60} store {case['store_mb']:>7.1f} MB  private copy {case['private_copy_mb']:>7.1f} MB  "
+                    f"rss {case['baseline_rss_mb']:.0f} -> {case['peak_rss_mb']:.0f} MB  {case['seconds']:.1f}s",
+                    flush=True,
+                )
+                cases.append(case)
+    return cases
+
+
+def run_benchmarks(args):
+    """
+    Runs the selected stage benchmarks.
+
+    Args:
+        args (argparse.Namespace): Parsed command line options.
+
+    Returns:
+        tuple: The measured cases and a dict of skipped stages -> reason.
+    """
+
+    samples = load_samples(args.samples, args.limit)
+    if not samples:
+        raise SystemExit(f"no sample images found in {args.samples}")
+    images = [image for _, _, image in samples]
+    document_type = args.document_type
+    cases, skipped = [], {}
+
+    ocr = None
+    if any(stage in OCR_STAGES for stage in args.stages):
+        try:
+            import OCR_Matching as ocr
+            import Main
+        except ImportError as e:
+            for stage in OCR_STAGES:
+                skipped[stage] = f"{type(e).__name__}: {e}"
+
+    if "convert_to_png" in args.stages:
+        # Work on copies: convert_to_png writes its PNG next to the input
+        workdir = tempfile.mkdtemp(prefix="convert-")
+        try:
+            paths = []
+            for filename, data, _ in samples:
+                path = os.path.join(workdir, f"input-{filename}")
+                with open(path, "wb") as f:
+                    f.write(data)
+                paths.append(path)
+            cases.append(measure("convert_to_png", "convert_to_png", {}, convert_to_png, paths, args.repeat))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if "correct_skew" in args.stages:
+        # Old search against the current estimator: timing on the samples, accuracy on rotated copies
+        for name, function in (("legacy", legacy_correct_skew), ("current", correct_skew)):
+            case = measure(f"correct_skew[{name}]", "correct_skew", {"implementation": name}, function, images, args.repeat)
+            case.update(skew_errors(function, images))
+            print(
+                f"{case['name']:<60} mean error {case['mean_abs_error_deg']:.2f} deg  "
+                f"median {case['median_abs_error_deg']:.2f} deg  unrotated {case['unrotated']:.0%}",
+                flush=True,
+            )
+            cases.append(case)
+
+    if "preprocess_image" in args.stages:
+        cases.append(measure("preprocess_image", "preprocess_image", {}, preprocess_image, images, args.repeat))
+
+    if ocr is not None and "process_ocr" in args.stages:
+        cases.append(measure("process_ocr", "process_ocr", {}, ocr.process_ocr, images, args.repeat))
+    if ocr is not None and "classify_document" in args.stages:
+        # Classification runs on the real OCR output of the samples
+        texts = [ocr.process_ocr(image) for image in images]
+        matcher = ocr.KEYWORD_MATCHERS[document_type]
+        cases.append(measure(
+            "classify_document",
+            "classify_document",
+            {"document_type": document_type},
+            lambda text: ocr.classify_document(text, matcher),
+            texts,
+            args.repeat,
+        ))
+
+    template_folder = TEMPLATE_FOLDERS[document_type]
+
+    if "detect_and_match_features" in args.stages:
+        folder = resolve_template_folder(template_folder)
+        template_path = os.path.join(folder, sorted(name for name in os.listdir(folder) if name.endswith(".png"))[0])
+        template = load_template(template_path)
+        prepared = [prepare_image(image) for image in images]
+        cases.append(measure(
+            f"detect_and_match_features[engine={args.engine}]",
+            "detect_and_match_features",
+            {
+                "template": os.path.basename(template_path), "engine": args.engine,
+                "profile": profile_tag(match_profile()) or "squash",
+            },
+            lambda image: detect_and_match_features(image, template, args.engine),
+            prepared,
+            args.repeat,
+        ))
+
+    if "compare_image_with_templates" in args.stages:
+        for size in args.library_sizes:
+            folder = template_subset(template_folder, size)
+            library = len(get_descriptor_store(folder, engine=args.engine))  # Built outside the timed region
+            for threads in args.threads:
+                params = {
+                    "library_size": library, "threads": threads, "match_mode": args.match_mode, "engine": args.engine,
+                    "profile": profile_tag(match_profile()) or "squash",
+                }
+                cases.append(measure(
+                    f"compare_image_with_templates[library={library},threads={threads},"
+                    f"mode={args.match_mode},engine={args.engine}]",
+                    "compare_image_with_templates",
+                    params,
+                    lambda image: compare_image_with_templates(
+                        image,
+                        folder,
+                        threshold=args.threshold,
+                        num_threads=threads,
+                        match_mode=args.match_mode,
+                        engine=args.engine,
+                    ),
+                    images,
+                    args.template_repeat,
+                ))
+
+    if ocr is not None and "check" in args.stages:
+        encoded = [data for _, data, _ in samples]
+        cases.append(measure(
+            f"check[engine={args.engine}]", "check", {"document_type": document_type, "engine": args.engine},
+            lambda data: Main.CHECK(document_type, data, engine=args.engine), encoded, args.template_repeat,
+        ))
+
+    if "store_memory" in args.stages:
+        cases.extend(store_memory_cases(args))
+
+    if "layout_distances" in args.stages:
+        for indexed_type in TEMPLATE_FOLDERS:
+            cases.append(layout_distances(indexed_type, images, args.layout_limit))
+
+    return cases, {stage: reason for stage, reason in skipped.items() if stage in args.stages}
+
+
+def find_regressions(cases, baseline, max_regression, min_delta_ms=1.0):
+    """
+    Compares measured cases with a baseline report.
+
+    Args:
+        cases (list): Cases returned by `run_benchmarks`.
+        baseline (dict): A report previously written by this script.
+        max_regression (float): Largest tolerated slowdown, as a fraction (0.2 = 20% slower).
+        min_delta_ms (float, optional): Slowdowns smaller than this are timer noise and ignored. Defaults to 1.0.
+
+    Returns:
+        list: One dict per regressed metric, with the case name, metric, baseline and current value.
+    """
+
+    previous = {case["name"]: case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in cases:
+        old = previous.get(case["name"])
+        if old is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if metric not in case or metric not in old:
+                continue  # Not a timed case (e.g. layout_distances)
+            slower = case[metric] - old.get(metric, case[metric])
+            if slower > min_delta_ms and case[metric] > old[metric] * (1 + max_regression):
+                regressions.append({
+                    "name": case["name"],
+                    "metric": metric,
+                    "baseline": old[metric],
+                    "current": case[metric],
+                    "change": round(case[metric] / old[metric] - 1, 3),
+                })
+    return regressions
+
+
+def _sizes(value):
+    # "50,200,all" -> [50, 200, None]
+    return [None if size.strip() == "all" else int(size) for size in value.split(",")]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the document check pipeline and its stages.")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma-separated stages to run (default: all)")
+    parser.add_argument("--samples", default=SAMPLE_FOLDER, help="folder of input images (default: SAMPLE_IMAGES)")
+    parser.add_argument("--limit", type=int, default=None, help="use at most this many sample images")
+    parser.add_argument("--document-type", default="invoice", choices=["invoice", "prescription", "labreport"])
+    parser.add_argument("--repeat", type=int, default=5, help="timed passes over the samples for fast stages")
+    parser.add_argument("--template-repeat", type=int, default=1,
+                        help="timed passes for compare_image_with_templates and check")
+    parser.add_argument("--library-sizes", type=_sizes, default=_sizes("50,200"),
+                        help='template library sizes, e.g. "50,200,all" (default: 50,200)')
+    parser.add_argument("--threads", type=lambda value: [int(n) for n in value.split(",")], default=[1, 4],
+                        help="thread counts for compare_image_with_templates (default: 1,4)")
+    parser.add_argument("--match-mode", default="exhaustive", choices=["exhaustive", "global", "hash", "cluster", "pyramid"])
+    parser.add_argument("--engine", default="sift", choices=["sift", "orb", "akaze"],
+                        help="feature engine for the template matching stages (default: sift)")
+    parser.add_argument("--threshold", type=int, default=15, help="good-match threshold for template matching")
+    parser.add_argument("--layout-limit", type=int, default=18,
+                        help="layout distance whose rejection rates layout_distances reports (default: 18)")
+    parser.add_argument("--output", default="benchmark.json", help="JSON report path (default: benchmark.json)")
+    parser.add_argument("--baseline", help="earlier JSON report to check for regressions")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="tolerated p50/p95 slowdown against the baseline (default: 0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="ignore slowdowns smaller than this many milliseconds (default: 1.0)")
+    args = parser.parse_args(argv)
+    args.stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cv2.setNumThreads(max(args.threads))
+
+    started = time.time()
+    cases, skipped = run_benchmarks(args)
+    for stage, reason in skipped.items():
+        print(f"{stage:<60} skipped ({reason})")
+
+    report = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            "duration_s": round(time.time() - started, 1),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items()},
+        },
+        "cases": cases,
+        "skipped": skipped,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(cases, json.load(f), args.max_regression, args.min_delta_ms)
+        report["regressions"] = regressions
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.output}")
+
+    for regression in regressions:
+        print(
+            f"REGRESSION {regression['name']} {regression['metric']}: "
+            f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.0%})"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
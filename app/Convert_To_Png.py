@@ -1,16 +1,25 @@
 import os
 from PIL import Image
+from Upload_Intake import MAX_PAGES, MAX_PIXELS, inspect_image
+from Image_Normalisation import ARCHIVE_COMPRESS_LEVEL, needs_normalising, archive_png, page_paths
 
 
-def convert_to_png(input_path):
+def convert_to_png(input_path, compress_level=ARCHIVE_COMPRESS_LEVEL):
   """
   Converts a single image file to PNG format and saves it in the same folder.
 
+  The checks themselves never need the PNG (uploads are decoded in memory, see
+  `Image_Loading`); this is for archiving. RGB PNGs without an ICC profile are
+  left untouched, and each page of a multi-page file is written as its own PNG.
+  Files failing the upload header checks (too large, or more than MAX_PAGES
+  pages) are not converted.
+
   Args:
       input_path: Path to the image file to be converted.
+      compress_level (optional): zlib level of the PNG (default: ARCHIVE_COMPRESS_LEVEL).
 
   Returns:
-      True if conversion is successful, False otherwise.
+      Path of the PNG (of the first page) if conversion is successful, False otherwise.
 
   Raises:
       OSError: If an error occurs while processing the image.
@@ -18,28 +27,37 @@ def convert_to_png(input_path):
 
   # Extract filepath and extension
   base, ext = os.path.splitext(input_path)
-  # Check if the file is an image using its extension (common image formats)
-  if ext.lower() not in (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"):
-    # print(f"Skipping non-image file: {filename}")
+  # Check the magic bytes, dimensions and page count from the header (a renamed file is not trusted)
+  result, _ = inspect_image(input_path, max_pages=MAX_PAGES)
+  if not result[0]:
+    # print(f"Skipping {filename}: {result[1]}")
     return False
 
   # Create output filename with PNG extension (same folder as input)
   output_path = f"{base}.png"  # Replace original extension with PNG
 
   try:
-    # Open the image using Pillow
-    img = Image.open(input_path)
-
-    # Convert to RGB mode (if necessary) for PNG compatibility
-    if img.mode != "RGB":
-      img = img.convert("RGB")
-
-    # Save the image as PNG with optimal quality (same folder)
-    img.save(output_path, "PNG", quality=100)  # Adjust quality as needed
-    # print(f"Converted: {input_path} -> {output_path}")
+    # Open the image using Pillow (only the header is read until the pixels are needed)
+    with Image.open(input_path) as img:
+      # Already what the archive expects: nothing to re-encode
+      if not needs_normalising(img) and output_path == input_path:
+        return output_path
+
+      # The header check only sized the first page: size every page before writing any
+      pages = getattr(img, "n_frames", 1)
+      for number in range(pages):
+        img.seek(number)
+        if img.size[0] * img.size[1] > MAX_PIXELS:
+          return False
+
+      # Convert colour mode and drop the ICC profile in memory, then write each page once
+      for number, path in enumerate(page_paths(output_path, pages)):
+        img.seek(number)
+        archive_png(img, path, compress_level)
+        # print(f"Converted: {input_path} -> {path}")
 
     return output_path  # Indicate success
 
-  except (IOError, OSError) as e:
+  except (IOError, OSError, ValueError, EOFError, Image.DecompressionBombError) as e:
     # print(f"Error converting {filename}: {e}")
     return False  # Indicate error
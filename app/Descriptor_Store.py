@@ -0,0 +1,498 @@
+import os
+import json
+import hashlib
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; builds are then only serialised within a process
+    fcntl = None
+from Feature_Extraction import (
+    MATCH_SIZE,
+    FEATURE_ENGINES,
+    load_template,
+    extract_features,
+    descriptor_dtype,
+    match_profile,
+    profile_tag,
+)
+
+# Bump whenever the on-disk layout or the feature extraction changes
+STORE_VERSION = 3
+
+# Root directory holding one store per template folder
+STORE_ROOT = os.environ.get(
+    "CHECK_STORE_ROOT",
+    os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "DESCRIPTOR_STORE")),
+)
+
+# Seconds between checks of a template folder for added, changed or removed files
+REFRESH_INTERVAL = 60
+
+# On-disk type of SIFT descriptors: "uint8" (OpenCV's SIFT values are integers in 0..255, so
+# this is lossless at a quarter of the size) or "float32"; binary engines are always uint8
+DESCRIPTOR_FORMAT = os.environ.get("CHECK_DESCRIPTOR_FORMAT", "uint8")
+
+# Files written by a store build; older builds' files are removed
+BUILD_FILE_PREFIXES = ("descriptors", "keypoints", "flann")
+
+_stores = {}
+_store_locks = {}  # key -> lock held while that store is checked or built
+_stores_lock = threading.Lock()
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def resolve_template_folder(template_folder):
+    """
+    Resolves a template folder name (e.g. "INVOICES") relative to the repository root.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+
+    Returns:
+        str: Absolute path to the template folder.
+    """
+
+    current_script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.abspath(os.path.join(current_script_dir, "..", template_folder))
+
+
+def store_directory(template_folder, engine=None, profile=None):
+    """
+    Returns the directory that holds the stores of a template folder.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+        engine (str, optional): Feature engine; its descriptor store lives in a sub-directory.
+                                Without it, the folder-level directory (layout hashes) is returned.
+        profile (dict, optional): Matching profile; stores of other profiles than the squash
+                                  without a keypoint budget get their own sub-directory
+                                  (e.g. "sift-s384-m300-g4"). Defaults to the folder's profile.
+
+    Returns:
+        str: Absolute path to the store directory.
+    """
+
+    directory = os.path.join(STORE_ROOT, os.path.basename(resolve_template_folder(template_folder)))
+    if not engine:
+        return directory
+    tag = profile_tag(profile or match_profile(template_folder))
+    return os.path.join(directory, f"{engine}-{tag}" if tag else engine)
+
+
+def store_params(engine, profile=None):
+    """
+    Returns the parameters a descriptor store depends on; a mismatch forces a full rebuild.
+
+    Args:
+        engine (str): Feature engine name.
+        profile (dict, optional): Matching profile. Defaults to the default profile.
+
+    Returns:
+        dict: Detector name, matching image size and keypoint budget, and on-disk descriptor type.
+    """
+
+    profile = profile or match_profile()
+    return {
+        "detector": engine,
+        "size": list(MATCH_SIZE),
+        "profile": {key: profile[key] for key in ("size", "max_keypoints", "grid")},
+        "dtype": np.dtype(storage_dtype(engine)).name,
+    }
+
+
+def storage_dtype(engine):
+    """
+    Returns the type descriptors of an engine are stored as (see DESCRIPTOR_FORMAT).
+
+    Args:
+        engine (str): Feature engine name.
+
+    Returns:
+        type: np.uint8 or np.float32.
+    """
+
+    if FEATURE_ENGINES[engine]["binary"] or DESCRIPTOR_FORMAT == "uint8":
+        return np.uint8
+    return np.float32
+
+
+def _encode(descriptors, dtype):
+    # SIFT values are already whole numbers in 0..255; rounding only guards against other inputs
+    if dtype == np.uint8 and descriptors.dtype != np.uint8:
+        return np.clip(np.rint(descriptors), 0, 255).astype(np.uint8)
+    return descriptors.astype(dtype, copy=False)
+
+
+class DescriptorStore:
+    """
+    Read-only view over the stacked template descriptors of one template folder
+    and feature engine.
+
+    The descriptor and keypoint arrays are memory-mapped, so several worker
+    processes loading the same store share the pages through the OS cache.
+    Descriptors may be stored more compactly than they are matched (uint8 SIFT);
+    `descriptors_for` converts them on the way out.
+    """
+
+    def __init__(self, directory, manifest, descriptors, keypoints):
+        self.directory = directory
+        self.manifest = manifest
+        self.engine = manifest["params"]["detector"]
+        self.descriptors = descriptors  # (N, dim) stored descriptors of all templates stacked (see storage_dtype)
+        self.keypoints = keypoints  # (N, 2) float32 keypoint coordinates, in prepared-image pixels
+        self.profile = manifest["params"]["profile"]
+        self.match_dtype = descriptor_dtype(self.engine)
+        self._matching = None
+        self.names = [entry["name"] for entry in manifest["templates"]]
+        self._entries = {entry["name"]: entry for entry in manifest["templates"]}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    @property
+    def library_version(self):
+        """str: Fingerprint of the template files the store was built from."""
+        return self.manifest["library_version"]
+
+    def descriptors_for(self, name):
+        """
+        Returns the descriptors of a single template.
+
+        Args:
+            name (str): Template file name.
+
+        Returns:
+            np.ndarray: The (n, dim) descriptor rows of the template, in the type the engine is matched in.
+        """
+
+        entry = self._entries[name]
+        rows = self.descriptors[entry["offset"]:entry["offset"] + entry["count"]]
+        return rows if rows.dtype == self.match_dtype else rows.astype(self.match_dtype)
+
+    def matching_descriptors(self):
+        """
+        Returns every stacked descriptor in the type the engine is matched in (e.g. for a FLANN index).
+
+        For compactly stored descriptors this is a private, converted copy kept for the life of the store:
+        unlike the memory-mapped arrays it is not shared between processes, so every worker using
+        the "global" match mode holds its own float32 library (four times the uint8 store).
+
+        Returns:
+            np.ndarray: The (N, dim) descriptors.
+        """
+
+        if self._matching is None:
+            self._matching = (
+                self.descriptors if self.descriptors.dtype == self.match_dtype
+                else np.ascontiguousarray(self.descriptors, dtype=self.match_dtype)
+            )
+        return self._matching
+
+    def prepared_size(self, name):
+        """
+        Returns the size a template was prepared at, i.e. the frame of its keypoints.
+
+        Args:
+            name (str): Template file name.
+
+        Returns:
+            tuple: Width and height in pixels.
+        """
+
+        return tuple(self._entries[name]["prepared"])
+
+    def keypoints_for(self, name):
+        """
+        Returns the keypoint coordinates of a single template.
+
+        Args:
+            name (str): Template file name.
+
+        Returns:
+            np.ndarray: The (n, 2) keypoint coordinates of the template.
+        """
+
+        entry = self._entries[name]
+        return self.keypoints[entry["offset"]:entry["offset"] + entry["count"]]
+
+    def template_ids(self):
+        """
+        Returns the index of the owning template for every stacked descriptor row.
+
+        Returns:
+            np.ndarray: An int32 array of length N, indexing into `names`.
+        """
+
+        counts = [entry["count"] for entry in self.manifest["templates"]]
+        return np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+
+
+def _read_manifest(directory, engine, profile):
+    manifest_path = os.path.join(directory, "manifest.json")
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != STORE_VERSION or manifest.get("params") != store_params(engine, profile):
+        return None
+    return manifest
+
+
+def _remove_builds(directory, keep=None, superseded_before=None):
+    # Drop files of superseded builds (processes still mapping them keep their pages). Temporary
+    # files belong to writes still in flight, and files written after the current manifest
+    # (e.g. a FLANN index saved by a reader of the previous build) are left for the next build.
+    for filename in os.listdir(directory):
+        if filename.split("-")[0] not in BUILD_FILE_PREFIXES or filename.endswith(".tmp"):
+            continue
+        if keep is not None and keep in filename:
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            if superseded_before is None or os.stat(path).st_mtime <= superseded_before:
+                os.remove(path)
+        except FileNotFoundError:
+            pass  # Removed by another process meanwhile
+
+
+@contextmanager
+def _build_lock(directory):
+    # Serialises check-and-build of a store across processes (gunicorn or Batch_Check workers).
+    # flock locks are per open file, so this must not be nested within one process.
+    with open(os.path.join(directory, ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _load_arrays(directory, manifest):
+    token = manifest["arrays"]
+    descriptors = np.load(os.path.join(directory, f"descriptors-{token}.npy"), mmap_mode="r")
+    keypoints = np.load(os.path.join(directory, f"keypoints-{token}.npy"), mmap_mode="r")
+    return descriptors, keypoints
+
+
+def _scan_folder(folder):
+    files = {}
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(".png"):
+            stat = os.stat(os.path.join(folder, filename))
+            files[filename] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return files
+
+
+def _library_version(files):
+    digest = hashlib.sha1()
+    for name, info in sorted(files.items()):
+        digest.update(f"{name}:{info['size']}:{info['mtime_ns']};".encode())
+    return digest.hexdigest()[:16]
+
+
+def _save_array(path, array):
+    # Write through a temporary file so readers never observe a partial array
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def build_descriptor_store(template_folder, force=False, engine="sift", profile=None):
+    """
+    Builds or incrementally updates the descriptor store of a template folder.
+
+    Descriptors of templates whose size and modification time are unchanged are
+    copied from the previous store; only new or modified templates are decoded
+    and run through the feature engine. Nothing is written if the folder did not change.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+        force (bool, optional): Recompute every template even if unchanged. Defaults to False.
+        engine (str, optional): Feature engine, see `Feature_Extraction.FEATURE_ENGINES`. Defaults to "sift".
+        profile (dict, optional): Matching profile, see `Feature_Extraction.match_profile`.
+                                  Defaults to the folder's profile.
+
+    Returns:
+        dict: The manifest of the up-to-date store.
+    """
+
+    profile = profile or match_profile(template_folder)
+    directory = store_directory(template_folder, engine, profile)
+    os.makedirs(directory, exist_ok=True)
+    with _build_lock(directory):
+        return _update_store(template_folder, directory, force, engine, profile)
+
+
+def _update_store(template_folder, directory, force, engine, profile):
+    # Caller holds the build lock of `directory`
+    folder = resolve_template_folder(template_folder)
+    dim, dtype = FEATURE_ENGINES[engine]["dim"], storage_dtype(engine)
+
+    files = _scan_folder(folder)
+    library_version = _library_version(files)
+
+    old_manifest = None if force else _read_manifest(directory, engine, profile)
+    if old_manifest is not None and old_manifest["library_version"] == library_version:
+        return old_manifest
+
+    old_entries, old_descriptors, old_keypoints = {}, None, None
+    if old_manifest is not None:
+        old_entries = {entry["name"]: entry for entry in old_manifest["templates"]}
+        old_descriptors, old_keypoints = _load_arrays(directory, old_manifest)
+
+    descriptor_blocks, keypoint_blocks, entries = [], [], []
+    offset = 0
+    for name, info in files.items():
+        old = old_entries.get(name)
+        if old is not None and old["size"] == info["size"] and old["mtime_ns"] == info["mtime_ns"]:
+            # Unchanged template: reuse its rows from the previous store
+            des = np.array(old_descriptors[old["offset"]:old["offset"] + old["count"]])
+            pts = np.array(old_keypoints[old["offset"]:old["offset"] + old["count"]])
+            prepared = old["prepared"]
+        else:
+            template = load_template(os.path.join(folder, name), profile)
+            if template is None:
+                continue  # Undecodable file, leave it out of the store
+            kp, des = extract_features(template, engine, profile)
+            if des is None:
+                des = np.empty((0, dim), dtype=dtype)
+            pts = np.array([p.pt for p in kp], dtype=np.float32).reshape(-1, 2)
+            prepared = [template.shape[1], template.shape[0]]
+
+        descriptor_blocks.append(_encode(des, dtype))
+        keypoint_blocks.append(pts)
+        entries.append(dict(name=name, offset=offset, count=len(des), prepared=prepared, **info))
+        offset += len(des)
+
+    descriptors = (
+        np.concatenate(descriptor_blocks) if descriptor_blocks
+        else np.empty((0, dim), dtype=dtype)
+    )
+    keypoints = (
+        np.concatenate(keypoint_blocks) if keypoint_blocks
+        else np.empty((0, 2), dtype=np.float32)
+    )
+
+    token = uuid.uuid4().hex[:12]
+    _save_array(os.path.join(directory, f"descriptors-{token}.npy"), descriptors)
+    _save_array(os.path.join(directory, f"keypoints-{token}.npy"), keypoints)
+
+    manifest = {
+        "version": STORE_VERSION,
+        "params": store_params(engine, profile),
+        "created": time.time(),
+        "library_version": library_version,
+        "arrays": token,
+        "templates": entries,
+    }
+    tmp_path = os.path.join(directory, f"manifest.json.{token}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(directory, "manifest.json"))
+
+    _remove_builds(directory, keep=token, superseded_before=manifest["created"])
+    # Stores of STORE_VERSION 1 lived directly in the folder-level directory
+    _remove_builds(store_directory(template_folder), superseded_before=manifest["created"])
+    legacy_manifest = os.path.join(store_directory(template_folder), "manifest.json")
+    if os.path.isfile(legacy_manifest):
+        os.remove(legacy_manifest)
+
+    return manifest
+
+
+def current_library_version(template_folder, refresh_interval=REFRESH_INTERVAL):
+    """
+    Returns the fingerprint of the template files currently in a folder.
+
+    Unlike `DescriptorStore.library_version` this only stats the files, so it can
+    be used to validate cached results without loading the store.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+        refresh_interval (float, optional): Seconds between re-scans of the folder. Defaults to REFRESH_INTERVAL.
+
+    Returns:
+        str: The library version.
+    """
+
+    folder = resolve_template_folder(template_folder)
+    with _versions_lock:
+        cached = _versions.get(folder)
+        if cached is None or time.monotonic() - cached[0] >= refresh_interval:
+            cached = (time.monotonic(), _library_version(_scan_folder(folder)))
+            _versions[folder] = cached
+        return cached[1]
+
+
+def get_descriptor_store(template_folder, refresh_interval=REFRESH_INTERVAL, engine="sift", profile=None):
+    """
+    Returns the loaded descriptor store of a template folder, building it if needed.
+
+    Stores are cached per process, engine and profile; the template folder is
+    re-scanned for changes at most once every `refresh_interval` seconds.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+        refresh_interval (float, optional): Seconds between change checks. Defaults to REFRESH_INTERVAL.
+        engine (str, optional): Feature engine, see `Feature_Extraction.FEATURE_ENGINES`. Defaults to "sift".
+        profile (dict, optional): Matching profile (e.g. a coarse pyramid level). Defaults to the folder's profile.
+
+    Returns:
+        DescriptorStore: The loaded store.
+    """
+
+    profile = profile or match_profile(template_folder)
+    key = (resolve_template_folder(template_folder), engine, profile_tag(profile))
+    with _stores_lock:
+        cached = _stores.get(key)
+        if cached is not None and time.monotonic() - cached[0] < refresh_interval:
+            return cached[1]
+        key_lock = _store_locks.setdefault(key, threading.Lock())
+
+    # A (possibly minutes long) build only holds up callers of the same store
+    with key_lock:
+        with _stores_lock:
+            cached = _stores.get(key)
+        if cached is not None and time.monotonic() - cached[0] < refresh_interval:
+            return cached[1]  # Refreshed by another thread while this one waited
+
+        directory = store_directory(template_folder, engine, profile)
+        os.makedirs(directory, exist_ok=True)
+        # Arrays are opened under the build lock too, so another process cannot supersede
+        # and remove them between reading the manifest and mapping them
+        with _build_lock(directory):
+            manifest = _update_store(template_folder, directory, False, engine, profile)
+            if cached is not None and cached[1].manifest["arrays"] == manifest["arrays"]:
+                store = cached[1]
+            else:
+                store = DescriptorStore(directory, manifest, *_load_arrays(directory, manifest))
+        with _stores_lock:
+            _stores[key] = (time.monotonic(), store)
+        return store
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Build (or refresh) the stores of every bundled template library,
+    # for the engines given on the command line (default: sift)
+    for engine in sys.argv[1:] or ["sift"]:
+        for folder in ("INVOICES", "PRESCRIPTIONS", "LABREPORTS"):
+            start = time.perf_counter()
+            store = get_descriptor_store(folder, engine=engine)
+            print(
+                f"{folder} [{os.path.basename(store.directory)}]: {len(store)} templates, {len(store.descriptors)} descriptors, "
+                f"{store.descriptors.nbytes / 1e6:.1f} MB as {store.descriptors.dtype} "
+                f"({time.perf_counter() - start:.1f}s)"
+            )
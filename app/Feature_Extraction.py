@@ -0,0 +1,228 @@
+import os
+import cv2
+import numpy as np
+
+# Dimensions every image is squashed to before feature extraction (unless a profile sets "size")
+MATCH_SIZE = (256, 256)
+
+# Default matching profile:
+#   size          - longest side the image is scaled to, keeping its aspect ratio
+#                   (0: squash to MATCH_SIZE, the historical behaviour)
+#   max_keypoints - keypoints kept per image, strongest first (0: all)
+#   grid          - spread the kept keypoints over a grid x grid layout of cells (0: no grid)
+#   pyramid       - longest side of the coarse level the "pyramid" match mode compares first
+MATCH_PROFILE = {
+    "size": int(os.environ.get("CHECK_MATCH_SIZE", 0)),
+    "max_keypoints": int(os.environ.get("CHECK_MAX_KEYPOINTS", 0)),
+    "grid": int(os.environ.get("CHECK_KEYPOINT_GRID", 0)),
+    "pyramid": int(os.environ.get("CHECK_MATCH_PYRAMID", 128)),
+}
+
+# The historical squash to MATCH_SIZE, whatever the configured default (e.g. for layout hashes)
+SQUASH_PROFILE = {"size": 0, "max_keypoints": 0, "grid": 0, "pyramid": 0}
+
+# Profile overrides per template folder, i.e. per document type, e.g.
+# {"INVOICES": {"size": 384, "max_keypoints": 300, "grid": 4}}; missing keys come from MATCH_PROFILE
+MATCH_PROFILES = {}
+
+# Feature engines: how to create the detector, whether its descriptors are binary
+# (matched by Hamming distance instead of L2) and the descriptor length
+FEATURE_ENGINES = {
+    "sift": {"create": lambda: cv2.SIFT_create(), "binary": False, "dim": 128},  # type: ignore
+    "orb": {"create": lambda: cv2.ORB_create(nfeatures=500), "binary": True, "dim": 32},
+    "akaze": {"create": lambda: cv2.AKAZE_create(), "binary": True, "dim": 61},
+}
+
+
+def match_profile(template_folder=None, **overrides):
+    """
+    Returns the complete matching profile of a template folder.
+
+    Args:
+        template_folder (str, optional): Name or path of the template folder; None for the default profile.
+        **overrides: Profile keys replacing the folder's values.
+
+    Returns:
+        dict: "size", "max_keypoints", "grid" and "pyramid" (see MATCH_PROFILE).
+    """
+
+    profile = dict(MATCH_PROFILE)
+    if template_folder is not None:
+        profile.update(MATCH_PROFILES.get(os.path.basename(os.path.normpath(template_folder)), {}))
+    profile.update(overrides)
+    return profile
+
+
+def coarse_profile(profile):
+    """
+    Returns the profile of the coarse pyramid level of a profile.
+
+    Args:
+        profile (dict): A complete profile.
+
+    Returns:
+        dict: The same keypoint budget at the "pyramid" size, without a further level.
+    """
+
+    return dict(profile, size=profile["pyramid"], pyramid=0)
+
+
+def profile_tag(profile):
+    """
+    Returns a short name for a profile, e.g. "s384-m300-g4"; "" for the squash without a budget.
+
+    Args:
+        profile (dict): A complete profile.
+
+    Returns:
+        str: The tag, used to keep the stores of different profiles apart.
+    """
+
+    keys = ("size", "max_keypoints", "grid") if profile["max_keypoints"] else ("size",)
+    return "-".join(f"{key[0]}{profile[key]}" for key in keys if profile[key])
+
+
+def prepared_size(shape, profile=None):
+    """
+    Returns the (width, height) an image is resized to for feature matching.
+
+    Args:
+        shape (tuple): Shape of the decoded image.
+        profile (dict, optional): Matching profile. Defaults to the default profile.
+
+    Returns:
+        tuple: Width and height in pixels.
+    """
+
+    size = (profile or MATCH_PROFILE)["size"]
+    if not size:
+        return MATCH_SIZE
+    height, width = shape[:2]
+    scale = size / max(height, width)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_image(image, profile=None):
+    """
+    Converts a decoded image to the grayscale form used for feature matching.
+
+    Args:
+        image (np.ndarray): The image as a NumPy array (grayscale or BGR).
+        profile (dict, optional): Matching profile (see `match_profile`). Defaults to the default profile.
+
+    Returns:
+        np.ndarray: Grayscale image squashed to MATCH_SIZE, or scaled to the profile's
+                    size with its aspect ratio kept.
+    """
+
+    # Convert to grayscale if the image still has colour channels
+    if len(image.shape) == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    # Resize the image to the matching dimensions
+    size = prepared_size(image.shape, profile)
+    if not (profile or MATCH_PROFILE)["size"]:
+        return cv2.resize(image, size)
+    # Aspect-preserving sizes are mostly downscales of full pages, where area averaging keeps thin strokes
+    interpolation = cv2.INTER_AREA if size[0] < image.shape[1] else cv2.INTER_LINEAR
+    return cv2.resize(image, size, interpolation=interpolation)
+
+
+def load_template(template_path, profile=None):
+    """
+    Reads a template image from disk and prepares it for feature matching.
+    Unlike `Template_Matching.preprocess_image`, the file on disk is never rewritten.
+
+    Args:
+        template_path (str): Path to the template image file.
+        profile (dict, optional): Matching profile. Defaults to the default profile.
+
+    Returns:
+        np.ndarray or None: The prepared image, or None if the file could not be decoded.
+    """
+
+    image = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    return prepare_image(image, profile)
+
+
+def descriptor_dtype(engine):
+    """
+    Returns the NumPy type of an engine's descriptors.
+
+    Args:
+        engine (str): Feature engine name (see FEATURE_ENGINES).
+
+    Returns:
+        type: np.uint8 for binary descriptors, np.float32 otherwise.
+    """
+
+    return np.uint8 if FEATURE_ENGINES[engine]["binary"] else np.float32
+
+
+def select_keypoints(keypoints, shape, max_keypoints, grid=0):
+    """
+    Keeps the strongest keypoints, optionally spread evenly over a grid.
+
+    With a grid, every cell keeps its strongest `max_keypoints / grid**2`
+    keypoints first, so text-dense areas cannot use up the whole budget; the
+    quota left by sparse cells goes to the strongest remaining keypoints.
+
+    Args:
+        keypoints (list): Detected cv2.KeyPoint objects.
+        shape (tuple): Shape of the image they were detected in.
+        max_keypoints (int): Keypoints to keep.
+        grid (int, optional): Cells per side (0: no grid). Defaults to 0.
+
+    Returns:
+        list: The kept keypoints, strongest first.
+    """
+
+    ranked = sorted(keypoints, key=lambda kp: -kp.response)
+    if len(ranked) <= max_keypoints:
+        return ranked
+    if not grid:
+        return ranked[:max_keypoints]
+
+    height, width = shape[:2]
+    quota = max(1, max_keypoints // (grid * grid))
+    per_cell, kept, rest = {}, [], []
+    for kp in ranked:
+        cell = (min(grid - 1, int(kp.pt[1] * grid / height)), min(grid - 1, int(kp.pt[0] * grid / width)))
+        if per_cell.get(cell, 0) < quota:
+            per_cell[cell] = per_cell.get(cell, 0) + 1
+            kept.append(kp)
+        else:
+            rest.append(kp)
+    kept.extend(rest[:max_keypoints - len(kept)])
+    return sorted(kept[:max_keypoints], key=lambda kp: -kp.response)
+
+
+def extract_features(image, engine="sift", profile=None):
+    """
+    Detects keypoints and computes their descriptors.
+
+    Args:
+        image (np.ndarray): The prepared grayscale image.
+        engine (str, optional): Feature engine, "sift", "orb" or "akaze" (default: "sift").
+        profile (dict, optional): Matching profile; its "max_keypoints" and "grid" bound the
+                                  keypoints kept. Defaults to the default profile.
+
+    Returns:
+        tuple: A tuple containing two elements:
+            - The list of detected cv2.KeyPoint objects.
+            - The descriptors as a NumPy array, float32 for SIFT and uint8 for the
+              binary engines (or None if no keypoints were found).
+    """
+
+    profile = profile or MATCH_PROFILE
+    detector = FEATURE_ENGINES[engine]["create"]()
+    if not profile["max_keypoints"]:
+        return detector.detectAndCompute(image, None)
+
+    # Describe only the keypoints within the budget, so every comparison costs about the same
+    keypoints = select_keypoints(detector.detect(image, None), image.shape, profile["max_keypoints"], profile["grid"])
+    if not keypoints:
+        return (), None
+    return detector.compute(image, keypoints)
@@ -0,0 +1,200 @@
+import os
+import json
+import threading
+import cv2
+import numpy as np
+from Feature_Extraction import MATCH_SIZE
+from Descriptor_Store import resolve_template_folder
+from Template_Matching import find_good_matches
+
+# OCR only the field regions of the matched template (1) or always the full page (0)
+ROI_OCR_ENABLED = os.environ.get("CHECK_ROI_OCR", "1") == "1"
+
+# Let a keyword pass on the field regions alone accept the page (1), skipping full-page OCR,
+# or only read the fields of pages the full-page OCR accepted (0). The crops are OCR'd on
+# their own, so their text is not a subset of the page text and a field pass does not imply
+# a full-page pass; enable this only after measuring its false-accept rate on real uploads
+ROI_OCR_DECIDES = os.environ.get("CHECK_ROI_DECIDES", "0") == "1"
+
+# RANSAC inliers needed before the upload is trusted to be aligned with the template
+MIN_INLIERS = int(os.environ.get("CHECK_ROI_MIN_INLIERS", 12))
+
+# RANSAC reprojection tolerance, in prepared-image pixels
+RANSAC_THRESHOLD = 3.0
+
+# Padding added around every region (fraction of the page) to absorb alignment error
+REGION_MARGIN = 0.02
+
+# Per-template regions, optional, in the template folder: {"<template>.png": {field: box}, "*": {...}}
+FIELDS_FILE = "fields.json"
+
+# Default field regions per document type as [left, top, right, bottom] fractions of
+# the template page, used for templates without an entry in FIELDS_FILE
+FIELD_REGIONS = {
+    "invoice": {
+        "number_and_date": [0.0, 0.0, 1.0, 0.3],
+        "amount": [0.4, 0.35, 1.0, 0.8],
+    },
+    "prescription": {
+        "doctor": [0.0, 0.0, 1.0, 0.25],
+        "patient": [0.0, 0.2, 1.0, 0.45],
+    },
+    "labreport": {
+        "title": [0.0, 0.0, 1.0, 0.2],
+        "patient": [0.0, 0.15, 1.0, 0.4],
+    },
+}
+
+_field_files = {}
+_field_files_lock = threading.Lock()
+
+
+def load_field_regions(template_folder):
+    """
+    Reads the per-template field regions of a template folder, if it has any.
+
+    The file is re-read whenever its modification time changes.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+
+    Returns:
+        dict: Template file name (or "*" for the folder default) -> {field: box}.
+    """
+
+    path = os.path.join(resolve_template_folder(template_folder), FIELDS_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    with _field_files_lock:
+        cached = _field_files.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path) as f:
+                cached = (mtime, json.load(f))
+            _field_files[path] = cached
+        return cached[1]
+
+
+def field_regions(document_type, template_folder, template_name):
+    """
+    Returns the field regions to read for a matched template.
+
+    Args:
+        document_type (str): The type of document.
+        template_folder (str): Name or path of the template folder.
+        template_name (str): File name of the matched template.
+
+    Returns:
+        dict: Field name -> [left, top, right, bottom] fractions of the template page.
+    """
+
+    regions = load_field_regions(template_folder)
+    return regions.get(template_name) or regions.get("*") or FIELD_REGIONS.get(document_type, {})
+
+
+def estimate_homography(image_points, image_descriptors, template_points, template_descriptors,
+                        engine="sift", min_inliers=MIN_INLIERS, image_size=MATCH_SIZE, template_size=MATCH_SIZE):
+    """
+    Estimates the perspective transform from an upload to a template with RANSAC.
+
+    Both point sets are in the pixels of their prepared images (see `Feature_Extraction.prepare_image`),
+    as stored in the descriptor store.
+
+    Args:
+        image_points (np.ndarray): (n, 2) keypoint coordinates of the upload.
+        image_descriptors (np.ndarray): Descriptors of the upload.
+        template_points (np.ndarray): (m, 2) keypoint coordinates of the template.
+        template_descriptors (np.ndarray): Descriptors of the template.
+        engine (str, optional): Feature engine of both descriptor sets. Defaults to "sift".
+        min_inliers (int, optional): Inliers needed for a usable transform. Defaults to MIN_INLIERS.
+        image_size (tuple, optional): (width, height) of the prepared upload. Defaults to MATCH_SIZE.
+        template_size (tuple, optional): (width, height) of the prepared template. Defaults to MATCH_SIZE.
+
+    Returns:
+        tuple: The 3x3 homography (None if the images could not be aligned) and the inlier count.
+    """
+
+    matches = find_good_matches(image_descriptors, template_descriptors, engine)
+    if len(matches) < max(4, min_inliers):
+        return None, 0
+
+    source = np.float32([image_points[m.queryIdx] for m in matches]).reshape(-1, 1, 2)
+    target = np.float32([template_points[m.trainIdx] for m in matches]).reshape(-1, 1, 2)
+    homography, mask = cv2.findHomography(source, target, cv2.RANSAC, RANSAC_THRESHOLD)
+    if homography is None:
+        return None, 0
+    inliers = int(mask.sum())
+    if inliers < min_inliers:
+        return None, inliers
+
+    # Reject degenerate fits: the upload must map onto a convex page of plausible size
+    width, height = image_size
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]]).reshape(-1, 1, 2)
+    projected = cv2.perspectiveTransform(corners, homography)
+    area = cv2.contourArea(projected)
+    if not cv2.isContourConvex(projected) or not 0.25 <= area / (template_size[0] * template_size[1]) <= 4:
+        return None, inliers
+    return homography, inliers
+
+
+def crop_fields(image, homography, regions, image_size=MATCH_SIZE, template_size=MATCH_SIZE, margin=REGION_MARGIN):
+    """
+    Cuts the field regions out of an upload, aligned to the template page.
+
+    Each region is warped directly from the full-resolution upload, so only the
+    pixels that will be read are resampled.
+
+    Args:
+        image (np.ndarray): The decoded upload.
+        homography (np.ndarray): Upload -> template transform from `estimate_homography`.
+        regions (dict): Field name -> [left, top, right, bottom] fractions of the template page.
+        image_size (tuple, optional): (width, height) of the prepared upload. Defaults to MATCH_SIZE.
+        template_size (tuple, optional): (width, height) of the prepared template. Defaults to MATCH_SIZE.
+        margin (float, optional): Padding around each region. Defaults to REGION_MARGIN.
+
+    Returns:
+        dict: Field name -> aligned crop (np.ndarray).
+    """
+
+    height, width = image.shape[:2]
+    # Upload pixels -> prepared upload -> prepared template -> template page at the upload's resolution
+    to_match = np.diag([image_size[0] / width, image_size[1] / height, 1.0])
+    to_page = np.diag([width / template_size[0], height / template_size[1], 1.0])
+    transform = to_page @ homography @ to_match
+
+    crops = {}
+    for name, (left, top, right, bottom) in regions.items():
+        x0 = int(max(0.0, left - margin) * width)
+        y0 = int(max(0.0, top - margin) * height)
+        x1 = int(min(1.0, right + margin) * width)
+        y1 = int(min(1.0, bottom + margin) * height)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            continue
+        shift = np.array([[1.0, 0.0, -x0], [0.0, 1.0, -y0], [0.0, 0.0, 1.0]])
+        crops[name] = cv2.warpPerspective(
+            image, shift @ transform, (x1 - x0, y1 - y0),
+            flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255),
+        )
+    return crops
+
+
+def region_area(regions, margin=REGION_MARGIN):
+    """
+    Returns the share of the page covered by a set of regions (overlaps counted once).
+
+    Args:
+        regions (dict): Field name -> [left, top, right, bottom] fractions of the page.
+        margin (float, optional): Padding around each region. Defaults to REGION_MARGIN.
+
+    Returns:
+        float: Covered fraction of the page, between 0 and 1.
+    """
+
+    mask = np.zeros((100, 100), dtype=bool)
+    for left, top, right, bottom in regions.values():
+        mask[
+            int(max(0.0, top - margin) * 100):int(np.ceil(min(1.0, bottom + margin) * 100)),
+            int(max(0.0, left - margin) * 100):int(np.ceil(min(1.0, right + margin) * 100)),
+        ] = True
+    return float(mask.mean())
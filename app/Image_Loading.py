@@ -0,0 +1,130 @@
+import io
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def _decode_with_pillow(data):
+    # Fallback for formats OpenCV cannot read (e.g. GIF); keeps the first frame
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def decode_image(source):
+    """
+    Decodes an image once into the BGR NumPy array consumed by every pipeline stage.
+
+    Args:
+        source: A file path (str), the encoded file contents (bytes), or an already
+                decoded image (np.ndarray, grayscale or BGR).
+
+    Returns:
+        np.ndarray or None: The decoded BGR image, or None if it could not be decoded.
+    """
+
+    if isinstance(source, np.ndarray):
+        if len(source.shape) == 2:
+            return cv2.cvtColor(source, cv2.COLOR_GRAY2BGR)
+        return source
+
+    if isinstance(source, str):
+        try:
+            with open(source, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+    else:
+        data = bytes(source)
+
+    if not data:
+        return None
+
+    # OpenCV ignores embedded ICC profiles, so no metadata stripping is needed here
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        image = _decode_with_pillow(data)
+    return image
+
+
+def count_pages(source):
+    """
+    Returns the number of pages (or frames) of an encoded image, read from its header.
+
+    Args:
+        source: A file path (str), the encoded file contents (bytes), or a decoded image (np.ndarray).
+
+    Returns:
+        int: The page count; 1 for decoded images, for files Pillow cannot open and for
+             images past Pillow's decompression bomb limit (left to `Upload_Intake.inspect_image`).
+    """
+
+    if isinstance(source, np.ndarray):
+        return 1
+    try:
+        with Image.open(source if isinstance(source, str) else io.BytesIO(bytes(source))) as img:
+            return getattr(img, "n_frames", 1)
+    except (IOError, OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+        return 1
+
+
+def _frame_to_bgr(img):
+    # Bilevel fax pages, palettes and greyscale all become BGR like single-page uploads
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+
+
+def iter_pages(source, max_pages=None, max_pixels=None):
+    """
+    Decodes the pages of a multi-page TIFF or the frames of an animated GIF/WebP one at a time.
+
+    Only the page being yielded is held decoded, so memory stays at about one page
+    whatever the page count. Single-page images are decoded like `decode_image`, so
+    untrusted files must pass `Upload_Intake.inspect_image` first.
+
+    Args:
+        source: A file path (str), the encoded file contents (bytes), or a decoded image (np.ndarray).
+        max_pages (int, optional): Stop after this many pages. Defaults to all of them.
+        max_pixels (int, optional): Pages larger than this are not decoded (a header check
+                                    only covers the first page). Defaults to no limit.
+
+    Yields:
+        np.ndarray or None: The BGR image of each page in order (None if a page cannot be
+                            decoded or is too large).
+    """
+
+    if count_pages(source) == 1:
+        yield decode_image(source)
+        return
+
+    with Image.open(source if isinstance(source, str) else io.BytesIO(bytes(source))) as img:
+        pages = img.n_frames if max_pages is None else min(img.n_frames, max_pages)
+        for number in range(pages):
+            try:
+                img.seek(number)
+                width, height = img.size
+                page = None if max_pixels and width * height > max_pixels else _frame_to_bgr(img)
+            except (IOError, OSError, ValueError, EOFError, Image.DecompressionBombError):
+                page = None
+            yield page
+
+
+def to_grayscale(image):
+    """
+    Returns a grayscale view of a decoded image.
+
+    Args:
+        image (np.ndarray): Grayscale or BGR image.
+
+    Returns:
+        np.ndarray: Single-channel image.
+    """
+
+    if len(image.shape) == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
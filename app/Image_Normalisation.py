@@ -0,0 +1,115 @@
+import os
+import threading
+import cv2
+import numpy as np
+
+# zlib level of archived PNGs: 1 is several times faster to write than Pillow's default 6
+# for a few percent larger files (0 stores uncompressed, 9 is the smallest and slowest)
+ARCHIVE_COMPRESS_LEVEL = int(os.environ.get("CHECK_ARCHIVE_COMPRESSION", 1))
+
+
+def strip_icc_profile(img):
+    """
+    Returns a Pillow image without its embedded ICC profile, keeping its colour mode.
+
+    Args:
+        img (PIL.Image.Image): The opened image; it is not modified.
+
+    Returns:
+        PIL.Image.Image: A copy without the profile; `img` itself when it has none.
+    """
+
+    if "icc_profile" in img.info:
+        img = img.copy()  # The copy gets its own metadata dict
+        img.info.pop("icc_profile")
+    return img
+
+
+def normalise_image(img):
+    """
+    Brings a Pillow image to the form every stage expects, in memory.
+
+    The colour mode is converted to RGB and the embedded ICC profile dropped
+    (OpenCV ignores it anyway), so nothing has to be rewritten on disk first.
+
+    Args:
+        img (PIL.Image.Image): The opened image (for multi-frame files, the current frame); it is not modified.
+
+    Returns:
+        PIL.Image.Image: An RGB image without an ICC profile; `img` itself when it already is one.
+    """
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")  # The converted copy carries over (a copy of) the metadata
+        img.info.pop("icc_profile", None)
+        return img
+    return strip_icc_profile(img)
+
+
+def needs_normalising(img):
+    """
+    Tells whether an opened file would change when normalised to an RGB PNG.
+
+    Args:
+        img (PIL.Image.Image): The opened image.
+
+    Returns:
+        bool: False for single-frame RGB PNGs without an ICC profile.
+    """
+
+    return (
+        img.format != "PNG"
+        or img.mode != "RGB"
+        or "icc_profile" in img.info
+        or getattr(img, "n_frames", 1) > 1
+    )
+
+
+def archive_png(image, output_path, compress_level=ARCHIVE_COMPRESS_LEVEL, keep_mode=False):
+    """
+    Writes an image to disk as a PNG for archival, with fast compression.
+
+    The file is written under a temporary name and renamed, so a reader never
+    sees a partial PNG.
+
+    Args:
+        image (PIL.Image.Image or np.ndarray): A Pillow image, or a decoded BGR/grayscale array.
+        output_path (str): Destination path.
+        compress_level (int, optional): zlib level 0-9. Defaults to ARCHIVE_COMPRESS_LEVEL.
+        keep_mode (bool, optional): Keep a Pillow image's colour mode (grayscale, palette, alpha)
+                                    and only drop its ICC profile, instead of normalising it to RGB.
+                                    Defaults to False.
+
+    Returns:
+        int: Bytes written.
+    """
+
+    temporary = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if isinstance(image, np.ndarray):
+        ok, encoded = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, compress_level])
+        if not ok:
+            raise OSError(f"cannot encode image for {output_path}")
+        with open(temporary, "wb") as f:
+            f.write(encoded.tobytes())
+    else:
+        image = strip_icc_profile(image) if keep_mode else normalise_image(image)
+        image.save(temporary, "PNG", compress_level=compress_level)
+    os.replace(temporary, output_path)
+    return os.path.getsize(output_path)
+
+
+def page_paths(output_path, pages):
+    """
+    Returns the archive paths of a document's pages: `output_path` for the first
+    page and `<base>-<n>.png` for page n > 1.
+
+    Args:
+        output_path (str): Path of the first page's PNG.
+        pages (int): Page count.
+
+    Returns:
+        list: One path per page.
+    """
+
+    base, ext = os.path.splitext(output_path)
+    return [output_path] + [f"{base}-{number}{ext}" for number in range(2, pages + 1)]
@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Log one line per CHECK with the duration of every span it went through (CHECK_TRACE=1)
+TRACE_ENABLED = os.environ.get("CHECK_TRACE", "0") == "1"
+
+# Histogram buckets
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+logger = logging.getLogger("document_check.trace")
+if TRACE_ENABLED and not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+_metrics = {}  # name -> metric, in registration order
+_metrics_lock = threading.Lock()
+
+# Spans and attributes of the CHECK running in the current thread, if any
+_trace = contextvars.ContextVar("check_trace", default=None)
+
+
+def _label_text(labelnames, labels):
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(labelnames, labels)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """
+    A monotonically increasing Prometheus counter with optional labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Increases the counter.
+
+        Args:
+            amount (float, optional): Increment. Defaults to 1.
+            **labels: One value per label name.
+        """
+
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name + _label_text(self.labelnames, key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """
+    A cumulative-bucket Prometheus histogram with optional labels.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=SECONDS_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Records one observation.
+
+        Args:
+            value (float): The observed value.
+            **labels: One value per label name.
+        """
+
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            values[index] += 1
+            values[-1] += value
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            items = [(key, list(values)) for key, values in self._values.items()]
+        for key, values in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                labels = _label_text(self.labelnames + ("le",), key + (bound,))
+                lines.append((f"{self.name}_bucket{labels}", cumulative))
+            labels = _label_text(self.labelnames, key)
+            lines.append((f"{self.name}_sum{labels}", values[-1]))
+            lines.append((f"{self.name}_count{labels}", cumulative))
+        return lines
+
+
+class Gauge:
+    """
+    A Prometheus gauge (or counter kept elsewhere) whose value is read from a callback at scrape time.
+    """
+
+    def __init__(self, name, documentation, function, kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.kind = kind
+
+    def samples(self):
+        try:
+            return [(self.name, float(self.function()))]
+        except Exception:
+            return []  # A failing callback must not break the whole scrape
+
+
+def _register(metric):
+    with _metrics_lock:
+        return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name, documentation, labelnames=()):
+    """
+    Returns the counter registered under `name`, creating it on first use.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): Help text.
+        labelnames (tuple, optional): Label names.
+
+    Returns:
+        Counter: The registered counter.
+    """
+
+    return _register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, buckets=SECONDS_BUCKETS, labelnames=()):
+    """
+    Returns the histogram registered under `name`, creating it on first use.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): Help text.
+        buckets (tuple, optional): Upper bucket bounds. Defaults to SECONDS_BUCKETS.
+        labelnames (tuple, optional): Label names.
+
+    Returns:
+        Histogram: The registered histogram.
+    """
+
+    return _register(Histogram(name, documentation, buckets, labelnames))
+
+
+def gauge(name, documentation, function, kind="gauge"):
+    """
+    Registers a gauge read from `function` whenever metrics are rendered.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): Help text.
+        function (callable): Returns the current value.
+        kind (str, optional): "gauge", or "counter" for totals kept by another component. Defaults to "gauge".
+
+    Returns:
+        Gauge: The registered gauge.
+    """
+
+    return _register(Gauge(name, documentation, function, kind))
+
+
+STAGE_SECONDS = histogram(
+    "document_check_stage_seconds", "Time spent in each stage of CHECK.", labelnames=("stage",)
+)
+CHECK_SECONDS = histogram(
+    "document_check_duration_seconds", "End-to-end duration of CHECK.", labelnames=("document_type",)
+)
+CHECKS = counter(
+    "document_check_results_total", "CHECK verdicts.", labelnames=("document_type", "result", "cached")
+)
+REJECTIONS = counter(
+    "document_check_rejections_total", "CHECK rejections by reason.", labelnames=("stage", "reason")
+)
+TEMPLATES_COMPARED = histogram(
+    "document_check_templates_compared", "Templates SIFT-compared per image.", buckets=COUNT_BUCKETS
+)
+KEYPOINTS = histogram(
+    "document_check_keypoints", "Keypoints extracted per image.", buckets=COUNT_BUCKETS, labelnames=("engine",)
+)
+OCR_TEXT_LENGTH = histogram(
+    "document_check_ocr_text_characters", "Characters of text extracted by OCR per image.", buckets=COUNT_BUCKETS
+)
+
+
+def observe_stage(stage, seconds):
+    """
+    Records the duration of a stage measured elsewhere (e.g. an OCR queue wait).
+
+    Args:
+        stage (str): Stage name.
+        seconds (float): Its duration.
+    """
+
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace["spans"].append((stage, round(seconds * 1000, 2)))
+
+
+@contextmanager
+def span(stage):
+    """
+    Times the body of a `with` block as one stage.
+
+    Args:
+        stage (str): Stage name, used as the "stage" label.
+
+    Yields:
+        dict: Holds "seconds" once the block has finished.
+    """
+
+    timing = {"seconds": None}
+    start = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing["seconds"] = time.perf_counter() - start
+        observe_stage(stage, timing["seconds"])
+
+
+def annotate(**attributes):
+    """
+    Attaches attributes (template counts, text length...) to the current trace, if any.
+
+    Args:
+        **attributes: Values logged with the trace.
+    """
+
+    trace = _trace.get()
+    if trace is not None:
+        trace["attributes"].update(attributes)
+
+
+@contextmanager
+def trace(document_type):
+    """
+    Collects the spans of one CHECK and logs them as a single JSON line when
+    tracing is enabled (CHECK_TRACE=1).
+
+    Args:
+        document_type (str): Document type of the check.
+
+    Yields:
+        dict: The trace; "attributes" can be filled in by the caller.
+    """
+
+    current = {"document_type": document_type, "spans": [], "attributes": {}}
+    token = _trace.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        _trace.reset(token)
+        if TRACE_ENABLED:
+            current["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            logger.info(json.dumps(current, default=str))
+
+
+def render():
+    """
+    Renders every registered metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics page.
+    """
+
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name} {value}" for name, value in metric.samples())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,148 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue already holds `max_pending` jobs."""
+
+
+class JobQueue:
+    """
+    A bounded in-process queue that runs document checks on a pool of worker threads.
+
+    Web requests submit a job and return immediately with its id; the outcome is
+    fetched later with `status`. Jobs that are still queued or running after
+    `timeout` seconds are reported as timed out and their result is discarded.
+
+    The timeout only affects reporting: a queued job is cancelled, but a running
+    thread cannot be stopped, so it keeps its worker and its `max_pending` slot
+    until the function returns. The job table is per process, so a web app serving
+    it must run as a single process (any number of threads).
+    """
+
+    def __init__(self, workers=2, max_pending=16, timeout=120, retention=3600):
+        """
+        Args:
+            workers (int, optional): Number of jobs run concurrently. Defaults to 2.
+            max_pending (int, optional): Largest number of queued plus running jobs. Defaults to 16.
+            timeout (float, optional): Seconds after submission at which a job is reported as timed out
+                                       (a running job still holds its worker until it returns). Defaults to 120.
+            retention (float, optional): Seconds finished jobs are kept for retrieval. Defaults to 3600.
+        """
+
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="check-job")
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, owner=None):
+        """
+        Queues `function(*args)` for execution.
+
+        Args:
+            function (callable): The work to run (e.g. `Main.CHECK`).
+            *args: Positional arguments for `function`.
+            owner (str, optional): Id of the user allowed to read the job.
+
+        Returns:
+            str: The job id.
+
+        Raises:
+            QueueFull: If `max_pending` jobs are already queued or running.
+        """
+
+        with self._lock:
+            self._purge()
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} jobs pending")
+            self._pending += 1
+            job_id = uuid.uuid4().hex
+            job = {
+                "id": job_id,
+                "owner": owner,
+                "status": "queued",
+                "result": None,
+                "error": None,
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+            }
+            self._jobs[job_id] = job
+        job["future"] = self._executor.submit(self._run, job, function, args)
+        return job_id
+
+    def _run(self, job, function, args):
+        try:
+            with self._lock:
+                self._expire(job, started=True)
+                if job["status"] != "queued":
+                    return  # Timed out while waiting in the queue
+                job["status"] = "running"
+                job["started"] = time.time()
+            try:
+                result, error = function(*args), None
+            except Exception as e:
+                result, error = None, f"{type(e).__name__}: {e}"
+            with self._lock:
+                self._expire(job, started=True)
+                job["finished"] = time.time()
+                if job["status"] == "running":
+                    job["status"] = "failed" if error else "done"
+                    job["result"] = result
+                    job["error"] = error
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _expire(self, job, started=False):
+        # Called with the lock held: flag jobs that exceeded their time budget
+        if job["status"] in ("queued", "running") and time.time() - job["submitted"] > self.timeout:
+            job["status"] = "timeout"
+            job["finished"] = time.time()
+            if not started and job["future"].cancel():
+                self._pending -= 1  # Never started, so `_run` will not release its slot
+
+    def _purge(self):
+        # Called with the lock held: forget finished jobs past their retention
+        cutoff = time.time() - self.retention
+        for job_id in [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished"] is not None and job["finished"] < cutoff
+        ]:
+            del self._jobs[job_id]
+
+    def status(self, job_id, owner=None):
+        """
+        Returns the state of a job.
+
+        Args:
+            job_id (str): The id returned by `submit`.
+            owner (str, optional): Id of the requesting user; other users' jobs are not returned.
+
+        Returns:
+            dict or None: "id", "status" (queued, running, done, failed or timeout),
+                          "result", "error" and timestamps; None if unknown.
+        """
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["owner"] != owner:
+                return None
+            self._expire(job)
+            return {key: value for key, value in job.items() if key != "future"}
+
+    def depth(self):
+        """
+        Returns the number of jobs currently queued or running.
+
+        Returns:
+            int: The queue depth.
+        """
+
+        with self._lock:
+            return self._pending
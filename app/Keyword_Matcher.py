@@ -0,0 +1,126 @@
+import string
+from collections import deque
+
+
+def tokenize(text):
+    """
+    Splits text into the lowercase word tokens used for keyword matching.
+
+    Surrounding punctuation is stripped (so "Address:" matches "address"); tokens
+    that are then not purely alphabetic, or are a single character, are dropped.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        list: The tokens, in order.
+    """
+
+    tokens = (token.strip(string.punctuation) for token in text.lower().split())
+    return [token for token in tokens if token.isalpha() and len(token) > 1]
+
+
+class KeywordMatcher:
+    """
+    A precompiled matcher for a keyword list containing single words and phrases.
+
+    Single-word keywords are looked up in a token set; multi-word phrases run
+    through a token-level Aho-Corasick automaton, so a document is scanned once
+    regardless of the number of keywords.
+    """
+
+    def __init__(self, keywords, weights=None):
+        """
+        Args:
+            keywords (list): Keywords and phrases; duplicates and case are ignored.
+            weights (dict, optional): Weight per keyword (default weight 1.0).
+        """
+
+        weights = {key.lower(): value for key, value in (weights or {}).items()}
+        self.weights = {}
+        self.words = {}  # token -> keyword
+        self._goto = [{}]  # state -> {token: next state}
+        self._fail = [0]
+        self._output = [[]]  # state -> keywords ending here
+
+        for keyword in keywords:
+            keyword = keyword.lower()
+            if keyword in self.weights:
+                continue
+            self.weights[keyword] = float(weights.get(keyword, 1.0))
+            tokens = tokenize(keyword)
+            if len(tokens) == 1:
+                self.words[tokens[0]] = keyword
+            elif tokens:
+                self._add_phrase(tokens, keyword)
+            # Keywords without any matchable token (e.g. "co2") still count in the total
+
+        self.total_weight = sum(self.weights.values())
+        self._link()
+
+    def _add_phrase(self, tokens, keyword):
+        state = 0
+        for token in tokens:
+            following = self._goto[state].get(token)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][token] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = following
+        self._output[state].append(keyword)
+
+    def _link(self):
+        # Breadth-first construction of failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(token, 0)
+                self._output[following] = self._output[following] + self._output[self._fail[following]]
+
+    def match(self, tokens):
+        """
+        Finds the keywords present in a token sequence.
+
+        Args:
+            tokens (list): Tokens produced by `tokenize`.
+
+        Returns:
+            dict: Matched keyword -> its weight.
+        """
+
+        matched = {}
+        for token in set(tokens).intersection(self.words):
+            keyword = self.words[token]
+            matched[keyword] = self.weights[keyword]
+
+        state = 0
+        for token in tokens:
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            for keyword in self._output[state]:
+                matched[keyword] = self.weights[keyword]
+        return matched
+
+    def score(self, tokens):
+        """
+        Scores a token sequence by the weighted share of keywords it contains.
+
+        Args:
+            tokens (list): Tokens produced by `tokenize`.
+
+        Returns:
+            tuple: The matched weight divided by the total weight, and the matched keywords.
+        """
+
+        matched = self.match(tokens)
+        if not self.total_weight:
+            return 0.0, matched
+        return sum(matched.values()) / self.total_weight, matched
@@ -0,0 +1,358 @@
+import os
+import json
+import heapq
+import time
+import threading
+import cv2
+import numpy as np
+from Feature_Extraction import SQUASH_PROFILE, prepare_image, load_template
+from Descriptor_Store import resolve_template_folder, store_directory, REFRESH_INTERVAL
+
+# Bump whenever a hash function changes
+HASH_VERSION = 2
+
+# Largest perceptual-hash distance at which two pages count as the same document
+DUPLICATE_DISTANCE = 2
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def layout_hash(image):
+    """
+    Computes a 64-bit difference hash (dHash) of a page's coarse layout.
+
+    Args:
+        image (np.ndarray): The image (grayscale or BGR); it is first squashed to
+                            MATCH_SIZE, whatever the matching profile.
+
+    Returns:
+        int: The 64-bit hash.
+    """
+
+    # 9x8 thumbnail: each bit tells whether a cell is brighter than its left neighbour
+    small = cv2.resize(prepare_image(image, SQUASH_PROFILE), (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def perceptual_hash(image):
+    """
+    Computes a 64-bit perceptual hash (pHash) of a page.
+
+    The hash keeps the signs of the lowest 8x8 DCT frequencies relative to their
+    median, so it survives rescaling, recompression and small contrast changes.
+
+    Args:
+        image (np.ndarray): The image (grayscale or BGR); it is first squashed to
+                            MATCH_SIZE, whatever the matching profile.
+
+    Returns:
+        int: The 64-bit hash.
+    """
+
+    small = cv2.resize(prepare_image(image, SQUASH_PROFILE), (32, 32), interpolation=cv2.INTER_AREA)
+    frequencies = cv2.dct(small.astype(np.float32))[:8, :8]
+    bits = (frequencies > np.median(frequencies)).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming_distance(a, b):
+    """
+    Returns the number of differing bits between two hashes.
+
+    Args:
+        a (int): First hash.
+        b (int): Second hash.
+
+    Returns:
+        int: The Hamming distance.
+    """
+
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    A Burkhard-Keller tree over 64-bit hashes under the Hamming distance.
+
+    Children are keyed by their distance to the parent, so the triangle inequality
+    lets range and nearest-neighbour searches skip whole subtrees. Identical hashes
+    share one node.
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, items, {distance: child}]
+
+    def add(self, value, item):
+        """
+        Inserts an item under its hash.
+
+        Args:
+            value (int): The item's hash.
+            item: The item (e.g. a template file name).
+        """
+
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(node[0], value)
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        """
+        Finds every item within `radius` bits of `value`.
+
+        Args:
+            value (int): The query hash.
+            radius (int): Largest Hamming distance returned.
+
+        Returns:
+            list: (distance, item) tuples, closest first.
+        """
+
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(node[0], value)
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return sorted(found, key=lambda pair: pair[0])
+
+    def nearest(self, value, k):
+        """
+        Finds the `k` items closest to `value`.
+
+        Args:
+            value (int): The query hash.
+            k (int): Number of items returned.
+
+        Returns:
+            list: Up to `k` (distance, item) tuples, closest first.
+        """
+
+        best = []  # Max-heap on distance: (-distance, order, item)
+        order = 0
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(node[0], value)
+            for item in node[1]:
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, order, item))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, order, item))
+                order += 1
+            # Only subtrees that can still hold something closer than the current k-th best
+            bound = -best[0][0] if len(best) == k else 64
+            for edge, child in node[2].items():
+                if distance - bound <= edge <= distance + bound:
+                    stack.append(child)
+        return [(-d, item) for d, _, item in sorted(best, key=lambda entry: (-entry[0], entry[1]))]
+
+
+def hamming_distances(hashes, value):
+    """
+    Computes the Hamming distance between one hash and an array of hashes.
+
+    Args:
+        hashes (np.ndarray): Array of uint64 hashes.
+        value (int): The hash to compare against.
+
+    Returns:
+        np.ndarray: Number of differing bits per entry of `hashes`.
+    """
+
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class LayoutIndex:
+    """
+    Layout (dHash) and perceptual (pHash) hashes of every template in a folder.
+
+    The dHashes serve the cheap nearest-layout gate in `Main`; the pHashes are
+    held in a BK-tree for top-k candidate lookup and duplicate detection.
+    """
+
+    def __init__(self, names, hashes, perceptual_hashes):
+        self.names = list(names)
+        self.hashes = np.array(hashes, dtype=np.uint64)
+        self.perceptual_hashes = np.array(perceptual_hashes, dtype=np.uint64)
+        self.tree = BKTree()
+        for name, value in zip(names, perceptual_hashes):
+            self.tree.add(value, name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, value, perceptual_value):
+        """
+        Adds a template to the in-memory index.
+
+        Args:
+            name (str): Template file name.
+            value (int): Its layout hash.
+            perceptual_value (int): Its perceptual hash.
+        """
+
+        self.names.append(name)
+        self.hashes = np.append(self.hashes, np.uint64(value))
+        self.perceptual_hashes = np.append(self.perceptual_hashes, np.uint64(perceptual_value))
+        self.tree.add(perceptual_value, name)
+
+    def similar(self, perceptual_value, k):
+        """
+        Finds the `k` templates whose perceptual hash is closest.
+
+        Args:
+            perceptual_value (int): Perceptual hash of the image.
+            k (int): Number of templates returned.
+
+        Returns:
+            list: (template name, Hamming distance) tuples, closest first.
+        """
+
+        return [(name, distance) for distance, name in self.tree.nearest(perceptual_value, k)]
+
+    def duplicates(self, perceptual_value, max_distance=DUPLICATE_DISTANCE):
+        """
+        Finds templates that are (near-)exact copies of the image.
+
+        Args:
+            perceptual_value (int): Perceptual hash of the image.
+            max_distance (int, optional): Largest distance counted as a copy. Defaults to DUPLICATE_DISTANCE.
+
+        Returns:
+            list: (template name, Hamming distance) tuples, closest first.
+        """
+
+        return [(name, distance) for distance, name in self.tree.search(perceptual_value, max_distance)]
+
+    def nearest(self, value):
+        """
+        Finds the template whose layout hash is closest to `value`.
+
+        Args:
+            value (int): Layout hash of the image.
+
+        Returns:
+            tuple: (template name, Hamming distance), or (None, 64) for an empty index.
+        """
+
+        if len(self.names) == 0:
+            return None, 64
+        distances = hamming_distances(self.hashes, value)
+        best = int(np.argmin(distances))
+        return self.names[best], int(distances[best])
+
+
+def build_layout_index(template_folder):
+    """
+    Builds or incrementally updates the layout and perceptual hashes of a template folder.
+
+    Hashes are kept in `layout_hashes.json` next to the folder's descriptor store;
+    only templates that are new or whose size or modification time changed are decoded.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+
+    Returns:
+        LayoutIndex: The up-to-date index.
+    """
+
+    folder = resolve_template_folder(template_folder)
+    directory = store_directory(template_folder)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "layout_hashes.json")
+
+    old = {}
+    if os.path.isfile(path):
+        with open(path) as f:
+            saved = json.load(f)
+        if saved.get("version") == HASH_VERSION:
+            old = saved["templates"]
+
+    entries, changed = {}, False
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith(".png"):
+            continue
+        stat = os.stat(os.path.join(folder, filename))
+        entry = old.get(filename)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            template = load_template(os.path.join(folder, filename), SQUASH_PROFILE)
+            if template is None:
+                continue
+            entry = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "dhash": layout_hash(template),
+                "phash": perceptual_hash(template),
+            }
+            changed = True
+        entries[filename] = entry
+    changed = changed or len(entries) != len(old)
+
+    if changed:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": HASH_VERSION, "templates": entries}, f)
+        os.replace(tmp_path, path)
+
+    names = list(entries)
+    return LayoutIndex(
+        names,
+        [entries[name]["dhash"] for name in names],
+        [entries[name]["phash"] for name in names],
+    )
+
+
+def get_layout_index(template_folder, refresh_interval=REFRESH_INTERVAL):
+    """
+    Returns the cached layout index of a template folder, refreshing it periodically.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+        refresh_interval (float, optional): Seconds between change checks. Defaults to REFRESH_INTERVAL.
+
+    Returns:
+        LayoutIndex: The layout index of the folder.
+    """
+
+    key = resolve_template_folder(template_folder)
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is None or time.monotonic() - cached[0] >= refresh_interval:
+            cached = (time.monotonic(), build_layout_index(template_folder))
+            _indexes[key] = cached
+        return cached[1]
+
+
+def find_duplicate_templates(image, template_folder, max_distance=DUPLICATE_DISTANCE):
+    """
+    Detects uploads that are copies of a library template, a strong re-submission signal.
+
+    Args:
+        image (np.ndarray): The decoded image.
+        template_folder (str): Name or path of the template folder.
+        max_distance (int, optional): Largest perceptual-hash distance counted as a copy.
+                                      Defaults to DUPLICATE_DISTANCE.
+
+    Returns:
+        list: (template name, Hamming distance) tuples, closest first; empty if none.
+    """
+
+    return get_layout_index(template_folder).duplicates(perceptual_hash(image), max_distance)
@@ -1,66 +1,627 @@
 # Import necessary functions from other files
 import os
-from Convert_To_Png import convert_to_png
+import time
+import threading
+from Image_Loading import decode_image, iter_pages
+from Image_Normalisation import archive_png
+from Upload_Intake import MAX_FILE_SIZE, MAX_PAGES, MAX_PIXELS, inspect_image
 from Pre_Processing import preprocess_image
-from OCR_Matching import OCR_MATCHING
-from Template_Matching import compare_image_with_templates
+from OCR_Matching import OCR_MATCHING, KEYWORD_MATCHERS, process_ocr, process_ocr_fields
+from OCR_Reader_Pool import LANGUAGES
+from Template_Matching import compare_image_with_templates, extract_image_features
+from Template_Ranking import VERIFY_TOP, rank_templates
+from Feature_Extraction import FEATURE_ENGINES, prepare_image, prepared_size, match_profile
+from Descriptor_Store import STORE_VERSION, store_params, current_library_version, get_descriptor_store
+from Template_Clusters import LINK_MATCHES, DESCEND_RATIO, DESCEND_TOP
+from Field_Regions import (
+    ROI_OCR_ENABLED, ROI_OCR_DECIDES, MIN_INLIERS, field_regions, estimate_homography, crop_fields, region_area,
+)
+from Layout_Hash import HASH_VERSION, layout_hash, get_layout_index, find_duplicate_templates
+from Upload_History import get_upload_history
+from Result_Cache import MISS, get_result_cache, image_digest, version_tag
+from Instrumentation import span, trace, annotate, CHECK_SECONDS, CHECKS, REJECTIONS
 
 
+template_folders = {
+    "invoice": r"INVOICES",
+    "prescription": r"PRESCRIPTIONS",
+    "labreport": r"LABREPORTS"
+}
 
-def CHECK(document_type, image_path):
+# Set threshold value based on document type
+thresholds = {
+    "invoice": 15,
+    "prescription": 20,
+    "labreport": 25,
+}
+
+# Feature engine used for template matching per document type; CHECK_FEATURE_ENGINE
+# ("sift", "orb" or "akaze") switches every type at once
+feature_engines = {
+    "invoice": "sift",
+    "prescription": "sift",
+    "labreport": "sift",
+}
+if os.environ.get("CHECK_FEATURE_ENGINE"):
+    feature_engines = {key: os.environ["CHECK_FEATURE_ENGINE"] for key in feature_engines}
+
+# Good-match thresholds per feature engine; the binary engines produce a different
+# number of keypoints and matches, so they need their own thresholds
+engine_thresholds = {
+    "sift": thresholds,
+    "orb": {
+        "invoice": 15,
+        "prescription": 18,
+        "labreport": 20,
+    },
+    "akaze": {
+        "invoice": 10,
+        "prescription": 12,
+        "labreport": 14,
+    },
+}
+
+# Largest Hamming distance (of 64 bits) between the upload's layout hash and the nearest template's.
+# Unset by default: the layout gate then only records the distance, because genuine pages and pages
+# of other document types overlap at 16-20 (see `Benchmark.py --stages layout_distances`)
+LAYOUT_MAX_DISTANCE = (
+    int(os.environ["CHECK_LAYOUT_MAX_DISTANCE"]) if os.environ.get("CHECK_LAYOUT_MAX_DISTANCE") else None
+)
+
+# Template candidates: "exhaustive", "global" (FLANN vote shortlist), "hash" (pHash shortlist),
+# "cluster" (cluster representatives first) or "pyramid" (coarse-resolution shortlist)
+MATCH_MODE = os.environ.get("CHECK_MATCH_MODE", "exhaustive")
+SHORTLIST_SIZE = int(os.environ.get("CHECK_SHORTLIST_SIZE", 50))
+
+# Template decision: "first" accepts the first template reaching the threshold; "ranked" scores
+# every candidate and also requires the best ones to align geometrically (RANSAC, see `Template_Ranking`)
+TEMPLATE_DECISION = os.environ.get("CHECK_TEMPLATE_DECISION", "first")
+
+# Multi-page uploads: "first" checks only the first page (like single-page decoding always did),
+# "any" accepts the document at the first accepted page, "all" rejects it at the first rejected page
+# (see `CHECK_PAGES`)
+PAGE_POLICY = os.environ.get("CHECK_PAGE_POLICY", "first")
+
+# Threads comparing an image against the template library
+TEMPLATE_THREADS = int(os.environ.get("CHECK_TEMPLATE_THREADS", 4))
+
+# Gate order: "auto" (cost model) or a comma-separated list of gate names, e.g. "blur,ocr,template"
+GATE_ORDER = os.environ.get("CHECK_GATE_ORDER", "auto")
+
+# Number of observed runs after which measured statistics outweigh a gate's declared priors
+PRIOR_WEIGHT = 20
+
+# Smoothing factor of the moving average of gate durations (one-off costs such as
+# building an index on first use fade out instead of skewing the order for good)
+COST_SMOOTHING = 0.1
+
+
+# Version tags of the cached intermediate results (see `Result_Cache`)
+OCR_CACHE_VERSION = version_tag("ocr", LANGUAGES)
+
+
+def select_engine(document_type, engine=None):
+    """
+    Returns the feature engine used for a document type.
+
+    Args:
+        document_type (str): The type of document.
+        engine (str, optional): Explicit choice overriding `feature_engines`.
+
+    Returns:
+        str: The feature engine name.
+
+    Raises:
+        ValueError: If the engine is unknown.
+    """
+
+    engine = engine or feature_engines.get(document_type, "sift")
+    if engine not in FEATURE_ENGINES:
+        raise ValueError(f"unknown feature engine: {engine}")
+    return engine
+
+
+def _threshold(document_type, engine):
+    return engine_thresholds[engine].get(document_type, 15)  # Use default if type not in thresholds
+
+
+def _check_cache_version(document_type, engine):
+    # Everything a verdict depends on; changing any of it invalidates cached verdicts
+    return version_tag(
+        "check",
+        document_type,
+        current_library_version(template_folders[document_type]),
+        engine,
+        _threshold(document_type, engine),
+        LAYOUT_MAX_DISTANCE,
+        MATCH_MODE,
+        SHORTLIST_SIZE,
+        sorted(match_profile(template_folders[document_type]).items()),
+        (TEMPLATE_DECISION, VERIFY_TOP, MIN_INLIERS) if TEMPLATE_DECISION == "ranked" else None,
+        (LINK_MATCHES, DESCEND_RATIO, DESCEND_TOP) if MATCH_MODE == "cluster" else None,
+        HASH_VERSION,
+        sorted(KEYWORD_MATCHERS[document_type].weights.items()),
+        (ROI_OCR_ENABLED, ROI_OCR_DECIDES, MIN_INLIERS),
+    )
+
+
+def _cached(context, kind, version, compute, cacheable=lambda value: True):
+    # Return a cached intermediate result of the image, computing and storing it on a miss
+    cache = context["cache"]
+    if cache is None:
+        return compute()
+    value = cache.get(kind, context["digest"], version)
+    if value is MISS:
+        value = compute()
+        if cacheable(value):
+            cache.put(kind, context["digest"], version, value)
+        else:
+            context["cacheable"] = False  # Transient failure: do not cache the verdict either
+    return value
+
+
+def _blur_gate(context):
+    # Steps of processing image and extraction
+    return preprocess_image(context["image"])
+
+
+def _layout_gate(context):
+    # Reject pages whose coarse layout is far from every template of the type;
+    # without LAYOUT_MAX_DISTANCE the distance is only recorded, for calibration
+    index = get_layout_index(context["template_folder"])
+    name, distance = index.nearest(layout_hash(context["image"]))
+    annotate(layout_template=name, layout_distance=distance)
+    if LAYOUT_MAX_DISTANCE is not None and distance > LAYOUT_MAX_DISTANCE:
+        return [False, "REJECTED !!! REASON : LAYOUT DOES NOT RESEMBLE ANY TEMPLATE ! "]
+    return [True, "ACCEPTED !!!"]
+
+
+def _read_fields(context, regions):
+    # Align the upload with the matched template and OCR only its field regions
+    engine = context["engine"]
+    store = get_descriptor_store(context["template_folder"], engine=engine)
+    name = context["matched_template"]
+    image_points, image_descriptors = context["image_features"]
+    image_size = prepared_size(context["image"].shape, match_profile(context["template_folder"]))
+    with span("homography"):
+        homography, inliers = estimate_homography(
+            image_points, image_descriptors, store.keypoints_for(name), store.descriptors_for(name), engine,
+            image_size=image_size, template_size=store.prepared_size(name),
+        )
+    annotate(template_inliers=inliers)
+    if homography is None:
+        return {}  # Could not align: read the full page instead
+    annotate(ocr_page_fraction=round(region_area(regions), 3))
+    return process_ocr_fields(
+        crop_fields(context["image"], homography, regions, image_size, store.prepared_size(name))
+    )
+
+
+def _field_gate(context):
+    # Once a template matched, OCR its field regions; the fields are returned with the verdict.
+    # The crops are read separately from the page, so their text is not a subset of the page
+    # text, and a pass here only decides the verdict with ROI_OCR_DECIDES
+    regions = field_regions(context["document_type"], context["template_folder"], context["matched_template"])
+    if not regions:
+        return None
+    fields = _cached(
+        context,
+        "ocr_fields",
+        version_tag(
+            OCR_CACHE_VERSION, context["engine"], context["template_folder"], context["matched_template"],
+            sorted(regions.items()), MIN_INLIERS, sorted(match_profile(context["template_folder"]).items()),
+        ),
+        lambda: _read_fields(context, regions),
+        cacheable=lambda value: isinstance(value, dict),
+    )
+    if not isinstance(fields, dict) or not fields:
+        return None
+    context["details"]["fields"] = fields
+    annotate(ocr_fields=sorted(fields))
+    result = OCR_MATCHING(context["document_type"], context["image"], " ".join(fields.values()))
+    return result if result[0] else None
+
+
+def _ocr_gate(context):
+    read_fields = ROI_OCR_ENABLED and context.get("matched_template")
+    if read_fields and ROI_OCR_DECIDES:
+        result = _field_gate(context)
+        if result is not None:
+            return result
+
+    extracted_text = _cached(
+        context,
+        "ocr",
+        OCR_CACHE_VERSION,
+        lambda: process_ocr(context["image"]),
+        cacheable=lambda text: not text.startswith("Error: "),
+    )
+    result = OCR_MATCHING(context["document_type"], context["image"], extracted_text)
+    if result[0] and read_fields and not ROI_OCR_DECIDES:
+        _field_gate(context)  # The full page decided; the fields only go out with the verdict
+    return result
+
+
+def _template_gate(context):
+    # Image keypoints and descriptors are content-addressed, so a re-upload skips feature extraction
+    engine = context["engine"]
+    profile = match_profile(context["template_folder"])
+    context["image_features"] = _cached(
+        context,
+        f"features:{engine}",
+        version_tag("features", STORE_VERSION, store_params(engine, profile)),
+        lambda: extract_image_features(prepare_image(context["image"], profile), engine, profile),
+    )
+    image_descriptors = context["image_features"][1]
+
+    if TEMPLATE_DECISION == "ranked":
+        ranking = rank_templates(
+            context["image"],
+            context["template_folder"],
+            context["threshold"],
+            num_threads=TEMPLATE_THREADS,
+            match_mode=MATCH_MODE,
+            shortlist_size=SHORTLIST_SIZE,
+            image_features=context["image_features"],
+            engine=engine,
+        )
+        annotate(template_ranking=ranking)
+        if ranking and ranking[0]["passed"]:
+            context["matched_template"] = context["details"]["template"] = ranking[0]["template"]
+            annotate(matched_template=ranking[0]["template"])
+            return [True, "ACCEPTED !!! "]
+        context["matched_template"] = None
+        return [False, "REJECTED !!! REASON : IMAGE NOT MATCHED DURING TEMPLATE MATCHING PROCESS ! "]
+
+    # Template matching
+    matched = compare_image_with_templates(
+        context["image"],
+        context["template_folder"],
+        context["threshold"],
+        num_threads=TEMPLATE_THREADS,
+        match_mode=MATCH_MODE,
+        shortlist_size=SHORTLIST_SIZE,
+        image_descriptors=image_descriptors,
+        engine=engine,
+    )
+    # The matched template tells the OCR gate which field regions to read
+    context["matched_template"] = matched[2]["matched_template"]
+    if context["matched_template"] is not None:
+        context["details"]["template"] = context["matched_template"]
+    annotate(matched_template=context["matched_template"])
+    return matched[:2]
+
+
+# Every gate declares its expected cost (seconds) and how often it rejects;
+# both are priors that get replaced by measurements as documents flow through
+GATES = {
+    "blur": {"cost": 0.02, "reject_rate": 0.05, "run": _blur_gate},
+    "layout": {"cost": 0.002, "reject_rate": 0.02, "run": _layout_gate},
+    "ocr": {"cost": 5.0, "reject_rate": 0.10, "run": _ocr_gate},
+    "template": {"cost": 2.0, "reject_rate": 0.10, "run": _template_gate},
+}
+
+_stats = {
+    name: {"calls": 0, "rejects": 0, "seconds": 0.0, "recent_seconds": None}
+    for name in ["file"] + list(GATES)
+}
+_stats_lock = threading.Lock()
+
+
+def _record(name, seconds, rejected):
+    with _stats_lock:
+        stats = _stats[name]
+        stats["calls"] += 1
+        stats["rejects"] += int(rejected)
+        stats["seconds"] += seconds
+        recent = stats["recent_seconds"]
+        stats["recent_seconds"] = seconds if recent is None else recent + COST_SMOOTHING * (seconds - recent)
+
+
+def pipeline_stats():
+    """
+    Returns per-stage timings and reject counts recorded by `CHECK`.
+
+    Returns:
+        dict: For every stage, its call count, reject count, total seconds and
+              moving average of recent durations.
+    """
+
+    with _stats_lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
+
+
+def gate_order(order=None):
+    """
+    Decides the order in which the gates run.
+
+    With "auto", gates are sorted by expected cost divided by reject probability,
+    which minimises the expected cost of rejecting a document when gates are
+    independent. Priors are blended with the recorded statistics.
+
+    Args:
+        order (str or list, optional): "auto" or an explicit list of gate names. Defaults to GATE_ORDER.
+
+    Returns:
+        list: Gate names in execution order.
+    """
+
+    order = order or GATE_ORDER
+    if order != "auto":
+        names = order.split(",") if isinstance(order, str) else list(order)
+        return [name.strip() for name in names if name.strip() in GATES]
+
+    snapshot = pipeline_stats()
+
+    def rank(name):
+        prior, stats = GATES[name], snapshot[name]
+        calls = stats["calls"]
+        weight = calls / (PRIOR_WEIGHT + calls)
+        cost = prior["cost"] if calls == 0 else (1 - weight) * prior["cost"] + weight * stats["recent_seconds"]
+        reject_rate = (prior["reject_rate"] * PRIOR_WEIGHT + stats["rejects"]) / (PRIOR_WEIGHT + calls)
+        return cost / max(reject_rate, 1e-6)
+
+    return sorted(GATES, key=rank)
+
+
+def _rejection_reason(message):
+    # "REJECTED !!! REASON : IMAGE TOO BLURRY !" -> "IMAGE TOO BLURRY"
+    return message.split("REASON :")[-1].strip(" !")
+
+
+def _file_checks(image):
+    # Cheapest checks first: existence, size, format, dimensions and page count, before anything is decoded
+    if isinstance(image, str):
+        # Check if the image path exists and is a file
+        if not os.path.exists(image) or not os.path.isfile(image):
+            return [False, "REJECTED !!! REASON : IMAGE DON'T EXIST !"], None
+        size = os.path.getsize(image)
+    elif isinstance(image, (bytes, bytearray)):
+        size = len(image)
+    else:
+        size = 0  # Already decoded
+    if size > MAX_FILE_SIZE:
+        return [False, "REJECTED !!! REASON : FILE TOO LARGE !"], None
+
+    # Confirm the format from the magic bytes and the dimensions from the header,
+    # so garbage and decompression bombs never reach the full decode
+    if size:
+        return inspect_image(image)
+    return [True, "ACCEPTED !!!"], None
+
+
+def _file_gate(image):
+    result, _ = _file_checks(image)
+    if not result[0]:
+        return result, None
+
+    # Decode the image once; every gate works on this array
+    decoded = decode_image(image)
+    if decoded is None:
+        return [False, "REJECTED !!! REASON : INVALID IMAGE FORMAT !"], None
+    return [True, "ACCEPTED !!!"], decoded
+
+
+def _run_check(document_type, image, save_path=None, order=None, engine="sift", source=None):
+    # The pipeline behind `CHECK`; every stage runs inside a timing span. Returns the verdict
+    # message and its details: the matched "template" and the OCR'd "fields" when known, and
+    # the re-submission signals "resubmission_of" (earlier uploads) and "template_copies".
+    # `source` names where the page was read from (a file path defaults to itself)
+    with span("file") as timing:
+        result, decoded = _file_gate(image)
+    _record("file", timing["seconds"], not result[0])
+    if not result[0]:
+        annotate(rejected_by="file")
+        return result[1], {}
+
+    # Only touch the disk when explicitly asked to, with fast PNG compression
+    if save_path:
+        archive_png(decoded, save_path)
+
+    context = {
+        "document_type": document_type,
+        "image": decoded,
+        "template_folder": template_folders[document_type],
+        "engine": engine,
+        "threshold": _threshold(document_type, engine),
+        "cache": get_result_cache(),
+        "digest": None,
+        "cacheable": True,
+        "details": {},
+    }
+
+    cache, history = context["cache"], get_upload_history()
+    if cache is not None or history is not None:
+        context["digest"] = image_digest(decoded)
+
+    # Re-submission signals, recorded with every verdict (cached or not) but never rejecting
+    signals = {}
+    with span("resubmission"):
+        if history is not None:
+            if source is None and isinstance(image, str):
+                source = image
+            signals["resubmission_of"] = history.check_and_record(
+                decoded, document_type, context["digest"], source=source
+            )
+        signals["template_copies"] = [
+            {"template": name, "distance": distance}
+            for name, distance in find_duplicate_templates(decoded, context["template_folder"])
+        ]
+    annotate(
+        resubmissions=len(signals.get("resubmission_of", [])),
+        template_copies=[copy["template"] for copy in signals["template_copies"]],
+    )
+
+    # A repeated upload of the same scan is answered straight from the cache
+    if cache is not None:
+        with span("cache_lookup"):
+            cache_key = f"{document_type}:{context['digest']}"
+            cache_version = _check_cache_version(document_type, engine)
+            cached = cache.get("check", cache_key, cache_version)
+        if cached is not MISS:
+            annotate(cached=True, rejected_by="cache")
+            return cached["result"], dict(cached["details"], **signals)
+
+    message = "ACCEPTED !!! "
+    for name in gate_order(order):
+        with span(name) as timing:
+            result = GATES[name]["run"](context)
+        _record(name, timing["seconds"], not result[0])
+        if not result[0]:
+            annotate(rejected_by=name)
+            message = result[1]
+            break  # Short-circuit on the first rejection
+
+    if cache is not None and context["cacheable"]:
+        cache.put("check", cache_key, cache_version, {"result": message, "details": context["details"]})
+    return message, dict(context["details"], **signals)
+
+
+def _run_pages(document_type, image, order=None, engine="sift", policy=PAGE_POLICY):
+    # The page pipeline behind `CHECK_PAGES`: the file is checked once, then every page
+    # runs through `_run_check` as it is decoded, until a page decides the document
+    with span("file") as timing:
+        result, _ = _file_checks(image)
+    _record("file", timing["seconds"], not result[0])
+    if not result[0]:
+        annotate(rejected_by="file")
+        return {"result": result[1], "pages": [], "decided_by": None}
+
+    pages, decided_by = [], None
+    for number, page in enumerate(iter_pages(image, MAX_PAGES, MAX_PIXELS), start=1):
+        if page is None:
+            message, details = "REJECTED !!! REASON : INVALID IMAGE FORMAT !", {}
+        else:
+            with span("page"):
+                source = f"{image}#page={number}" if isinstance(image, str) else None
+                message, details = _run_check(document_type, page, order=order, engine=engine, source=source)
+        del page  # Drop the decoded page before the next one is decoded
+        pages.append({"page": number, "result": message, **details})
+        if policy == "first" or message.startswith("ACCEPTED") == (policy == "any"):
+            decided_by = number
+            break  # This page decides the document; the rest are never decoded
+
+    if not pages:
+        message = "REJECTED !!! REASON : INVALID IMAGE FORMAT !"
+    elif decided_by is not None:
+        message = pages[-1]["result"]
+    elif policy == "any":
+        message = pages[0]["result"]  # No page accepted: report the first page's reason
+    else:
+        message = "ACCEPTED !!! "
+    annotate(pages_checked=len(pages), decided_by_page=decided_by)
+    return {"result": message, "pages": pages, "decided_by": decided_by}
+
+
+def _observe(document_type, message, seconds, attributes):
+    # Export the outcome of one checked document
+    accepted = message.startswith("ACCEPTED")
+    CHECK_SECONDS.observe(seconds, document_type=document_type)
+    CHECKS.inc(
+        document_type=document_type,
+        result="accepted" if accepted else "rejected",
+        cached="true" if attributes.get("cached") else "false",
+    )
+    if not accepted:
+        REJECTIONS.inc(stage=attributes.get("rejected_by", "unknown"), reason=_rejection_reason(message))
+
+
+def CHECK(document_type, image, save_path=None, order=None, engine=None):
     """
     This function performs document type checking and processing.
 
+    The image is decoded exactly once; the gates (blur check, layout hash, OCR and
+    template matching) all consume the same in-memory array and nothing is written
+    to disk unless `save_path` is given. Gates run cheapest-rejection-first (see
+    `gate_order`) and the first rejection short-circuits the remaining ones.
+
+    Multi-page TIFFs and animated GIF/WebP files are checked page by page (see
+    `CHECK_PAGES`) and get the verdict of the whole document under PAGE_POLICY.
+
+    Verdicts, OCR text and image descriptors are cached under a hash of the decoded
+    pixels (see `Result_Cache`), so a re-uploaded scan is answered from the cache
+    until the template library or a threshold changes.
+
+    Each stage is timed and exported through `Instrumentation` (see the `/metrics`
+    route); with CHECK_TRACE=1 every call also logs its spans as one JSON line.
+
     Args:
         document_type (str): The type of document to be processed (e.g., "invoice", "prescription", "labreport").
-        image_path (str): The path to the image file.
+        image (str, bytes or np.ndarray): The path to the image file, the uploaded file contents,
+                                          or an already decoded image.
+        save_path (str, optional): If given, the decoded image is also written there as PNG
+                                   (single-page images only).
+        order (str or list, optional): Gate order override, see `gate_order`.
+        engine (str, optional): Feature engine for template matching ("sift", "orb" or "akaze");
+                                defaults to the document type's entry in `feature_engines`.
 
     Returns:
         str: A message indicating the result of processing, including success or error messages.
     """
 
-    template_folders = {
-            "invoice": r"INVOICES",
-            "prescription": r"PRESCRIPTIONS",
-            "labreport": r"LABREPORTS"
-        }
-    
-    
-    # Check if the image path exists and is a file
-    if not os.path.exists(image_path) or not os.path.isfile(image_path):
-        return "REJECTED !!! REASON : IMAGE DON'T EXIST !"
-        # return render_template('result.html', result=result)
-    
-    # Set threshold value based on document type
-    thresholds = {
-        "invoice": 15,
-        "prescription": 20,
-        "labreport": 25,
-    }
+    document_type = document_type.lower()
+    if document_type not in template_folders:
+        return "REJECTED !!! REASON : UNKNOWN DOCUMENT TYPE !"
 
-    document_type=document_type.lower()
-    
-    threshold = thresholds.get(document_type, 15)  # Use default if type not in thresholds
-    
-    # Convert the image to PNG format if necessary
-    if not image_path.endswith(".png"):
-        image_path = convert_to_png(image_path)
-        if (image_path == False):
-            return "REJECTED !!! REASON : INVALID IMAGE FORMAT !"
+    # The header is checked before the page count is read, so a decompression bomb is
+    # rejected here like in `CHECK_PAGES` instead of reaching Pillow's own limit
+    checked, header = _file_checks(image)
+    if checked[0] and header is not None and header["pages"] > 1:
+        return CHECK_PAGES(document_type, image, order=order, engine=engine)["result"]
 
-    # Steps of processing image and extraction
-    preprocessed_img = preprocess_image(image_path)
-    
-    if not preprocessed_img[0]:  # Check if preprocessing was successful
-        return preprocessed_img[1]  # Print preprocessing error message
+    engine = select_engine(document_type, engine)
+    with trace(document_type) as current:
+        start = time.perf_counter()
+        message, _ = _run_check(document_type, image, save_path, order, engine)
+        seconds = time.perf_counter() - start
+        annotate(result=message)
+
+    _observe(document_type, message, seconds, current["attributes"])
+    return message
+
+
+def CHECK_PAGES(document_type, image, order=None, engine=None, policy=None):
+    """
+    Checks a multi-page document (multi-page TIFF, animated GIF or WebP) page by page.
+
+    Pages are decoded one at a time as the document is read, so memory stays at
+    about one page, and each page goes through the same gates as `CHECK`. Reading
+    stops as soon as a page decides the document: with the "first" policy that is
+    always the first page, with "any" the first accepted page accepts it, and with
+    "all" the first rejected page rejects it. Single-page images are checked as a
+    one-page document, so callers that want per-page verdicts (e.g. the web app's
+    job results) can use this for every upload.
+
+    Args:
+        document_type (str): The type of document to be processed (e.g., "invoice", "prescription", "labreport").
+        image (str or bytes): The path to the file, or the uploaded file contents.
+        order (str or list, optional): Gate order override, see `gate_order`.
+        engine (str, optional): Feature engine for template matching, see `CHECK`.
+        policy (str, optional): "first", "any" or "all". Defaults to PAGE_POLICY.
+
+    Returns:
+        dict: A dict with keys:
+            - "result": the verdict message of the document.
+            - "pages": one {"page", "result"} dict per checked page, in page order, also holding
+              the matched "template" and the OCR'd "fields" (field name -> text) when known, and
+              the re-submission signals: "resubmission_of", earlier uploads of the same page (see
+              `Upload_History`), and "template_copies", library templates the page is a copy of.
+            - "decided_by": number of the page that decided the verdict, or None if every page was read.
+    """
 
-    OCR_RESULT = OCR_MATCHING(document_type, image_path)
+    document_type = document_type.lower()
+    if document_type not in template_folders:
+        return {"result": "REJECTED !!! REASON : UNKNOWN DOCUMENT TYPE !", "pages": [], "decided_by": None}
+    policy = policy or PAGE_POLICY
+    if policy not in ("first", "any", "all"):
+        raise ValueError(f"unknown page policy: {policy}")
 
-    if not OCR_RESULT[0]:  # Check if OCR was successful
-        return OCR_RESULT[1]  # Print OCR error message
+    engine = select_engine(document_type, engine)
+    with trace(document_type) as current:
+        start = time.perf_counter()
+        outcome = _run_pages(document_type, image, order, engine, policy)
+        seconds = time.perf_counter() - start
+        annotate(result=outcome["result"])
 
-    template_folder = template_folders[document_type]
-    # Template matching (after successful OCR)
-    matched = compare_image_with_templates(image_path, template_folder, threshold, num_threads=4)
-    
-    return matched[1]  # Return template matching message or other result
+    _observe(document_type, outcome["result"], seconds, current["attributes"])
+    return outcome
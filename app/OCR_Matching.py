@@ -1,38 +1,130 @@
 import re
-import easyocr
+import cv2
+from OCR_Reader_Pool import get_reader_pool
+from Image_Loading import decode_image
+from Keyword_Matcher import KeywordMatcher, tokenize
+from Instrumentation import span, annotate, OCR_TEXT_LENGTH
 from Keywords import (
     invoice_keywords,
     prescription_keywords,
     lab_report_keywords,
     general_keywords,
 )
-def process_ocr(image_path):
+def process_ocr(image):
     """
     Processes a single image using Optical Character Recognition (OCR).
 
     Args:
-        image_path: Path to the image file.
+        image: Path to the image file, or the already decoded image as a NumPy array.
 
     Returns:
         str: Extracted text from the image.
     """
 
-    # Initialize EasyOCR reader
-    reader = easyocr.Reader(['en'])
+    # Borrow a warm EasyOCR reader from the process-wide pool
+    with get_reader_pool().reader() as reader:
+        try:
+            # Perform OCR
+            with span("ocr_readtext"):
+                result = reader.readtext(image)
 
-    try:
-        # Perform OCR
-        result = reader.readtext(image_path)
+        # Handle errors during OCR processing
+        except Exception as e:
+            return f"Error: {e}"
 
-        # Extract text from the result
-        extracted_text = ' '.join([text[1] for text in result])
+    # Extract text from the result
+    extracted_text = ' '.join([text[1] for text in result])
+    OCR_TEXT_LENGTH.observe(len(extracted_text))
+    annotate(ocr_text_characters=len(extracted_text))
+
+    return extracted_text
+
+
+def process_ocr_fields(crops):
+    """
+    Reads the text of several field regions of one document.
+
+    Args:
+        crops (dict): Field name -> image region as a NumPy array (see `Field_Regions.crop_fields`).
+
+    Returns:
+        dict or str: Field name -> extracted text, or "Error: ..." if OCR failed.
+    """
+
+    fields = {}
+    # Borrow one warm reader for all the regions of the document
+    with get_reader_pool().reader() as reader:
+        try:
+            with span("ocr_fields"):
+                for name, crop in crops.items():
+                    fields[name] = ' '.join([text[1] for text in reader.readtext(crop)])
+
+        # Handle errors during OCR processing
+        except Exception as e:
+            return f"Error: {e}"
+
+    characters = sum(len(text) for text in fields.values())
+    OCR_TEXT_LENGTH.observe(characters)
+    annotate(ocr_text_characters=characters)
+    return fields
+
+
+def _load_for_ocr(image):
+    # Decode a path into a BGR array; arrays are passed through untouched
+    decoded = decode_image(image)
+    if decoded is None:
+        raise OSError(f"cannot decode image: {image}")
+    return decoded
+
+
+def process_ocr_batch(images, batch_size=8, n_width=None, n_height=None):
+    """
+    Processes several images with batched EasyOCR detection and recognition.
+
+    EasyOCR can only batch images of identical size, so images are grouped by
+    shape (or all resized to `n_width` x `n_height` when given) and each group
+    runs through a single `readtext_batched` call on one pooled reader.
+
+    Args:
+        images (list): Image file paths and/or decoded images as NumPy arrays.
+        batch_size (int, optional): Recognition batch size (default: 8).
+        n_width (int, optional): Width every image is resized to before detection.
+        n_height (int, optional): Height every image is resized to before detection.
+
+    Returns:
+        list: Extracted text per image, in input order ("Error: ..." for failed images).
+    """
+
+    texts = [None] * len(images)
+    groups = {}
+    for position, image in enumerate(images):
+        try:
+            decoded = _load_for_ocr(image)
+        except Exception as e:
+            texts[position] = f"Error: {e}"
+            continue
+        if n_width and n_height:
+            decoded = cv2.resize(decoded, (n_width, n_height))
+        groups.setdefault(decoded.shape, []).append((position, decoded))
+
+    with get_reader_pool().reader() as reader:
+        for members in groups.values():
+            positions = [position for position, _ in members]
+            try:
+                # Perform detection and recognition for the whole group at once
+                group_results = reader.readtext_batched(
+                    [decoded for _, decoded in members], batch_size=batch_size
+                )
+            except Exception as e:
+                for position in positions:
+                    texts[position] = f"Error: {e}"
+                continue
+            for position, result in zip(positions, group_results):
+                texts[position] = ' '.join([text[1] for text in result])
+
+    return texts
 
-        return extracted_text
 
-    # Handle errors during OCR processing
-    except Exception as e:
-        return f"Error: {e}"
-    
 def preprocess_text(text):
     """
     Preprocesses text by converting to lowercase, removing punctuation, and fixing typos (optional).
@@ -44,10 +136,11 @@ def preprocess_text(text):
         list: A list of words representing the preprocessed text.
     """
 
-    text = text.lower()
-    text = text.split()  # Split text into a list of words
-    text = list(filter(lambda item: (item.isalpha() and len(item)>1), text))
-    return text
+    return tokenize(text)
+
+def _as_matcher(keywords):
+    # Keyword lists passed by callers are compiled on the fly; prebuilt matchers are reused
+    return keywords if isinstance(keywords, KeywordMatcher) else KeywordMatcher(keywords)
 
 def check_keywords(text, keywords, threshold=0.05):
     """
@@ -55,26 +148,22 @@ def check_keywords(text, keywords, threshold=0.05):
 
     Args:
         text: The preprocessed text as a list of words.
-        keywords: A list of keywords to match against.
+        keywords: A list of keywords (or a prebuilt KeywordMatcher) to match against.
         threshold (optional): The minimum percentage of keywords that must be matched for successful classification (default: 0.05).
 
     Returns:
         bool: True if the percentage of matched keywords is greater than or equal to the threshold, False otherwise.
     """
-    matches = 0
-    for keyword in keywords:
-        if keyword in text:
-            matches += 1
-    return matches / len(keywords) >= threshold
+    score, _ = _as_matcher(keywords).score(text)
+    return score >= threshold
 
 def classify_document(text,keywords_list,threshold=0.05):
     """
     Classifies a document based on document type, keyword list, and threshold.
 
     Args:
-        text: The preprocessed text as a list of words.
-        document_type: The expected document type (e.g., "invoice", "prescription", "lab_report").
-        keywords_dict: A dictionary mapping document types to their keyword lists.
+        text: The raw extracted text.
+        keywords_list: A list of keywords (or a prebuilt KeywordMatcher) of the expected document type.
         threshold (optional): The minimum percentage of keywords that must be matched for successful classification (default: 0.05).
 
     Returns:
@@ -87,41 +176,107 @@ def classify_document(text,keywords_list,threshold=0.05):
     else:
         return False  # Document type not found or no keywords defined
 
-def OCR_MATCHING(document_type, image_path):
+
+# Keyword matchers per document type, compiled once at import
+# ("labreport" is the name used by Main and the upload form)
+KEYWORD_MATCHERS = {
+    "invoice": KeywordMatcher(invoice_keywords + general_keywords),
+    "prescription": KeywordMatcher(prescription_keywords + general_keywords),
+    "lab_report": KeywordMatcher(lab_report_keywords + general_keywords),
+    # Add other document types with their keyword lists here
+}
+KEYWORD_MATCHERS["labreport"] = KEYWORD_MATCHERS["lab_report"]
+
+
+def evaluate_text(extracted_text, matcher, threshold=0.05):
+    """
+    Turns extracted OCR text into the accept/reject result of `OCR_MATCHING`.
+
+    Args:
+        extracted_text (str): Text returned by `process_ocr` (or an "Error: ..." message).
+        matcher (KeywordMatcher): Keyword matcher of the expected document type.
+        threshold (optional): Minimum weighted fraction of keywords that must be matched (default: 0.05).
+
+    Returns:
+        list: A list containing three elements:
+            - A boolean classification result.
+            - An acceptance or rejection message.
+            - A dict with the keyword "score" and the "matched" keywords and their weights.
+    """
+
+    # Check if extracted text is empty (no characters)
+    if not re.search(r'\w', extracted_text):
+        return [False, "REJECTED !!! REASON : IMAGE NOT READABLE ! ", {"score": 0.0, "matched": {}}]
+
+    score, matched = matcher.score(preprocess_text(extracted_text))
+    details = {"score": score, "matched": matched}
+
+    if score >= threshold:
+        return [True, "ACCEPTED !!!", details]
+    return [False, "REJECTED !!! REASON : IMAGE NOT MATCHED DURING OCR MATCHING ! ", details]
+
+
+def OCR_MATCHING(document_type, image, extracted_text=None):
     """
     This function performs document classification using Optical Character Recognition (OCR).
 
     Args:
         document_type (str): The type of document to be classified (e.g., "invoice", "prescription", "lab_report").
-        image_path (str): The path to the image file containing the document text.
+        image (str or np.ndarray): The path to the image file containing the document text,
+                                   or the already decoded image.
+        extracted_text (str, optional): Text already extracted from the image (e.g. from the
+                                        result cache); OCR is skipped when given.
 
     Returns:
-        list: A list containing two elements:
+        list: A list containing three elements:
             - The first element is a boolean indicating classification success (True) or failure (False).
             - The second element is a string with the classification result or a rejection message.
+            - The third element is a dict with the keyword "score" and the "matched" keywords and weights.
     """
 
-    # Define a dictionary mapping document types to their keywords
-    keywords_dict = {
-        "invoice": invoice_keywords + general_keywords,
-        "prescription": prescription_keywords + general_keywords,
-        "lab_report": lab_report_keywords + general_keywords
-        # Add other document types with their keyword lists here
-    }
+    matcher = KEYWORD_MATCHERS[document_type]
     # Set a threshold for keyword matching accuracy (e.g., 0.05 for 5%)
     threshold = 0.05  # Adjust this value as needed
-    
+
     # Extract text from the image using an external OCR process (not shown)
-    extracted_text = process_ocr(image_path)
+    if extracted_text is None:
+        extracted_text = process_ocr(image)
 
-    # Check if extracted text is empty (no characters)
-    if not re.search(r'\w', extracted_text):
-        return [False, "REJECTED !!! REASON : IMAGE NOT READABLE ! "]  # Indicate rejection
+    return evaluate_text(extracted_text, matcher, threshold)
 
-    # Check if extracted text is a string (not an error message)
-    if isinstance(extracted_text, str):
-        classified = classify_document(extracted_text, keywords_dict[document_type], threshold)
 
-        return [True, "ACCEPTED !!!"] if classified else [False, "REJECTED !!! REASON : IMAGE NOT MATCHED DURING OCR MATCHING ! "]
-    else:
-        return [False, extracted_text]
+def OCR_MATCHING_BATCH(document_type, images, batch_size=8, chunk_size=32, n_width=None, n_height=None):
+    """
+    Classifies many documents with batched OCR, giving the same verdicts as `OCR_MATCHING`.
+
+    Args:
+        document_type (str): The type of the documents (e.g., "invoice", "prescription", "lab_report").
+        images (iterable): Image file paths and/or decoded images as NumPy arrays.
+        batch_size (int, optional): Recognition batch size (default: 8).
+        chunk_size (int, optional): Documents decoded and held in memory at once (default: 32).
+        n_width (int, optional): Width every image is resized to before detection.
+        n_height (int, optional): Height every image is resized to before detection.
+
+    Returns:
+        list: One dict per input document, in input order, with keys:
+            - "text": the extracted text (or an "Error: ..." message).
+            - "result": the [bool, message] classification, as returned by `OCR_MATCHING`.
+    """
+
+    matcher = KEYWORD_MATCHERS[document_type]
+    threshold = 0.05  # Same keyword threshold as the single-image path
+
+    results = []
+    chunk = []
+    for image in images:
+        chunk.append(image)
+        if len(chunk) == chunk_size:
+            results.extend(process_ocr_batch(chunk, batch_size, n_width, n_height))
+            chunk = []
+    if chunk:
+        results.extend(process_ocr_batch(chunk, batch_size, n_width, n_height))
+
+    return [
+        {"text": text, "result": evaluate_text(text, matcher, threshold)}
+        for text in results
+    ]
@@ -0,0 +1,146 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import easyocr
+from Instrumentation import observe_stage
+
+# Number of warm EasyOCR readers shared by the process (each holds its own models)
+POOL_SIZE = int(os.environ.get("OCR_READER_POOL_SIZE", "1"))
+
+# Languages loaded into every reader
+LANGUAGES = ["en"]
+
+
+class ReaderPool:
+    """
+    A thread-safe pool of warm `easyocr.Reader` instances.
+
+    Readers are created lazily, up to `size`, the first time they are needed
+    (or eagerly through `warm_up`) and are then reused across requests. A reader
+    is only ever used by one thread at a time.
+    """
+
+    def __init__(self, size=POOL_SIZE, languages=LANGUAGES):
+        self.size = max(1, size)
+        self.languages = languages
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._metrics = {
+            "pool_size": self.size,
+            "readers_loaded": 0,
+            "model_load_seconds_total": 0.0,
+            "model_load_seconds_last": None,
+            "acquisitions": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+        }
+
+    def _reserve_slot(self):
+        # Claim the right to create a new reader if the pool is not full yet
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return True
+            return False
+
+    def _create_reader(self):
+        start = time.perf_counter()
+        try:
+            reader = easyocr.Reader(self.languages)
+        except Exception:
+            with self._lock:
+                self._created -= 1  # Give the slot back so a later call can retry
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._metrics["readers_loaded"] += 1
+            self._metrics["model_load_seconds_total"] += elapsed
+            self._metrics["model_load_seconds_last"] = elapsed
+        observe_stage("ocr_model_load", elapsed)
+        return reader
+
+    def warm_up(self, count=None):
+        """
+        Loads readers ahead of the first request.
+
+        Args:
+            count (int, optional): Number of readers to load. Defaults to the pool size.
+        """
+
+        for _ in range(min(count or self.size, self.size)):
+            if not self._reserve_slot():
+                break
+            self._idle.put(self._create_reader())
+
+    @contextmanager
+    def reader(self, timeout=None):
+        """
+        Borrows a reader for the duration of a `with` block.
+
+        Args:
+            timeout (float, optional): Seconds to wait for an idle reader. Waits forever by default.
+
+        Yields:
+            easyocr.Reader: A reader reserved for the caller.
+
+        Raises:
+            queue.Empty: If no reader became available within `timeout`.
+        """
+
+        wait = 0.0
+        try:
+            reader = self._idle.get_nowait()
+        except queue.Empty:
+            if self._reserve_slot():
+                reader = self._create_reader()
+            else:
+                # Every reader is busy: queue up behind the other requests
+                start = time.perf_counter()
+                reader = self._idle.get(timeout=timeout)
+                wait = time.perf_counter() - start
+
+        with self._lock:
+            self._metrics["acquisitions"] += 1
+            self._metrics["queue_wait_seconds_total"] += wait
+            self._metrics["queue_wait_seconds_max"] = max(self._metrics["queue_wait_seconds_max"], wait)
+        observe_stage("ocr_queue_wait", wait)
+
+        try:
+            yield reader
+        finally:
+            self._idle.put(reader)
+
+    def metrics(self):
+        """
+        Returns a snapshot of the pool's model load and queue wait metrics.
+
+        Returns:
+            dict: Counters and timings (in seconds) of the pool.
+        """
+
+        with self._lock:
+            snapshot = dict(self._metrics)
+        snapshot["readers_idle"] = self._idle.qsize()
+        return snapshot
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_reader_pool():
+    """
+    Returns the process-wide reader pool, creating it on first use.
+
+    Returns:
+        ReaderPool: The shared pool.
+    """
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ReaderPool()
+        return _pool
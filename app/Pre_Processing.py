@@ -1,58 +1,125 @@
 import cv2
 import numpy as np
+from Image_Loading import to_grayscale
+from Instrumentation import span
 
-def correct_skew(image):
+def _projection_scores(ys, xs, angles, n_bins):
     """
-    Corrects skew (tilting) in an image using OpenCV.
+    Scores candidate rotations by the sharpness of their horizontal projection profiles.
+
+    All angles are evaluated at once: every foreground pixel is projected onto the
+    rotated vertical axis for every angle, and one `np.bincount` builds all profiles.
 
     Args:
-        image (np.ndarray): The input image as a NumPy array. Can be grayscale or BGR color format.
+        ys (np.ndarray): Row coordinates of foreground pixels, relative to the image centre.
+        xs (np.ndarray): Column coordinates of foreground pixels, relative to the image centre.
+        angles (np.ndarray): Candidate angles in degrees (same convention as cv2.getRotationMatrix2D).
+        n_bins (int): Number of rows in each projection profile.
+
+    Returns:
+        np.ndarray: One score per angle; higher means better aligned text lines.
+    """
+
+    radians = np.deg2rad(angles)[:, None]
+    # Row of every pixel after rotating by each angle (cv2 rotation convention)
+    rows = np.floor(ys * np.cos(radians) - xs * np.sin(radians) + 0.5).astype(np.int64) + n_bins // 2
+    np.clip(rows, 0, n_bins - 1, out=rows)
+    rows += (np.arange(len(angles)) * n_bins)[:, None]
+
+    profiles = np.bincount(rows.ravel(), minlength=len(angles) * n_bins)
+    profiles = profiles.reshape(len(angles), n_bins).astype(float)
+
+    # Well-aligned lines give abrupt changes between consecutive rows of the profile
+    return np.sum(np.diff(profiles, axis=1) ** 2, axis=1)
+
+
+def estimate_skew(image, max_angle=5.0, coarse_step=1.0, fine_step=0.1, max_dim=800, max_points=100000):
+    """
+    Estimates the skew angle of a document with a coarse-to-fine projection profile search.
+
+    Args:
+        image (np.ndarray): The input image (grayscale or BGR).
+        max_angle (float, optional): Largest skew searched, in degrees either way. Defaults to 5.0.
+        coarse_step (float, optional): Angle step of the coarse search. Defaults to 1.0.
+        fine_step (float, optional): Angle step of the refinement around the coarse best. Defaults to 0.1.
+        max_dim (int, optional): The image is downsampled so its longer side is at most this. Defaults to 800.
+        max_points (int, optional): Cap on the foreground pixels used for the profiles. Defaults to 100000.
 
     Returns:
         tuple: A tuple containing two elements:
-            - The corrected (rotated) image as a NumPy array.
-            - The estimated skew angle in degrees (float).
+            - The estimated skew angle in degrees (float), to be passed to cv2.getRotationMatrix2D.
+            - A confidence in [0, 1]: how much the best angle stands out from the others.
     """
 
-    # Handle color conversion if necessary
-    if len(image.shape) == 2:
-        # Grayscale image detected, convert to BGR for OpenCV compatibility
-        color_image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-    else:
-        # Color image assumed to be in BGR format (blue, green, red)
-        color_image = image
+    gray = to_grayscale(image)
 
-    # Convert the image to grayscale for better skew detection
-    gray = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY)
+    # Downsample first; the angle does not depend on resolution
+    scale = max_dim / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
 
-    # Apply Otsu's thresholding to create a binary image for edge detection
+    # Apply Otsu's thresholding to separate ink (white) from background (black)
     thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
-    #   - thresh: The resulting binary image after thresholding.
-    #   - cv2.THRESH_BINARY_INV: Inverts the thresholding result (darker pixels to white, lighter to black).
-    #   - cv2.THRESH_OTSU: Applies Otsu's method for automatic threshold selection.
 
-    # Calculate projection profile to estimate skew angle
-    h, w = thresh.shape  # Get image height and width
+    h, w = thresh.shape
+    ys, xs = np.nonzero(thresh)
+    ys = ys - h // 2
+    xs = xs - w // 2
+
+    # Keep a centred disc only: its outline looks the same at every angle, whereas
+    # the straight page border would always favour the unrotated profile
+    radius = min(h, w) // 2
+    inside = ys ** 2 + xs ** 2 <= radius ** 2
+    ys, xs = ys[inside], xs[inside]
+
+    if len(ys) == 0:
+        return 0.0, 0.0  # Blank page: nothing to align
+    if len(ys) > max_points:
+        stride = len(ys) // max_points + 1
+        ys, xs = ys[::stride], xs[::stride]
+
+    n_bins = 2 * radius + 3
+
+    # Coarse search over the whole range
+    coarse = np.arange(-max_angle, max_angle + coarse_step / 2, coarse_step)
+    coarse_scores = _projection_scores(ys, xs, coarse, n_bins)
+    best = coarse[np.argmax(coarse_scores)]
 
-    scores = []  # List to store scores for different skew angles
-    angles = np.arange(-5, 6, 1)  # Range of angles to search for skew (-5 to +5 degrees in steps of 1)
+    # Fine search around the coarse optimum
+    fine = np.arange(best - coarse_step, best + coarse_step + fine_step / 2, fine_step)
+    fine = fine[np.abs(fine) <= max_angle + 1e-9]
+    fine_scores = _projection_scores(ys, xs, fine, n_bins)
+    best_angle = float(np.round(fine[np.argmax(fine_scores)], 2))
 
-    for angle in angles:
-        # Rotate the thresholded image to analyze projection profile
-        rotated = cv2.rotate(thresh, cv2.ROTATE_90_CLOCKWISE, dst=thresh)  # Create a rotated copy to avoid modifying thresh
+    peak = fine_scores.max()
+    confidence = float((peak - np.median(coarse_scores)) / peak) if peak > 0 else 0.0
+
+    return best_angle, max(0.0, min(1.0, confidence))
+
+
+def correct_skew(image, min_confidence=0.35):
+    """
+    Corrects skew (tilting) in an image using OpenCV.
 
-        # Calculate projection histogram: sum pixel intensities along columns
-        hist = np.sum(rotated, axis=1, dtype=float)
+    Args:
+        image (np.ndarray): The input image as a NumPy array. Can be grayscale or BGR color format.
+        min_confidence (float, optional): Estimates less confident than this are not applied. Defaults to 0.35,
+            which skips the unreliable estimates on thumbnails (see `Benchmark.py --stages correct_skew`).
 
-        # Calculate projection score based on difference between consecutive histogram elements
-        # Higher score indicates potentially better alignment after rotation due to more significant intensity changes.
-        score = np.sum((hist[1:] - hist[:-1]) ** 2, dtype=float)
-        scores.append(score)
+    Returns:
+        tuple: A tuple containing two elements:
+            - The corrected (rotated) image as a NumPy array.
+            - The estimated skew angle in degrees (float).
+    """
 
-    # Find the angle with the maximum projection profile difference (indicating alignment)
-    best_angle = angles[scores.index(max(scores))]
+    best_angle, confidence = estimate_skew(image)
+    if confidence < min_confidence:
+        best_angle = 0.0  # No clear text-line structure: leave the image as it is
+    if best_angle == 0:
+        return image, best_angle  # Already straight: skip the full-resolution warp
 
     # Correct image skew by rotating it
+    h, w = image.shape[:2]
     center = (w // 2, h // 2)  # Calculate image center coordinates
     M = cv2.getRotationMatrix2D(center, best_angle, 1.0)  # Create rotation matrix for specified angle
     corrected = cv2.warpAffine(
@@ -92,12 +159,12 @@ def variance_of_laplacian(image):
     return var
 
 
-def preprocess_image(image_path, apply_binarization=False, blur_threshold=50):
+def preprocess_image(image, apply_binarization=False, blur_threshold=50):
     """
     Preprocesses an image for improved OCR performance.
 
     Args:
-        image_path (str): Path to the image file.
+        image (str or np.ndarray): Path to the image file, or the already decoded image.
         apply_binarization (bool, optional): Whether to apply binarization (thresholding) to the image. Defaults to False.
         blur_threshold (int, optional): The minimum acceptable variance of Laplacian for blur detection.
         Images with a variance below this threshold are considered too blurry and rejected. Defaults to 50.
@@ -108,11 +175,15 @@ def preprocess_image(image_path, apply_binarization=False, blur_threshold=50):
             - The second element is a string with either "ACCEPTED" or a rejection message if the image is too blurry.
     """
 
-    # Load the image in grayscale mode for better OCR performance
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    # Work in grayscale for better OCR performance (decoding only if given a path)
+    if isinstance(image, str):
+        img = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+    else:
+        img = to_grayscale(image)
 
     # Correct skew (optional): You might need to implement the `correct_skew` function if needed
-    corrected_image, skew_angle = correct_skew(img)  # Replace with your skew correction implementation
+    with span("skew_correction"):
+        corrected_image, skew_angle = correct_skew(img)  # Replace with your skew correction implementation
 
     # Apply binarization (thresholding) if desired
     if apply_binarization:
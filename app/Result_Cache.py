@@ -0,0 +1,310 @@
+import os
+import sys
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Enable (1) or disable (0) caching of pipeline results
+CACHE_ENABLED = os.environ.get("CHECK_CACHE", "1") == "1"
+
+# Entries kept in the in-memory LRU tier
+MEMORY_ENTRIES = int(os.environ.get("CHECK_CACHE_SIZE", 256))
+
+# Bytes of values kept in the in-memory LRU tier of each process (the descriptors of one
+# upload take up to about a megabyte)
+MEMORY_BYTES = int(os.environ.get("CHECK_CACHE_MEMORY_BYTES", 256 << 20))
+
+# Entries kept in the on-disk tier before the least recently used ones are pruned
+DISK_ENTRIES = int(os.environ.get("CHECK_CACHE_DISK_ENTRIES", 100000))
+
+# Bytes of pickled values kept in the on-disk tier; image descriptors take up to about
+# a megabyte per upload, so the entry count alone does not bound the file
+DISK_BYTES = int(os.environ.get("CHECK_CACHE_DISK_BYTES", 1 << 30))
+
+# Location of the on-disk tier
+CACHE_PATH = os.environ.get(
+    "CHECK_CACHE_PATH",
+    os.path.abspath(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RESULT_CACHE", "results.sqlite3")
+    ),
+)
+
+# Number of writes (or fraction of DISK_BYTES written) between two prunes of the on-disk tier
+PRUNE_EVERY = 100
+PRUNE_BYTES_FRACTION = 0.05
+
+# Returned by `ResultCache.get` on a miss, so that None can be cached like any other value
+MISS = object()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def image_digest(image):
+    """
+    Returns the content address of a decoded image.
+
+    The hash covers the decoded pixels rather than the uploaded file, so the same
+    scan re-encoded or re-uploaded under another name maps to the same key.
+
+    Args:
+        image (np.ndarray): The decoded image.
+
+    Returns:
+        str: Hex SHA-256 digest of the image shape, dtype and pixels.
+    """
+
+    digest = hashlib.sha256(f"{image.shape}:{image.dtype};".encode())
+    digest.update(memoryview(image if image.flags.c_contiguous else image.copy()))
+    return digest.hexdigest()
+
+
+def value_size(value):
+    """
+    Estimates the memory held by a cached value.
+
+    Arrays count their buffers; containers count their items recursively.
+
+    Args:
+        value: A cached value (verdicts, OCR text, descriptor arrays...).
+
+    Returns:
+        int: Approximate size in bytes.
+    """
+
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(value_size(key) + value_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(value_size(item) for item in value)
+    return size
+
+
+def version_tag(*parts):
+    """
+    Combines the settings a cached value depends on into one short tag.
+
+    Args:
+        *parts: Anything with a stable `repr` (versions, thresholds, modes...).
+
+    Returns:
+        str: A 16 character fingerprint; a changed setting gives a different tag.
+    """
+
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    A two-tier cache of pipeline results keyed by image content.
+
+    Values live in a bounded in-memory LRU and in a sqlite file that survives
+    restarts. Every entry is stored with the version tag of the settings that
+    produced it; a lookup with a different tag (e.g. after the template library
+    or a threshold changed) is a miss, and the stale entry is overwritten.
+    """
+
+    def __init__(self, path=CACHE_PATH, memory_entries=MEMORY_ENTRIES, disk_entries=DISK_ENTRIES, disk_bytes=DISK_BYTES,
+                 memory_bytes=MEMORY_BYTES):
+        """
+        Args:
+            path (str, optional): sqlite file of the disk tier, or None for memory only. Defaults to CACHE_PATH.
+            memory_entries (int, optional): Capacity of the LRU tier, in entries. Defaults to MEMORY_ENTRIES.
+            disk_entries (int, optional): Capacity of the disk tier, in entries. Defaults to DISK_ENTRIES.
+            disk_bytes (int, optional): Capacity of the disk tier, in bytes of stored values. Defaults to DISK_BYTES.
+            memory_bytes (int, optional): Capacity of the LRU tier, in bytes (see `value_size`). Defaults to MEMORY_BYTES.
+        """
+
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.disk_entries = disk_entries
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()  # (kind, key) -> (version, value, size)
+        self._memory_size = 0  # Bytes of the values in `_memory`
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._written_bytes = 0  # Since the last prune
+        self._metrics = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "writes": 0,
+            "lookup_seconds_total": 0.0,
+        }
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Several processes (e.g. batch workers) may share the file; wait for their writes
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "kind TEXT, key TEXT, version TEXT, value BLOB, accessed REAL, size INTEGER, "
+                "PRIMARY KEY (kind, key))"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(entries)")]
+            if "size" not in columns:
+                # Files written before the byte cap
+                self._db.execute("ALTER TABLE entries ADD COLUMN size INTEGER")
+                self._db.execute("UPDATE entries SET size = length(value)")
+            self._db.commit()
+
+    def _remember(self, kind, key, version, value):
+        # Called with the lock held: insert into the LRU tier and evict the oldest entries,
+        # in entries and in bytes (a value larger than the whole tier is not kept)
+        size = value_size(value)
+        previous = self._memory.pop((kind, key), None)
+        if previous is not None:
+            self._memory_size -= previous[2]
+        self._memory[(kind, key)] = (version, value, size)
+        self._memory_size += size
+        while self._memory and (len(self._memory) > self.memory_entries or self._memory_size > self.memory_bytes):
+            self._memory_size -= self._memory.popitem(last=False)[1][2]
+
+    def _execute(self, statement, parameters):
+        # Called with the lock held: a write the cache can live without if the file stays locked
+        try:
+            self._db.execute(statement, parameters)
+            self._db.commit()
+        except sqlite3.OperationalError:
+            self._db.rollback()
+
+    def get(self, kind, key, version):
+        """
+        Looks up a cached value.
+
+        Args:
+            kind (str): Value family, e.g. "check", "ocr" or "descriptors".
+            key (str): Content address, see `image_digest`.
+            version (str): Version tag the value must have been stored with.
+
+        Returns:
+            The cached value, or MISS on a miss.
+        """
+
+        start = time.perf_counter()
+        with self._lock:
+            try:
+                entry = self._memory.get((kind, key))
+                if entry is not None and entry[0] == version:
+                    self._memory.move_to_end((kind, key))
+                    self._metrics["memory_hits"] += 1
+                    return entry[1]
+
+                row = None
+                if self._db is not None:
+                    try:
+                        row = self._db.execute(
+                            "SELECT version, value FROM entries WHERE kind = ? AND key = ?", (kind, key)
+                        ).fetchone()
+                    except sqlite3.OperationalError:
+                        row = None  # Locked by another process: treat as a miss
+                if row is not None and row[0] == version:
+                    value = pickle.loads(row[1])
+                    self._execute(
+                        "UPDATE entries SET accessed = ? WHERE kind = ? AND key = ?", (time.time(), kind, key)
+                    )
+                    self._remember(kind, key, version, value)
+                    self._metrics["disk_hits"] += 1
+                    return value
+
+                if entry is not None or row is not None:
+                    self._metrics["stale"] += 1  # Produced under other settings
+                self._metrics["misses"] += 1
+                return MISS
+            finally:
+                self._metrics["lookup_seconds_total"] += time.perf_counter() - start
+
+    def put(self, kind, key, version, value):
+        """
+        Stores a value in both tiers.
+
+        Args:
+            kind (str): Value family, e.g. "check", "ocr" or "descriptors".
+            key (str): Content address, see `image_digest`.
+            version (str): Version tag of the settings that produced the value.
+            value: Any picklable value.
+        """
+
+        with self._lock:
+            self._remember(kind, key, version, value)
+            self._metrics["writes"] += 1
+            if self._db is None:
+                return
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            self._execute(
+                "INSERT OR REPLACE INTO entries (kind, key, version, value, accessed, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, version, data, time.time(), len(data)),
+            )
+            self._writes += 1
+            self._written_bytes += len(data)
+            if self._writes % PRUNE_EVERY == 0 or self._written_bytes > self.disk_bytes * PRUNE_BYTES_FRACTION:
+                self._prune()
+
+    def _prune(self):
+        # Called with the lock held: drop the least recently used rows beyond the disk capacity,
+        # in entries and in bytes
+        self._execute(
+            "DELETE FROM entries WHERE rowid IN ("
+            "SELECT rowid FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.disk_entries,),
+        )
+        self._execute(
+            "DELETE FROM entries WHERE rowid IN ("
+            "SELECT rowid FROM (SELECT rowid, SUM(size) OVER (ORDER BY accessed DESC ROWS UNBOUNDED PRECEDING) AS total "
+            "FROM entries) WHERE total > ?)",
+            (self.disk_bytes,),
+        )
+        self._written_bytes = 0
+
+    def clear(self):
+        """
+        Removes every entry from both tiers.
+        """
+
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries")
+                self._db.commit()
+
+    def metrics(self):
+        """
+        Returns hit/miss counters of the cache.
+
+        Returns:
+            dict: Memory and disk hits, misses (of which "stale" were version
+                  mismatches), writes, hit ratio, lookup time, and entries and bytes in memory.
+        """
+
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["memory_entries"] = len(self._memory)
+            metrics["memory_bytes"] = self._memory_size
+        lookups = metrics["memory_hits"] + metrics["disk_hits"] + metrics["misses"]
+        metrics["hit_ratio"] = (metrics["memory_hits"] + metrics["disk_hits"]) / lookups if lookups else 0.0
+        return metrics
+
+
+def get_result_cache():
+    """
+    Returns the process-wide result cache, or None if caching is disabled (CHECK_CACHE=0).
+
+    Returns:
+        ResultCache or None: The shared cache.
+    """
+
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from Descriptor_Store import get_descriptor_store
+from Layout_Hash import get_layout_index, hamming_distances
+from Template_Matching import match_descriptors
+
+# Bump whenever the clustering or the file layout changes
+CLUSTER_VERSION = 1
+
+# Only template pairs whose perceptual hashes differ by at most this many bits are compared
+CLUSTER_RADIUS = 16
+
+# Good matches two templates must share to be put in the same cluster
+LINK_MATCHES = int(os.environ.get("CHECK_CLUSTER_LINK", 25))
+
+# A cluster is searched when its representative reaches this fraction of the threshold...
+DESCEND_RATIO = float(os.environ.get("CHECK_CLUSTER_DESCEND_RATIO", 0.5))
+
+# ...or is among the best-scoring representatives
+DESCEND_TOP = int(os.environ.get("CHECK_CLUSTER_DESCEND_TOP", 3))
+
+_clusters = {}
+_clusters_lock = threading.Lock()
+
+
+class TemplateClusters:
+    """
+    Groups of near-identical templates of one folder, each with a representative.
+
+    Every member shares at least `link_matches` good matches with its
+    representative, so an upload resembling a member also scores on the
+    representative; matching compares the representatives first and only
+    descends into the clusters whose representative came close.
+    """
+
+    def __init__(self, store, clusters):
+        self.store = store
+        self.members = clusters  # representative -> member names (without the representative)
+        self.representatives = list(clusters)
+
+    def __len__(self):
+        return len(self.representatives)
+
+    def descend(self, scores, threshold, ratio=DESCEND_RATIO, top=DESCEND_TOP):
+        """
+        Lists the members worth comparing after the representatives were scored.
+
+        Args:
+            scores (dict): Representative name -> good matches with the image.
+            threshold (int): Matches needed to accept a template.
+            ratio (float, optional): Clusters whose representative reached `ratio * threshold`
+                                     are searched. Defaults to DESCEND_RATIO.
+            top (int, optional): The `top` best-scoring clusters are searched regardless. Defaults to DESCEND_TOP.
+
+        Returns:
+            list: Member names, most promising cluster first.
+        """
+
+        ranked = sorted(
+            (name for name in self.representatives if self.members[name]),
+            key=lambda name: -scores.get(name, 0),
+        )
+        names = []
+        for position, name in enumerate(ranked):
+            if position >= top and scores.get(name, 0) < ratio * threshold:
+                break
+            names.extend(self.members[name])
+        return names
+
+
+def _clusters_path(store):
+    return os.path.join(store.directory, "clusters.json")
+
+
+def _read_clusters(store, link_matches):
+    path = _clusters_path(store)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        saved = json.load(f)
+    if saved.get("version") != CLUSTER_VERSION or saved.get("params") != _params(link_matches):
+        return None
+    return saved
+
+
+def _params(link_matches):
+    return {"radius": CLUSTER_RADIUS, "link_matches": link_matches}
+
+
+def _star_clusters(names, links):
+    # Most connected templates become representatives and take their unassigned neighbours
+    clusters, assigned = {}, set()
+    for name in sorted(names, key=lambda name: (-len(links[name]), name)):
+        if name in assigned:
+            continue
+        clusters[name] = sorted(neighbour for neighbour in links[name] if neighbour not in assigned)
+        assigned.add(name)
+        assigned.update(clusters[name])
+    return clusters
+
+
+def build_template_clusters(template_folder, engine="sift", link_matches=LINK_MATCHES, force=False):
+    """
+    Builds or incrementally updates the template clusters of a folder.
+
+    Candidate pairs come from the perceptual hashes (see `Layout_Hash`) and are
+    confirmed by descriptor matching. Confirmed links are saved in `clusters.json`
+    next to the descriptor store; after a library change only the pairs
+    involving new or modified templates are matched again.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+        engine (str, optional): Feature engine of the descriptor store. Defaults to "sift".
+        link_matches (int, optional): Good matches linking two templates. Defaults to LINK_MATCHES.
+        force (bool, optional): Match every candidate pair again. Defaults to False.
+
+    Returns:
+        dict: The saved clusters: "clusters" (representative -> members), "links" and metadata.
+    """
+
+    store = get_descriptor_store(template_folder, engine=engine)
+    saved = None if force else _read_clusters(store, link_matches)
+    if saved is not None and saved["library_version"] == store.library_version:
+        return saved
+
+    templates = {entry["name"]: [entry["size"], entry["mtime_ns"]] for entry in store.manifest["templates"]}
+    unchanged = set()
+    old_links = []
+    if saved is not None:
+        unchanged = {name for name, info in templates.items() if saved["templates"].get(name) == info}
+        old_links = [(a, b) for a, b in saved["links"] if a in unchanged and b in unchanged]
+
+    layout = get_layout_index(template_folder)
+    perceptual = dict(zip(layout.names, layout.perceptual_hashes))
+    names = [name for name in store.names if name in perceptual]
+    hashes = np.array([perceptual[name] for name in names], dtype=np.uint64)
+
+    links = {name: set() for name in store.names}
+    for a, b in old_links:
+        links[a].add(b)
+        links[b].add(a)
+    for position, name in enumerate(names):
+        distances = hamming_distances(hashes[position + 1:], perceptual[name])
+        for offset in (distances <= CLUSTER_RADIUS).nonzero()[0]:
+            other = names[position + 1 + offset]
+            if name in unchanged and other in unchanged:
+                continue  # Already decided by the previous build
+            count = match_descriptors(store.descriptors_for(name), store.descriptors_for(other), engine)
+            if count >= link_matches:
+                links[name].add(other)
+                links[other].add(name)
+
+    saved = {
+        "version": CLUSTER_VERSION,
+        "params": _params(link_matches),
+        "created": time.time(),
+        "library_version": store.library_version,
+        "templates": templates,
+        "links": sorted([a, b] for a in links for b in links[a] if a < b),
+        "clusters": _star_clusters(store.names, links),
+    }
+    path = _clusters_path(store)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(saved, f)
+    os.replace(tmp_path, path)
+    return saved
+
+
+def get_template_clusters(template_folder, engine="sift"):
+    """
+    Returns the template clusters of a folder, building them if needed.
+
+    Clusters are rebuilt (incrementally) whenever the underlying descriptor
+    store changes. The first build of a large library takes a while; run
+    `python Template_Clusters.py` ahead of time.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+        engine (str, optional): Feature engine of the descriptor store. Defaults to "sift".
+
+    Returns:
+        TemplateClusters: The clusters of the folder's current descriptor store.
+    """
+
+    store = get_descriptor_store(template_folder, engine=engine)
+    with _clusters_lock:
+        cached = _clusters.get(store.directory)
+        if cached is None or cached.store is not store:
+            saved = build_template_clusters(template_folder, engine)
+            cached = TemplateClusters(store, saved["clusters"])
+            _clusters[store.directory] = cached
+        return cached
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Cluster every bundled template library, for the engines given on the command line (default: sift)
+    for engine in sys.argv[1:] or ["sift"]:
+        for folder in ("INVOICES", "PRESCRIPTIONS", "LABREPORTS"):
+            start = time.perf_counter()
+            saved = build_template_clusters(folder, engine)
+            sizes = sorted((len(members) + 1 for members in saved["clusters"].values()), reverse=True)
+            print(
+                f"{folder} [{engine}]: {sum(sizes)} templates in {len(sizes)} clusters "
+                f"({sum(1 for size in sizes if size > 1)} with several templates, largest {sizes[0] if sizes else 0}) "
+                f"({time.perf_counter() - start:.1f}s)"
+            )
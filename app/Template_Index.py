@@ -0,0 +1,155 @@
+import os
+import threading
+import numpy as np
+import cv2
+from Descriptor_Store import get_descriptor_store
+from Feature_Extraction import FEATURE_ENGINES, descriptor_dtype
+
+# FLANN parameters of the global index: a KD-tree for SIFT (same algorithm as the
+# per-template matcher) and multi-probe LSH for the binary (Hamming) engines
+INDEX_PARAMS = dict(algorithm=1, trees=4)
+# (20-bit keys without multi-probe: ~25 ms per query over ~500k ORB descriptors, against
+# ~2 s with 12-bit keys, and the same best-voted templates)
+LSH_INDEX_PARAMS = dict(algorithm=6, table_number=6, key_size=20, multi_probe_level=0)
+SEARCH_PARAMS = dict(checks=64)
+
+# Neighbours retrieved per query descriptor across the whole library
+NEIGHBOURS = 16
+
+# Lowe's ratio used by `Template_Matching.match_descriptors`
+RATIO = 0.7
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class TemplateIndex:
+    """
+    A single FLANN index over the stacked descriptors of every template in a folder.
+
+    Each indexed row remembers its owning template, so one kNN query of the
+    uploaded image's descriptors yields per-template vote counts.
+    """
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.template_ids = store.template_ids()
+        self.binary = FEATURE_ENGINES[store.engine]["binary"]
+
+    def votes(self, image_descriptors, neighbours=NEIGHBOURS):
+        """
+        Counts, per template, the image descriptors that pass the ratio test.
+
+        For a template that occurs twice among a descriptor's neighbours, its two
+        nearest rows give the ratio directly. If it occurs once, its second-nearest
+        row lies beyond the last neighbour, so that distance is used as a bound.
+        This mirrors the per-template ratio test without searching each template.
+
+        Args:
+            image_descriptors (np.ndarray): Descriptors of the preprocessed image.
+            neighbours (int, optional): Neighbours retrieved per descriptor. Defaults to NEIGHBOURS.
+
+        Returns:
+            np.ndarray: Vote count per template, aligned with `store.names`.
+        """
+
+        votes = np.zeros(len(self.store), dtype=np.int64)
+        if image_descriptors is None or len(image_descriptors) == 0 or len(self.template_ids) == 0:
+            return votes
+
+        k = min(neighbours, len(self.template_ids))
+        rows, dists = self.index.knnSearch(
+            np.ascontiguousarray(image_descriptors, dtype=descriptor_dtype(self.store.engine)), k, params=SEARCH_PARAMS
+        )
+        if self.binary:
+            # Hamming distances; LSH leaves unfilled neighbour slots at -1
+            dists = np.where(rows < 0, np.inf, dists.astype(np.float64))
+            rows = np.where(rows < 0, 0, rows)
+        else:
+            dists = np.sqrt(dists.astype(np.float64))  # FLANN returns squared L2 distances
+        tids = self.template_ids[rows]
+
+        # Group each descriptor's neighbours by template, keeping distance order within a group
+        tids = np.where(np.isinf(dists), len(self.store), tids)  # Missing neighbours form their own group
+        order = np.argsort(tids, axis=1, kind="stable")
+        tids = np.take_along_axis(tids, order, axis=1)
+        dists = np.take_along_axis(dists, order, axis=1)
+
+        first = np.ones(tids.shape, dtype=bool)
+        first[:, 1:] = tids[:, 1:] != tids[:, :-1]
+        next_same = np.zeros(tids.shape, dtype=bool)
+        next_same[:, :-1] = tids[:, 1:] == tids[:, :-1]
+
+        # Second-nearest distance within the template, or the farthest neighbour as a bound
+        second = np.empty_like(dists)
+        second[:, :-1] = dists[:, 1:]
+        farthest = np.where(np.isinf(dists), -np.inf, dists).max(axis=1, keepdims=True)
+        second = np.where(next_same, second, farthest)
+
+        good = first & (dists < RATIO * second) & (tids < len(self.store))
+        votes += np.bincount(tids[good], minlength=len(self.store))[:len(self.store)]
+        return votes
+
+    def shortlist(self, image_descriptors, top_k=20):
+        """
+        Ranks templates by their votes for the image.
+
+        Args:
+            image_descriptors (np.ndarray): Descriptors of the preprocessed image.
+            top_k (int, optional): Maximum number of templates returned. Defaults to 20.
+
+        Returns:
+            list: (template name, vote count) tuples with at least one vote, best first.
+        """
+
+        votes = self.votes(image_descriptors)
+        ranked = np.argsort(-votes, kind="stable")[:top_k]
+        return [(self.store.names[i], int(votes[i])) for i in ranked if votes[i] > 0]
+
+
+def _build_index(store):
+    if len(store.descriptors) == 0:
+        return None  # Nothing to index; `votes` short-circuits on an empty store
+
+    # FLANN keeps a pointer to the rows, which the store keeps alive
+    descriptors = store.matching_descriptors()
+    if FEATURE_ENGINES[store.engine]["binary"]:
+        # OpenCV cannot reload saved LSH indexes, so they are rebuilt per process (about a second)
+        return cv2.flann_Index(np.ascontiguousarray(descriptors), LSH_INDEX_PARAMS)
+
+    # Reuse the index saved next to the store arrays when it belongs to the same build
+    path = os.path.join(store.directory, f"flann-{store.manifest['arrays']}.idx")
+    index = cv2.flann_Index()
+    if os.path.isfile(path) and index.load(descriptors, path):
+        return index
+
+    index = cv2.flann_Index(descriptors, INDEX_PARAMS)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    index.save(tmp_path)
+    os.replace(tmp_path, path)
+    return index
+
+
+def get_template_index(template_folder, engine="sift"):
+    """
+    Returns the global FLANN index of a template folder, building it if needed.
+
+    The index is rebuilt whenever the underlying descriptor store changes and is
+    persisted next to the store, so other processes only have to load it.
+
+    Args:
+        template_folder (str): Name or path of the template folder.
+        engine (str, optional): Feature engine of the descriptor store. Defaults to "sift".
+
+    Returns:
+        TemplateIndex: The index for the folder's current descriptor store.
+    """
+
+    store = get_descriptor_store(template_folder, engine=engine)
+    with _indexes_lock:
+        cached = _indexes.get(store.directory)
+        if cached is None or cached.store is not store:
+            cached = TemplateIndex(store, _build_index(store))
+            _indexes[store.directory] = cached
+        return cached
@@ -1,166 +1,429 @@
 import cv2
-import os
-from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from PIL import Image
+from Image_Loading import decode_image
+from Image_Normalisation import archive_png
+from Feature_Extraction import FEATURE_ENGINES, prepare_image, extract_features, match_profile, coarse_profile
+from Descriptor_Store import get_descriptor_store
+from Template_Index import get_template_index
+from Layout_Hash import get_layout_index, perceptual_hash
+from Instrumentation import span, annotate, observe_stage, KEYPOINTS, TEMPLATES_COMPARED
+
+_process_pools = {}
+_process_pools_lock = threading.Lock()
 
 
 def delete_icc_profile(image_path):
     """
     Removes the ICC profile from a PNG image using Pillow.
 
+    Matching never needs this (OpenCV ignores ICC profiles); the file is only
+    rewritten, with fast compression, when it actually carries a profile.
+
     Args:
         image_path (str): Path to the image file.
+
+    Returns:
+        bool: True if a profile was removed.
+    """
+
+    # Open the image using Pillow; only the header (where the profile lives) is read
+    with Image.open(image_path) as img:
+        # Check if the 'icc_profile' key exists in the metadata
+        if "icc_profile" not in img.info:
+            return False
+        img.load()
+
+        # Save the image back to the same path without the ICC profile, in its own colour mode
+        archive_png(img, image_path, keep_mode=True)
+    return True
+
+
+def preprocess_image(image, profile=None):
     """
+    Preprocesses an image for template matching.
 
-    # Open the image using Pillow
-    img = Image.open(image_path)
+    The file is decoded in memory and never rewritten; OpenCV ignores embedded
+    ICC profiles, so they do not have to be stripped first.
 
-    # Access the image metadata dictionary
-    info = img.info
+    Args:
+        image (str or np.ndarray): Path to the image file, or the already decoded image.
+        profile (dict, optional): Matching profile (see `Feature_Extraction.match_profile`).
+                                  Defaults to the default profile.
+
+    Returns:
+        np.ndarray: Grayscale and resized image for template matching.
+    """
 
-    # Check if the 'icc_profile' key exists in the metadata
-    if "icc_profile" in info:
-        # If it exists, remove the ICC profile data using pop
-        info.pop("icc_profile", None)
+    # Read the image in BGR color space using OpenCV, unless it is already decoded
+    if isinstance(image, str):
+        image = decode_image(image)
 
-    # Save the image back to the same path without the ICC profile
-    img.save(image_path)
+    # Convert the image to grayscale and resize it to the matching dimensions
+    return prepare_image(image, profile)
 
 
-def preprocess_image(image_path):
+def find_good_matches(image_descriptors, template_descriptors, engine="sift"):
     """
-    Preprocesses an image for template matching, removing the ICC profile first.
+    Matches two sets of descriptors and keeps the matches passing Lowe's ratio test.
+
+    SIFT descriptors are matched with a FLANN KD-tree; binary descriptors (ORB,
+    AKAZE) are matched exactly by Hamming distance, which for a few hundred
+    descriptors is cheaper than building an LSH index per template pair.
 
     Args:
-        image_path (str): Path to the image file.
+        image_descriptors (np.ndarray): Descriptors of the image (query set).
+        template_descriptors (np.ndarray): Descriptors of the template (train set).
+        engine (str, optional): Feature engine that produced both sets (default: "sift").
 
     Returns:
-        np.ndarray: Grayscale and resized image for template matching.
+        list: The good cv2.DMatch objects (queryIdx into the image, trainIdx into the template).
     """
 
-    # Remove the ICC profile before further processing
-    delete_icc_profile(image_path)
+    # The ratio test needs at least two candidates on each side
+    if (
+        image_descriptors is None
+        or template_descriptors is None
+        or len(image_descriptors) < 2
+        or len(template_descriptors) < 2
+    ):
+        return []
+
+    if FEATURE_ENGINES[engine]["binary"]:
+        matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+    else:
+        # Match descriptors using FLANN matcher
+        matcher = cv2.FlannBasedMatcher(dict(algorithm=1, trees=5), dict(checks=50))
+    matches = matcher.knnMatch(image_descriptors, np.asarray(template_descriptors), k=2)
 
-    # Read the image in BGR color space using OpenCV (without ICC profile)
-    image = cv2.imread(image_path)
+    # Filter good matches based on Lowe's ratio test
+    return [
+        pair[0] for pair in matches
+        if len(pair) == 2 and pair[0].distance < 0.7 * pair[1].distance
+    ]
 
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    # Resize the image to the desired dimensions
-    # Modify resize dimensions as needed
-    resized = cv2.resize(gray, (256, 256))
+def match_descriptors(image_descriptors, template_descriptors, engine="sift"):
+    """
+    Matches two sets of descriptors and counts the matches passing Lowe's ratio test.
 
-    # Now return resized image
-    return resized
+    Args:
+        image_descriptors (np.ndarray): Descriptors of the image (query set).
+        template_descriptors (np.ndarray): Descriptors of the template (train set).
+        engine (str, optional): Feature engine that produced both sets (default: "sift").
 
+    Returns:
+        int: The number of good matches between the two descriptor sets.
+    """
 
-def detect_and_match_features(image, template):
+    # Return the number of good matches
+    return len(find_good_matches(image_descriptors, template_descriptors, engine))
+
+
+def extract_image_features(prepared, engine="sift", profile=None):
+    """
+    Extracts the keypoint coordinates and descriptors of an uploaded image,
+    recording the time taken and the number of keypoints found.
+
+    Args:
+        prepared (np.ndarray): The image as returned by `preprocess_image`.
+        engine (str, optional): Feature engine (default: "sift").
+        profile (dict, optional): Matching profile the image was prepared with; its
+                                  keypoint budget applies. Defaults to the default profile.
+
+    Returns:
+        tuple: The (n, 2) float32 keypoint coordinates (in `prepared` pixels) and the
+               descriptors (None if no keypoints were found).
+    """
+
+    with span(f"{engine}_extraction"):
+        keypoints, descriptors = extract_features(prepared, engine, profile)
+    KEYPOINTS.observe(len(keypoints), engine=engine)
+    annotate(engine=engine, keypoints=len(keypoints))
+    return np.array([p.pt for p in keypoints], dtype=np.float32).reshape(-1, 2), descriptors
+
+
+def extract_image_descriptors(prepared, engine="sift", profile=None):
+    """
+    Extracts the descriptors of an uploaded image (see `extract_image_features`).
+
+    Args:
+        prepared (np.ndarray): The image as returned by `preprocess_image`.
+        engine (str, optional): Feature engine (default: "sift").
+        profile (dict, optional): Matching profile the image was prepared with. Defaults to the default profile.
+
+    Returns:
+        np.ndarray or None: The descriptors, or None if no keypoints were found.
+    """
+
+    return extract_image_features(prepared, engine, profile)[1]
+
+
+def detect_and_match_features(image, template, engine="sift", profile=None):
     """
     Detects features and performs matching between an image and a template.
 
     Args:
         image (np.ndarray): The preprocessed image as a NumPy array.
         template (np.ndarray): The preprocessed template image as a NumPy array.
+        engine (str, optional): Feature engine (default: "sift").
+        profile (dict, optional): Matching profile both were prepared with. Defaults to the default profile.
 
     Returns:
         int: The number of good matches between the image and the template.
     """
 
-    # Choose a feature detector (uncomment your preferred choice)
-    detector = cv2.SIFT_create()  # type: ignore # SIFT (slower, more accurate)
-    # detector = cv2.ORB_create()  # ORB (faster, often recommended)
-
     # Detect keypoints and compute descriptors
-    kp1, des1 = detector.detectAndCompute(image, None)
-    kp2, des2 = detector.detectAndCompute(template, None)
+    kp1, des1 = extract_features(image, engine, profile)
+    kp2, des2 = extract_features(template, engine, profile)
 
-    # Match descriptors using FLANN matcher
-    matcher = cv2.FlannBasedMatcher(dict(algorithm=1, trees=5), dict(checks=50))
-    matches = matcher.knnMatch(des1, des2, k=2)
-
-    # Filter good matches based on Lowe's ratio test
-    good_matches = [m for m, n in matches if m.distance < 0.7 * n.distance]
-
-    # Return the number of good matches
-    return len(good_matches)
+    return match_descriptors(des1, des2, engine)
 
 
-def compare_with_template(image, template_path, threshold=15):
+def compare_with_template(image_descriptors, template_descriptors, threshold=15, engine="sift"):
     """
-    Compares a preprocessed image with a single template image and returns True if the
+    Compares a preprocessed image with a single template and returns True if the
     number of good matches between them exceeds a specified threshold.
 
     Args:
-        image (np.ndarray): The preprocessed image as a NumPy array. It's assumed
-                           that the image has already been processed using a function
-                           like `preprocess_image` (not shown here) to improve feature
-                           extraction and matching performance.
-        template_path (str): The path to the template image file.
+        image_descriptors (np.ndarray): Descriptors of the preprocessed image,
+                                        computed once per upload with `extract_features`.
+        template_descriptors (np.ndarray): Descriptors of the template, as held
+                                           in the template folder's descriptor store.
         threshold (int, optional): The minimum number of good matches required for
                                    the image to be considered a match to the template.
                                    Defaults to 15.
+        engine (str, optional): Feature engine of both descriptor sets. Defaults to "sift".
 
     Returns:
         bool: True if the number of good matches is greater than or equal to the
               threshold, False otherwise.
     """
 
-    # Preprocess the template image (if necessary)
-    template = preprocess_image(template_path)
-
-    # Detect features and perform matching between image and template
-    num_matches = detect_and_match_features(image, template)
+    # Perform matching between image and template descriptors
+    num_matches = match_descriptors(image_descriptors, template_descriptors, engine)
 
     # Compare the number of good matches with the threshold
     return num_matches >= threshold
 
 
+def _match_batch(image_descriptors, template_folder, names, threshold, stop_event=None, engine="sift", profile=None):
+    """
+    Compares an image against a batch of templates, stopping at the first match.
+
+    Runs inside pool workers: the descriptor store is looked up by folder so that
+    process workers load (and memory-map) it once instead of receiving it per task.
+
+    Args:
+        image_descriptors (np.ndarray): Descriptors of the preprocessed image.
+        template_folder (str): Name or path of the template folder.
+        names (list): Template file names in this batch.
+        threshold (int): Minimum number of good matches for a passing result.
+        stop_event (threading.Event, optional): Set by another worker once a match is found.
+        engine (str, optional): Feature engine of the descriptors. Defaults to "sift".
+        profile (dict, optional): Matching profile of the descriptors. Defaults to the folder's profile.
+
+    Returns:
+        tuple: The matched template name (or None) and the good match count of every compared template.
+    """
+
+    store = get_descriptor_store(template_folder, engine=engine, profile=profile)
+    scores = {}
+    for name in names:
+        if stop_event is not None and stop_event.is_set():
+            break
+        scores[name] = match_descriptors(image_descriptors, store.descriptors_for(name), engine)
+        if scores[name] >= threshold:
+            return name, scores
+    return None, scores
+
+
+def _get_process_pool(num_workers):
+    # Process pools are expensive to start, so keep one per size for the process lifetime
+    with _process_pools_lock:
+        pool = _process_pools.get(num_workers)
+        if pool is None:
+            # Spawned, not forked: a fork from the threaded web server could copy a lock held by
+            # another thread (sqlite, OpenCV, the OCR pool) and deadlock the worker
+            pool = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"))
+            _process_pools[num_workers] = pool
+        return pool
+
+
 def compare_image_with_templates(
-    image_path, template_folder, threshold=15, num_threads=4
+    image,
+    template_folder,
+    threshold=15,
+    num_threads=4,
+    use_processes=False,
+    batch_size=8,
+    match_mode="exhaustive",
+    shortlist_size=20,
+    image_descriptors=None,
+    engine="sift",
+    stop_on_match=True,
 ):
     """
-    Compares an image with templates in a folder using multithreading and early stopping.
+    Compares an image with templates in a folder in parallel, with early stopping.
+
+    Templates are split into batches that are fanned out over a pool of workers.
+    As soon as one template crosses the threshold the remaining batches are cancelled
+    and running thread workers stop at their next template.
+
+    Template descriptors come from the folder's precomputed descriptor store
+    (see `Descriptor_Store`), so template images are never decoded here.
 
     Args:
-        image_path (str): Path to the image.
+        image (str or np.ndarray): Path to the image, or the already decoded image.
         template_folder (str): Path to the template folder containing template image files.
         threshold (int, optional): Minimum number of good matches for a passing result (default: 15).
-        num_threads (int, optional): Number of threads to use for parallel template matching (default: 4).
+        num_threads (int, optional): Number of workers to use for parallel template matching (default: 4).
+        use_processes (bool, optional): Use a shared pool of spawned processes instead of threads,
+            so matching is not limited by the GIL (default: False). The workers open the
+            descriptor store themselves, so it should be built first (see `Descriptor_Store`).
+        batch_size (int, optional): Number of templates compared per task (default: 8).
+        match_mode (str, optional): "exhaustive" compares against every template; "global" first
+            queries the folder-wide FLANN index (see `Template_Index`) and only verifies the
+            best-voted templates; "hash" only verifies the templates with the closest
+            perceptual hashes (see `Layout_Hash`); "cluster" compares one representative per
+            cluster of near-identical templates and then the members of the clusters whose
+            representative came close (see `Template_Clusters`); "pyramid" compares every template
+            at the profile's coarse "pyramid" size first and only verifies the best-scoring
+            ones at full size (default: "exhaustive").
+        shortlist_size (int, optional): Number of templates verified in "global", "hash" and "pyramid" modes (default: 20).
+        image_descriptors (np.ndarray, optional): Descriptors of the image computed earlier
+            (e.g. taken from the result cache); extracted from `image` when not given.
+        engine (str, optional): Feature engine: "sift" (default), or the binary "orb" and "akaze",
+            which are an order of magnitude cheaper to compare and need their own thresholds.
+        stop_on_match (bool, optional): Stop at the first template reaching the threshold (default: True).
+            When False every candidate of the match mode is scored, e.g. to rank them
+            (see `Template_Ranking`), and "matched_template" is the best-scoring one.
 
     Returns:
-        list: A list containing two elements:
+        list: A list containing three elements:
             - The first element is a boolean indicating successful matching (True) or rejection (False).
             - The second element is a string with either "ACCEPTED !" or a rejection message if no templates matched.
+            - The third element is a dict with "templates_compared", "templates_total" and "matched_template"
+              (and "scores", template name -> good matches, when `stop_on_match` is False).
     """
 
-    # Get the directory of the current script (main.py)
-    current_script_dir = os.path.dirname(os.path.abspath(__file__))
-
-    # Construct the path to the INVOICES directory
-    template_folder = os.path.join(current_script_dir, '..', template_folder)
-
-    # Convert to absolute path
-    template_folder = os.path.abspath(template_folder)
-
-
-    # Preprocess the image before template matching
-    image = preprocess_image(image_path)  # Assumes preprocess_image function exists
-
-    # Use ThreadPoolExecutor for multithreaded template matching
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        # Iterate through template files in the folder
-        for filename in os.listdir(template_folder):
-            if filename.endswith(".png"):
-                template_path = os.path.join(template_folder, filename)
-                # Submit a task (future) to compare the image with the current template
-                future = executor.submit(
-                    compare_with_template, image, template_path, threshold
-                )
+    # Load (building or refreshing if needed) the descriptor store of the template folder
+    profile = match_profile(template_folder)
+    store = get_descriptor_store(template_folder, engine=engine, profile=profile)
+
+    # Preprocess the image and compute its descriptors once for all templates
+    if isinstance(image, str):
+        image = decode_image(image)
+    prepared = preprocess_image(image, profile)
+    if image_descriptors is None:
+        image_descriptors = extract_image_descriptors(prepared, engine, profile)
+
+    stats = {"templates_compared": 0, "templates_total": len(store), "matched_template": None}
+
+    # Created inside the try below, so the thread pool is shut down whatever stage raises
+    executor = None
+    stop_event = None if use_processes else threading.Event()  # Processes: pending batches are cancelled; running ones are short
+
+    def batched(names):
+        return [names[i:i + batch_size] for i in range(0, len(names), batch_size)]
+
+    # Without early stopping the workers never see a passing score
+    stop_threshold = threshold if stop_on_match else float("inf")
+
+    def run(names):
+        # Fan the templates out in batches; the first match cancels the rest
+        futures = [
+            executor.submit(
+                _match_batch, image_descriptors, template_folder, batch, stop_threshold, stop_event, engine, profile
+            )
+            for batch in batched(names)
+        ]
+        scores = {}
+        try:
+            for future in as_completed(futures):
+                matched_name, batch_scores = future.result()
+                scores.update(batch_scores)
+                stats["templates_compared"] += len(batch_scores)
 
                 # stopping: If a match is found, return "passed" immediately
-                if future.result():
-                    return [True, "ACCEPTED !!! "]
-
-        # No match found in all templates
-        return [False, "REJECTED !!! REASON : IMAGE NOT MATCHED DURING TEMPLATE MATCHING PROCESS ! "]
+                if matched_name is not None:
+                    return matched_name, scores
+        finally:
+            # Cancel outstanding work; running thread workers see the stop event
+            if stop_event is not None:
+                stop_event.set()
+            for future in futures:
+                future.cancel()
+        return None, scores
+
+    start = time.perf_counter()
+    try:
+        executor = _get_process_pool(num_threads) if use_processes else ThreadPoolExecutor(max_workers=num_threads)
+
+        clusters = None
+        if match_mode == "global":
+            # One kNN query over the folder-wide index ranks the templates; only the shortlist is verified
+            shortlist = get_template_index(template_folder, engine).shortlist(image_descriptors, shortlist_size)
+            names = [name for name, _ in shortlist]
+            stats["shortlist"] = shortlist
+        elif match_mode == "hash":
+            # Nearest perceptual hashes from the folder's BK-tree; only those get compared
+            shortlist = get_layout_index(template_folder).similar(perceptual_hash(prepared), shortlist_size)
+            names = [name for name, _ in shortlist if name in store]
+            stats["shortlist"] = shortlist
+        elif match_mode == "cluster":
+            # Representatives first; cluster members only where a representative came close
+            from Template_Clusters import get_template_clusters  # Imports this module
+
+            clusters = get_template_clusters(template_folder, engine)
+            names = clusters.representatives
+            stats["clusters"] = len(clusters)
+        elif match_mode == "pyramid":
+            # Every template at the coarse level (a fraction of the keypoints), then the best at full size
+            coarse = coarse_profile(profile)
+            coarse_descriptors = extract_image_descriptors(preprocess_image(image, coarse), engine, coarse)
+            coarse_scores = {}
+            futures = [
+                executor.submit(
+                    _match_batch, coarse_descriptors, template_folder, batch, float("inf"), None, engine, coarse
+                )
+                for batch in batched(store.names)
+            ]
+            for future in futures:
+                coarse_scores.update(future.result()[1])
+            stats["coarse_compared"] = len(coarse_scores)
+            shortlist = sorted(coarse_scores.items(), key=lambda item: -item[1])[:shortlist_size]
+            names = [name for name, _ in shortlist if name in store]
+            stats["shortlist"] = shortlist
+        else:
+            names = store.names
+
+        matched_name, scores = run(names)
+        if matched_name is None and clusters is not None:
+            members = clusters.descend(scores, threshold)
+            stats["cluster_members_compared"] = len(members)
+            if stop_event is not None:
+                stop_event.clear()
+            matched_name, member_scores = run(members)
+            scores.update(member_scores)
+        if not stop_on_match:
+            stats["scores"] = scores
+            best = max(scores, key=scores.get, default=None)
+            if best is not None and scores[best] >= threshold:
+                matched_name = best
+        if matched_name is not None:
+            stats["matched_template"] = matched_name
+            return [True, "ACCEPTED !!! ", stats]
+    finally:
+        if executor is not None and not use_processes:
+            executor.shutdown(wait=False, cancel_futures=True)
+        observe_stage("template_comparison", time.perf_counter() - start)
+        TEMPLATES_COMPARED.observe(stats["templates_compared"])
+        annotate(templates_compared=stats["templates_compared"], templates_total=stats["templates_total"])
+
+    # No match found in all templates
+    return [False, "REJECTED !!! REASON : IMAGE NOT MATCHED DURING TEMPLATE MATCHING PROCESS ! ", stats]
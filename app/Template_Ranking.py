@@ -0,0 +1,117 @@
+import os
+from Image_Loading import decode_image
+from Feature_Extraction import match_profile, prepared_size
+from Descriptor_Store import get_descriptor_store
+from Template_Matching import compare_image_with_templates, preprocess_image, extract_image_features
+from Field_Regions import MIN_INLIERS, estimate_homography
+from Instrumentation import span, annotate
+
+# Best-scoring templates checked with RANSAC after the ratio-test counts are known
+VERIFY_TOP = int(os.environ.get("CHECK_VERIFY_TOP", 5))
+
+
+def verify_template(image_features, image_size, store, name, min_inliers=MIN_INLIERS):
+    """
+    Checks that the matches between an upload and a template are geometrically consistent.
+
+    Args:
+        image_features (tuple): (points, descriptors) of the upload, see `extract_image_features`.
+        image_size (tuple): (width, height) the upload was prepared at.
+        store (DescriptorStore): Descriptor store holding the template.
+        name (str): Template file name.
+        min_inliers (int, optional): Inliers needed for the template to count as aligned. Defaults to MIN_INLIERS.
+
+    Returns:
+        tuple: The RANSAC inlier count and whether the upload aligns with the template.
+    """
+
+    image_points, image_descriptors = image_features
+    homography, inliers = estimate_homography(
+        image_points, image_descriptors, store.keypoints_for(name), store.descriptors_for(name), store.engine,
+        min_inliers=min_inliers, image_size=image_size, template_size=store.prepared_size(name),
+    )
+    return inliers, homography is not None
+
+
+def rank_templates(
+    image,
+    template_folder,
+    threshold=15,
+    top_k=5,
+    verify_top=VERIFY_TOP,
+    min_inliers=MIN_INLIERS,
+    num_threads=4,
+    match_mode="exhaustive",
+    shortlist_size=20,
+    image_features=None,
+    engine="sift",
+):
+    """
+    Ranks the templates of a folder by how well they match an image.
+
+    Every candidate of the match mode gets a ratio-test match count (without the
+    early stop of `compare_image_with_templates`); only the `verify_top` best are
+    then checked with RANSAC, so geometric verification costs a few milliseconds
+    per upload instead of one homography per template.
+
+    Args:
+        image (str or np.ndarray): Path to the image, or the already decoded image.
+        template_folder (str): Name or path of the template folder.
+        threshold (int, optional): Good matches a template needs to pass (default: 15).
+        top_k (int, optional): Number of templates returned (default: 5).
+        verify_top (int, optional): Best-scoring templates verified with RANSAC. Defaults to VERIFY_TOP.
+        min_inliers (int, optional): RANSAC inliers a template needs to pass. Defaults to MIN_INLIERS.
+        num_threads (int, optional): Workers scoring the templates (default: 4).
+        match_mode (str, optional): Candidate selection, see `compare_image_with_templates` (default: "exhaustive").
+        shortlist_size (int, optional): Candidates in the shortlist-based match modes (default: 20).
+        image_features (tuple, optional): (points, descriptors) of the image computed earlier
+            (e.g. taken from the result cache); extracted from `image` when not given.
+        engine (str, optional): Feature engine (default: "sift").
+
+    Returns:
+        list: Up to `top_k` dicts, best first, with keys:
+            - "template": the template file name.
+            - "matches": good matches passing Lowe's ratio test.
+            - "inliers": RANSAC inliers (None if the template was not verified).
+            - "passed": True if the template reaches `threshold` and aligns with at least `min_inliers` inliers.
+    """
+
+    if isinstance(image, str):
+        image = decode_image(image)
+    profile = match_profile(template_folder)
+    if image_features is None:
+        image_features = extract_image_features(preprocess_image(image, profile), engine, profile)
+
+    matched = compare_image_with_templates(
+        image,
+        template_folder,
+        threshold,
+        num_threads=num_threads,
+        match_mode=match_mode,
+        shortlist_size=shortlist_size,
+        image_descriptors=image_features[1],
+        engine=engine,
+        stop_on_match=False,
+    )
+    ranked = sorted(matched[2]["scores"].items(), key=lambda item: (-item[1], item[0]))
+
+    # Geometric verification only for the shortlist
+    store = get_descriptor_store(template_folder, engine=engine, profile=profile)
+    image_size = prepared_size(image.shape, profile)
+    results = []
+    with span("template_verification"):
+        for position, (name, matches) in enumerate(ranked[:max(top_k, verify_top)]):
+            inliers, aligned = None, False
+            if position < verify_top and name in store:
+                inliers, aligned = verify_template(image_features, image_size, store, name, min_inliers)
+            results.append({
+                "template": name,
+                "matches": matches,
+                "inliers": inliers,
+                "passed": matches >= threshold and aligned,
+            })
+
+    # Verified templates are ordered by inliers, which separate true layouts from texture better than counts
+    results.sort(key=lambda result: (-result["passed"], -(result["inliers"] or 0), -result["matches"]))
+    annotate(templates_verified=min(verify_top, len(ranked)))
+    return results[:top_k]
@@ -0,0 +1,182 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from Layout_Hash import DUPLICATE_DISTANCE, BKTree, perceptual_hash
+
+# Remember the perceptual hash of every checked upload (1) to flag re-submissions, or not (0, default)
+HISTORY_ENABLED = os.environ.get("CHECK_UPLOAD_HISTORY", "0") == "1"
+
+# sqlite file shared by every process checking uploads
+HISTORY_PATH = os.environ.get(
+    "CHECK_UPLOAD_HISTORY_PATH",
+    os.path.abspath(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RESULT_CACHE", "uploads.sqlite3")
+    ),
+)
+
+# Uploads remembered, and days an upload is remembered for; older ones are pruned from the file and the BK-tree
+MAX_ENTRIES = int(os.environ.get("CHECK_UPLOAD_HISTORY_ENTRIES", 100000))
+MAX_AGE_DAYS = float(os.environ.get("CHECK_UPLOAD_HISTORY_DAYS", 90))
+
+# Earlier uploads reported per check, closest first
+MAX_REPORTED = 5
+
+# Uploads recorded by a process between prunes (the BK-tree is rebuilt on every prune)
+PRUNE_EVERY = 1000
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def _signed(value):
+    # sqlite integers are signed 64-bit; hashes are unsigned
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class UploadHistory:
+    """
+    Perceptual hashes of previously checked uploads, for re-submission detection.
+
+    Hashes are appended to a sqlite file that several processes (gunicorn or batch
+    workers) share; each process mirrors the rows into a BK-tree and picks up the
+    rows added by the others before every lookup. Both keep at most `max_entries`
+    uploads of the last `max_age_days` days.
+    """
+
+    def __init__(self, path=HISTORY_PATH, max_entries=MAX_ENTRIES, max_age_days=MAX_AGE_DAYS):
+        """
+        Args:
+            path (str, optional): sqlite file of the history, or None for memory only. Defaults to HISTORY_PATH.
+            max_entries (int, optional): Uploads remembered. Defaults to MAX_ENTRIES.
+            max_age_days (float, optional): Days an upload is remembered for. Defaults to MAX_AGE_DAYS.
+        """
+
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self.tree = BKTree()
+        self._entries = OrderedDict()  # (digest, document_type) -> (hash, item), oldest first
+        self._recorded = 0  # Since the last prune
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                "id INTEGER PRIMARY KEY, document_type TEXT, digest TEXT, phash INTEGER, checked REAL, "
+                "source TEXT, UNIQUE (digest, document_type))"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(uploads)")]
+            if "source" not in columns:
+                # Files written before uploads had a source
+                self._db.execute("ALTER TABLE uploads ADD COLUMN source TEXT")
+            self._db.commit()
+
+    def _add(self, document_type, digest, value, checked, source):
+        # Called with the lock held
+        if (digest, document_type) not in self._entries:
+            item = {"document_type": document_type, "digest": digest, "checked": checked, "source": source}
+            self._entries[(digest, document_type)] = (value, item)
+            self.tree.add(value, item)
+
+    def _prune(self):
+        # Called with the lock held: forget uploads past the age and entry caps, in the file
+        # and in the mirror (a BK-tree cannot delete, so it is rebuilt from the remaining entries)
+        cutoff = time.time() - self.max_age
+        if self._db is not None:
+            try:
+                self._db.execute("DELETE FROM uploads WHERE checked < ?", (cutoff,))
+                self._db.execute(
+                    "DELETE FROM uploads WHERE id IN (SELECT id FROM uploads ORDER BY id DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+            except sqlite3.OperationalError:
+                self._db.rollback()  # Another process prunes next time
+        entries = [(key, entry) for key, entry in self._entries.items() if entry[1]["checked"] >= cutoff]
+        self._entries = OrderedDict(entries[max(0, len(entries) - self.max_entries):])
+        self.tree = BKTree()
+        for value, item in self._entries.values():
+            self.tree.add(value, item)
+        self._recorded = 0
+
+    def _sync(self):
+        # Called with the lock held: mirror rows written by other processes since the last lookup
+        try:
+            rows = self._db.execute(
+                "SELECT id, document_type, digest, phash, checked, source FROM uploads WHERE id > ? ORDER BY id",
+                (self._last_id,),
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return  # Locked by another process: use what is already mirrored
+        for row_id, document_type, digest, value, checked, source in rows:
+            self._add(document_type, digest, value % (1 << 64), checked, source)
+            self._last_id = row_id
+
+    def check_and_record(self, image, document_type, digest, max_distance=DUPLICATE_DISTANCE, source=None):
+        """
+        Finds earlier uploads that look like the same page, then records this upload.
+
+        Args:
+            image (np.ndarray): The decoded upload.
+            document_type (str): The document type it is checked as.
+            digest (str): Content address of the upload, see `Result_Cache.image_digest`.
+            max_distance (int, optional): Largest perceptual-hash distance counted as the same page.
+                                          Defaults to DUPLICATE_DISTANCE.
+            source (str, optional): Where the upload was read from (e.g. a batch file path). The same
+                                    file checked again from the same source (a resumed batch) is not
+                                    reported as its own re-submission. Defaults to None (web uploads).
+
+        Returns:
+            list: Up to MAX_REPORTED dicts of earlier uploads ("document_type", "digest",
+                  "checked" timestamp of its first check, "source" and "distance"), closest
+                  first; an identical re-upload is reported at distance 0, a first upload gets
+                  an empty list.
+        """
+
+        value = perceptual_hash(image)
+        with self._lock:
+            if self._db is not None:
+                self._sync()
+            cutoff = time.time() - self.max_age
+            earlier = [
+                dict(item, distance=distance) for distance, item in self.tree.search(value, max_distance)
+                if item["checked"] >= cutoff
+                and not (source is not None and item["source"] == source and item["digest"] == digest)
+            ]
+            checked = time.time()
+            self._add(document_type, digest, value, checked, source)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR IGNORE INTO uploads (document_type, digest, phash, checked, source) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (document_type, digest, _signed(value), checked, source),
+                    )
+                    self._db.commit()
+                except sqlite3.OperationalError:
+                    self._db.rollback()  # Only this process remembers the upload
+            self._recorded += 1
+            if self._recorded >= PRUNE_EVERY or len(self._entries) > self.max_entries + PRUNE_EVERY:
+                self._prune()
+        return earlier[:MAX_REPORTED]
+
+
+def get_upload_history():
+    """
+    Returns the process-wide upload history, or None unless it is enabled (CHECK_UPLOAD_HISTORY=1).
+
+    Returns:
+        UploadHistory or None: The shared history.
+    """
+
+    global _history
+    if not HISTORY_ENABLED:
+        return None
+    with _history_lock:
+        if _history is None:
+            _history = UploadHistory()
+        return _history
@@ -0,0 +1,164 @@
+import io
+import os
+import hashlib
+import threading
+import warnings
+from PIL import Image
+
+# Largest accepted upload, in bytes
+MAX_FILE_SIZE = int(os.environ.get("CHECK_MAX_FILE_SIZE", 20 * 1024 * 1024))
+
+# Largest accepted image, in pixels and along either side, read from the header before decoding
+MAX_PIXELS = int(os.environ.get("CHECK_MAX_PIXELS", 50_000_000))
+MAX_DIMENSION = int(os.environ.get("CHECK_MAX_DIMENSION", 20000))
+
+# Largest accepted page count of a multi-page TIFF or animated GIF/WebP
+MAX_PAGES = int(os.environ.get("CHECK_MAX_PAGES", 50))
+
+# Bytes read from the stream at a time
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of every accepted format -> (format, file extension)
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", ("png", ".png")),
+    (b"\xff\xd8\xff", ("jpeg", ".jpg")),
+    (b"GIF87a", ("gif", ".gif")),
+    (b"GIF89a", ("gif", ".gif")),
+    (b"BM", ("bmp", ".bmp")),
+    (b"II*\x00", ("tiff", ".tif")),
+    (b"MM\x00*", ("tiff", ".tif")),
+)
+
+
+def sniff_format(head):
+    """
+    Identifies an image format from its first bytes, whatever the file is named.
+
+    Args:
+        head (bytes): At least the first 12 bytes of the file.
+
+    Returns:
+        tuple or None: (format, extension), or None if the bytes are not a supported image.
+    """
+
+    # WebP is a RIFF container: "RIFF", 4 size bytes, then "WEBP"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ("webp", ".webp")
+    for signature, kind in SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+def read_upload(stream, max_bytes=MAX_FILE_SIZE):
+    """
+    Reads an uploaded file in chunks, giving up as soon as it exceeds `max_bytes`.
+
+    The first chunk is sniffed, so a file that is not an image is refused before
+    the rest of it is read.
+
+    Args:
+        stream: A binary file-like object (e.g. `FileStorage.stream`).
+        max_bytes (int, optional): Size cap. Defaults to MAX_FILE_SIZE.
+
+    Returns:
+        list, bytes: [bool, message] and the file contents (None when rejected).
+    """
+
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if not chunks and sniff_format(chunk) is None:
+            return [False, "REJECTED !!! REASON : INVALID IMAGE FORMAT !"], None
+        size += len(chunk)
+        if size > max_bytes:
+            return [False, "REJECTED !!! REASON : FILE TOO LARGE !"], None
+        chunks.append(chunk)
+    if not chunks:
+        return [False, "REJECTED !!! REASON : INVALID IMAGE FORMAT !"], None
+    return [True, "ACCEPTED !!!"], b"".join(chunks)
+
+
+def inspect_image(source, max_pixels=MAX_PIXELS, max_dimension=MAX_DIMENSION, max_pages=MAX_PAGES):
+    """
+    Validates an encoded image from its signature and header, without decoding the pixels.
+
+    This rejects renamed non-images and decompression bombs (a few kilobytes of
+    file declaring a gigapixel image) before the full decode allocates memory.
+
+    Args:
+        source (str or bytes): File path or encoded file contents.
+        max_pixels (int, optional): Largest accepted width * height. Defaults to MAX_PIXELS.
+        max_dimension (int, optional): Largest accepted width or height. Defaults to MAX_DIMENSION.
+        max_pages (int, optional): Largest accepted page or frame count. Defaults to MAX_PAGES.
+
+    Returns:
+        list, dict: [bool, message] and the "format", "extension", "width", "height"
+                    and "pages" read from the header (None when rejected).
+    """
+
+    try:
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                head = f.read(16)
+        else:
+            head = bytes(source[:16])
+    except OSError:
+        return [False, "REJECTED !!! REASON : IMAGE DON'T EXIST !"], None
+
+    kind = sniff_format(head)
+    if kind is None:
+        return [False, "REJECTED !!! REASON : INVALID IMAGE FORMAT !"], None
+
+    try:
+        with warnings.catch_warnings():
+            # Pillow warns about (and past twice its limit refuses) large images; the limits here are ours
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            # Image.open only parses the header; pixels are decoded on first access
+            with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as img:
+                width, height = img.size
+                pages = getattr(img, "n_frames", 1)
+    except Image.DecompressionBombError:
+        return [False, "REJECTED !!! REASON : IMAGE DIMENSIONS TOO LARGE !"], None
+    except (IOError, OSError, ValueError, SyntaxError):
+        return [False, "REJECTED !!! REASON : INVALID IMAGE FORMAT !"], None
+
+    if width < 1 or height < 1:
+        return [False, "REJECTED !!! REASON : INVALID IMAGE FORMAT !"], None
+    if width * height > max_pixels or max(width, height) > max_dimension:
+        return [False, "REJECTED !!! REASON : IMAGE DIMENSIONS TOO LARGE !"], None
+    if pages > max_pages:
+        return [False, "REJECTED !!! REASON : TOO MANY PAGES !"], None
+    return [True, "ACCEPTED !!!"], {
+        "format": kind[0], "extension": kind[1], "width": width, "height": height, "pages": pages,
+    }
+
+
+def store_upload(data, folder, extension):
+    """
+    Writes an upload under the SHA-256 of its contents.
+
+    Two uploads with the same client file name no longer overwrite each other,
+    and the same file uploaded twice is stored once.
+
+    Args:
+        data (bytes): The file contents.
+        folder (str): Destination folder, created if needed.
+        extension (str): File extension from `inspect_image` (not the client's file name).
+
+    Returns:
+        str: Path of the stored file.
+    """
+
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, hashlib.sha256(data).hexdigest() + extension)
+    if not os.path.exists(path):
+        # Write then rename, so a concurrent reader never sees a partial file
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+    return path
@@ -0,0 +1,208 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+# Seconds a user document loaded for a session is reused before it is read again
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 300))
+
+# User documents kept in memory before the least recently used ones are dropped
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+
+# Connection pool of the MongoDB client (see `client_options`)
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 2))
+MONGO_MAX_IDLE_MS = int(os.environ.get("MONGO_MAX_IDLE_MS", 300000))
+MONGO_TIMEOUT_MS = int(os.environ.get("MONGO_TIMEOUT_MS", 5000))
+
+
+def client_options():
+    """
+    Returns the connection pool settings of the MongoDB client.
+
+    A few connections are kept open so a login does not pay for a TLS handshake,
+    and every wait (server selection, connecting, a free pooled connection) is
+    bounded so a database outage fails requests quickly instead of piling them up.
+
+    Returns:
+        dict: Keyword arguments for `pymongo.MongoClient`.
+    """
+
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_MS,
+        "serverSelectionTimeoutMS": MONGO_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_TIMEOUT_MS,
+        "retryWrites": True,
+    }
+
+
+class UserStore:
+    """
+    Reads and writes the users collection for the authentication routes.
+
+    `get` is called by Flask-Login on every authenticated request, so the user
+    documents it returns are cached in memory for `ttl` seconds. Anything that
+    changes or ends a session (logout, a password change...) must call
+    `invalidate`. Logins always read the database, so a stale password hash is
+    never checked.
+
+    Any pymongo-compatible collection works, e.g. a `mongomock` collection in tests.
+    """
+
+    def __init__(self, collection, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_SIZE):
+        """
+        Args:
+            collection: The users collection.
+            ttl (float, optional): Seconds a cached user is reused; 0 disables the cache. Defaults to USER_CACHE_TTL.
+            max_entries (int, optional): Capacity of the cache. Defaults to USER_CACHE_SIZE.
+        """
+
+        self.collection = collection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # user id -> (expiry, user document)
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def ensure_indexes(self):
+        """
+        Creates the unique indexes on username and email (a no-op when they exist).
+
+        They make login and registration lookups index scans and let the database
+        reject a duplicate account created by two concurrent registrations.
+
+        Returns:
+            list: [bool, message] - False if existing duplicates prevent an index.
+        """
+
+        try:
+            self.collection.create_index("username", unique=True, name="username_unique")
+            self.collection.create_index("email", unique=True, name="email_unique")
+        except OperationFailure as e:
+            return [False, f"Could not create the unique user indexes: {e}"]
+        return [True, "User indexes are in place."]
+
+    def _remember(self, user_id, user_data):
+        # Called with the lock held: insert into the cache and evict the oldest entries
+        self._cache[user_id] = (time.monotonic() + self.ttl, user_data)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def get(self, user_id):
+        """
+        Returns a user by id, from the cache while it is fresh.
+
+        Args:
+            user_id (str): The session's user id.
+
+        Returns:
+            dict or None: The user document; None for an unknown or malformed id.
+        """
+
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(user_id)
+                self._metrics["hits"] += 1
+                return entry[1]
+            self._metrics["misses"] += 1
+
+        try:
+            user_data = self.collection.find_one({"_id": ObjectId(user_id)})
+        except (InvalidId, TypeError):
+            return None  # Tampered or outdated session cookie
+
+        with self._lock:
+            if user_data is None:
+                self._cache.pop(user_id, None)
+            elif self.ttl > 0:
+                self._remember(user_id, user_data)
+        return user_data
+
+    def find_by_username(self, username):
+        """
+        Reads a user for a login attempt, bypassing the cache.
+
+        The document is then cached, so the requests following the login are
+        served without another read.
+
+        Args:
+            username (str): The submitted username.
+
+        Returns:
+            dict or None: The user document.
+        """
+
+        user_data = self.collection.find_one({"username": username})
+        if user_data is not None and self.ttl > 0:
+            with self._lock:
+                self._remember(str(user_data["_id"]), user_data)
+        return user_data
+
+    def exists(self, username, email):
+        """
+        Tells whether a username or an email is already taken, in one query.
+
+        Args:
+            username (str): The requested username.
+            email (str): The requested email.
+
+        Returns:
+            bool: True if an account uses either of them.
+        """
+
+        return self.collection.find_one(
+            {"$or": [{"username": username}, {"email": email}]}, projection={"_id": 1}
+        ) is not None
+
+    def create(self, user_data):
+        """
+        Inserts a new user.
+
+        Args:
+            user_data (dict): The user document.
+
+        Returns:
+            list: [bool, message] - False if the username or email was taken in the meantime.
+        """
+
+        try:
+            self.collection.insert_one(user_data)
+        except DuplicateKeyError:
+            return [False, "User already exists."]
+        return [True, "User created."]
+
+    def invalidate(self, user_id=None):
+        """
+        Drops a user from the cache, or every user when no id is given.
+
+        Args:
+            user_id (str, optional): The user whose document changed.
+        """
+
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(str(user_id), None)
+            self._metrics["invalidations"] += 1
+
+    def metrics(self):
+        """
+        Returns hit/miss counters of the user cache.
+
+        Returns:
+            dict: Hits, misses, invalidations and cached entries.
+        """
+
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["entries"] = len(self._cache)
+        return metrics
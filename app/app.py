@@ -1,12 +1,17 @@
-from flask import Flask, render_template, redirect, url_for, request, flash
+from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, abort, Response
 from flask_login import LoginManager, login_user, current_user, logout_user
 from user_model import User
 from pymongo import MongoClient
 from pymongo.server_api import ServerApi
-from bson.objectid import ObjectId
 import os
 from dotenv import load_dotenv
-from Main import CHECK
+from Main import CHECK_PAGES
+from OCR_Reader_Pool import get_reader_pool
+from Job_Queue import JobQueue, QueueFull
+from Result_Cache import get_result_cache
+from Instrumentation import gauge, render
+from User_Store import UserStore, client_options
+from Upload_Intake import MAX_FILE_SIZE, read_upload, inspect_image, store_upload
 from flask_bcrypt import Bcrypt
 
 
@@ -25,6 +30,16 @@ app = Flask(__name__)
 app.config["SECRET_KEY"] = SECRET_KEY  # Replace with a strong secret key
 # Define the upload folder
 app.config["UPLOAD_FOLDER"] = "uploads"
+# Keep a copy of every upload on disk (uploads are otherwise processed in memory only)
+app.config["SAVE_UPLOADS"] = os.environ.get("SAVE_UPLOADS", "0") == "1"
+# Refuse request bodies larger than an upload plus the form fields before they are read (413)
+app.config["MAX_CONTENT_LENGTH"] = MAX_FILE_SIZE + 64 * 1024
+# Document checks run on a bounded background worker pool. Jobs are tracked in this process's
+# memory, so serve the app from a single process (e.g. gunicorn -w 1 --threads 8); the timeout
+# only marks a job as timed out, a running check keeps its worker until it returns
+app.config["CHECK_WORKERS"] = int(os.environ.get("CHECK_WORKERS", 2))
+app.config["CHECK_QUEUE_LIMIT"] = int(os.environ.get("CHECK_QUEUE_LIMIT", 16))
+app.config["CHECK_JOB_TIMEOUT"] = float(os.environ.get("CHECK_JOB_TIMEOUT", 120))
 # Configure Bcrypt
 bcrypt = Bcrypt(app)
 
@@ -33,9 +48,13 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"  # Redirect to login route for unauthorized access
 
-# Connect to MongoDB
+# Connect to MongoDB (MONGODB_TLS=0 for a local mongod without TLS)
 client = MongoClient(
-    MONGODB_URI, server_api=ServerApi("1"), tls=True, tlsAllowInvalidCertificates=True
+    MONGODB_URI,
+    server_api=ServerApi("1"),
+    tls=os.environ.get("MONGODB_TLS", "1") == "1",
+    tlsAllowInvalidCertificates=True,
+    **client_options(),
 )
 # Send a ping to confirm a successful connection
 try:
@@ -46,29 +65,60 @@ except Exception as e:
 
 db = client[DATABASE_NAME]  # Replace with your database name
 
+# User lookups go through a cache; unique indexes keep them index scans
+users = UserStore(db[COLLECTION_NAME])
+indexed, message = users.ensure_indexes()
+if not indexed:
+    print(message)
 
-def save_file(file):
-    # Save the file to the upload folder and return the file path
-    if file:
-        filename = file.filename
-        # Create the upload folder if it doesn't exist
-        upload_folder = app.config["UPLOAD_FOLDER"]
-        if not os.path.exists(upload_folder):
-            os.makedirs(upload_folder)
-        file_path = os.path.join(upload_folder, filename)
-        file.save(file_path)
-        return file_path
-    else:
-        return None
+job_queue = JobQueue(
+    workers=app.config["CHECK_WORKERS"],
+    max_pending=app.config["CHECK_QUEUE_LIMIT"],
+    timeout=app.config["CHECK_JOB_TIMEOUT"],
+)
+
+# Values owned by other components, read when /metrics is scraped
+gauge("document_check_jobs_pending", "Checks queued or running.", job_queue.depth)
+gauge(
+    "document_check_ocr_readers_loaded",
+    "EasyOCR readers loaded in this process.",
+    lambda: get_reader_pool().metrics()["readers_loaded"],
+)
+for key in ("memory_hits", "disk_hits", "misses"):
+    gauge(
+        f"document_check_cache_{key}_total",
+        f"Result cache lookups ({key.replace('_', ' ')}).",
+        lambda key=key: get_result_cache().metrics()[key] if get_result_cache() else 0,
+        kind="counter",
+    )
+for key in ("hits", "misses"):
+    gauge(
+        f"user_cache_{key}_total",
+        f"Session user lookups ({key}).",
+        lambda key=key: users.metrics()[key],
+        kind="counter",
+    )
+
+# Load the OCR models at startup instead of on the first upload (OCR_WARMUP=1)
+if os.environ.get("OCR_WARMUP", "0") == "1":
+    get_reader_pool().warm_up()
+
+
+def save_file(data, extension):
+    # Save the upload under its content hash (never the client's file name) and return the file path
+    return store_upload(data, app.config["UPLOAD_FOLDER"], extension)
+
+
+def wants_json():
+    # API clients ask for JSON explicitly; browsers get HTML pages
+    return request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json"
 
 
 # User loader function
 @login_manager.user_loader
 def load_user(user_id):
-    users_collection = db[
-        COLLECTION_NAME
-    ]  # Replace with your collection name (if different)
-    user_data = users_collection.find_one({"_id": ObjectId(user_id)})
+    # Runs on every authenticated request: served from the user cache while fresh
+    user_data = users.get(user_id)
     return User(user_data) if user_data else None
 
 
@@ -80,22 +130,82 @@ def home():
     result = None
     if request.method == "POST":
         # Check if the file is present in the request
-        if "image_path" in request.files:
-            # Get the file data
+        if "image_path" in request.files and request.files["image_path"].filename:
+            # Read the file data with a size cap, then check its type and dimensions from
+            # the header; only valid images are queued and decoded (once, in memory, by CHECK)
             image_file = request.files["image_path"]
-            # Save the file to a temporary location or process it directly
-            image_path = save_file(image_file)
+            result, image_data = read_upload(image_file.stream)
+            if result[0]:
+                result, header = inspect_image(image_data)
+            if not result[0]:
+                status = 413 if "TOO LARGE" in result[1] else 400
+                if wants_json():
+                    return jsonify(error=result[1]), status
+                return render_template("result.html", result=result[1]), status
+            if app.config["SAVE_UPLOADS"]:
+                save_file(image_data, header["extension"])
         else:
             return "No file provided"
 
         # Get the document type from the form
         document_type = request.form.get("document_type")
 
-        result = CHECK(document_type, image_path)  # Capture the result
-        return render_template("result.html", result=result)
+        # Queue the check and answer immediately; the outcome (with the verdict of every
+        # checked page) is served by /jobs/<job_id>
+        try:
+            job_id = job_queue.submit(CHECK_PAGES, document_type, image_data, owner=current_user.get_id())
+        except QueueFull:
+            message = "Server is busy, please try again shortly."
+            if wants_json():
+                return jsonify(error=message), 503
+            return render_template("result.html", result=message), 503
+
+        if wants_json():
+            return jsonify(job_id=job_id, status_url=url_for("job_status", job_id=job_id)), 202
+        return redirect(url_for("job_status", job_id=job_id))
     return render_template("index.html")
 
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    if not current_user.is_authenticated:
+        return redirect(url_for("login"))  # Redirect to login if not authenticated
+
+    job = job_queue.status(job_id, owner=current_user.get_id())
+    if job is None:
+        abort(404)
+
+    outcome = job["result"] or {}
+    if wants_json():
+        return jsonify(
+            job_id=job["id"],
+            status=job["status"],
+            result=outcome.get("result"),
+            pages=outcome.get("pages"),
+            decided_by=outcome.get("decided_by"),
+            error=job["error"],
+        )
+
+    if job["status"] in ("queued", "running"):
+        # Page refreshes itself until the check is finished
+        return render_template("result.html", pending=True)
+    if job["status"] == "timeout":
+        result = "REJECTED !!! REASON : PROCESSING TIMED OUT !"
+    elif job["status"] == "failed":
+        result = "ERROR !!! REASON : PROCESSING FAILED !"
+    else:
+        result = outcome["result"]
+    # Per-page verdicts are only listed for multi-page documents
+    pages = outcome.get("pages") if len(outcome.get("pages") or []) > 1 else None
+    return render_template("result.html", result=result, pages=pages)
+
+
+@app.route("/metrics")
+def metrics():
+    # Prometheus scrape endpoint: stage timings, verdicts, rejection reasons, queue and cache state
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
@@ -112,14 +222,8 @@ def register():
             # Show error message
             return render_template("register.html", error="Passwords do not match.")
 
-        # Check for existing user
-        users_collection = db[
-            COLLECTION_NAME
-        ]  # Replace with your collection name (if different)
-        existing_userid = users_collection.find_one({"username": username})
-        existing_useremail = users_collection.find_one({"email": email})
-
-        if existing_userid or existing_useremail:
+        # Check for existing user (username or email, in one query)
+        if users.exists(username, email):
             # Show warning message (explained later)
             return render_template("register.html", error="User already exists.")
 
@@ -132,12 +236,10 @@ def register():
             "email": email,
             "password_hash": hashed_password,
         }
-        users_collection = db[
-            COLLECTION_NAME
-        ]  # Replace with your collection name (if different)
-
-        # Insert the user document into the collection
-        users_collection.insert_one(new_user)
+        # Insert the user document into the collection; the unique indexes catch a concurrent registration
+        created, message = users.create(new_user)
+        if not created:
+            return render_template("register.html", error=message)
 
         # Redirect to confirmation or login page
         return redirect(url_for("login"))  # redirect to login
@@ -153,10 +255,7 @@ def login():
         password = request.form["password"]
 
         # Implement logic to validate user credentials against database
-        users_collection = db[
-            COLLECTION_NAME
-        ]  # Replace with your collection name (if different)
-        user_data = users_collection.find_one({"username": username})
+        user_data = users.find_by_username(username)
 
         if user_data and bcrypt.check_password_hash(
             user_data["password_hash"], password
@@ -173,6 +272,8 @@ def login():
 # Logout route
 @app.route("/logout")
 def logout():
+    if current_user.is_authenticated:
+        users.invalidate(current_user.get_id())  # Next login reads the user again
     logout_user()
     return redirect(url_for("home"))
 
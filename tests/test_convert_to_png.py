@@ -0,0 +1,40 @@
+import os
+from PIL import Image
+import Convert_To_Png
+from Convert_To_Png import convert_to_png
+from test_image_loading import bomb_png
+
+
+def _tiff(path, pages, size=(32, 32)):
+    frames = [Image.new("L", size, 40 * number) for number in range(pages)]
+    frames[0].save(path, "TIFF", save_all=True, append_images=frames[1:])
+
+
+def test_converts_every_page(tmp_path):
+    _tiff(tmp_path / "scan.tif", 3)
+    assert convert_to_png(str(tmp_path / "scan.tif")) == str(tmp_path / "scan.png")
+    assert sorted(os.listdir(tmp_path)) == ["scan-2.png", "scan-3.png", "scan.png", "scan.tif"]
+    with Image.open(tmp_path / "scan-3.png") as img:
+        assert img.mode == "RGB" and img.getpixel((0, 0)) == (80, 80, 80)
+
+
+def test_refuses_bombs_and_non_images(tmp_path):
+    (tmp_path / "bomb.png").write_bytes(bomb_png())
+    (tmp_path / "notes.jpg").write_bytes(b"plain text")
+    assert convert_to_png(str(tmp_path / "bomb.png")) is False
+    assert convert_to_png(str(tmp_path / "notes.jpg")) is False
+    assert convert_to_png(str(tmp_path / "missing.gif")) is False
+    assert sorted(os.listdir(tmp_path)) == ["bomb.png", "notes.jpg"]
+
+
+def test_refuses_too_many_or_too_large_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(Convert_To_Png, "MAX_PAGES", 2)
+    _tiff(tmp_path / "long.tif", 3)
+    assert convert_to_png(str(tmp_path / "long.tif")) is False
+
+    # A later page larger than the pixel limit, behind a small first page
+    monkeypatch.setattr(Convert_To_Png, "MAX_PIXELS", 2000)
+    small, large = Image.new("L", (32, 32)), Image.new("L", (100, 100))
+    small.save(tmp_path / "mixed.tif", "TIFF", save_all=True, append_images=[large])
+    assert convert_to_png(str(tmp_path / "mixed.tif")) is False
+    assert sorted(os.listdir(tmp_path)) == ["long.tif", "mixed.tif"]
@@ -0,0 +1,97 @@
+import os
+import json
+import shutil
+import threading
+import multiprocessing
+import pytest
+import Descriptor_Store
+
+TEMPLATES = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "PRESCRIPTIONS"))
+
+
+@pytest.fixture
+def template_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(Descriptor_Store, "STORE_ROOT", str(tmp_path / "store"))
+    folder = tmp_path / "TEMPLATES"
+    folder.mkdir()
+    for filename in sorted(os.listdir(TEMPLATES))[:4]:
+        shutil.copy(os.path.join(TEMPLATES, filename), folder / filename)
+    return str(folder)
+
+
+def _rebuild(template_folder):
+    # Forked worker: force rebuilds while the other workers rebuild and read the same store
+    sizes = []
+    for _ in range(3):
+        Descriptor_Store.build_descriptor_store(template_folder, force=True)
+        store = Descriptor_Store.get_descriptor_store(template_folder, refresh_interval=0)
+        sizes.append((len(store), int(store.descriptors.shape[0])))
+    return sizes
+
+
+def test_incremental_build_reuses_unchanged_templates(template_folder):
+    first = Descriptor_Store.build_descriptor_store(template_folder)
+    assert Descriptor_Store.build_descriptor_store(template_folder) == first
+
+    os.remove(os.path.join(template_folder, sorted(os.listdir(template_folder))[0]))
+    second = Descriptor_Store.build_descriptor_store(template_folder)
+    assert second["library_version"] != first["library_version"]
+    assert len(Descriptor_Store.get_descriptor_store(template_folder, refresh_interval=0)) == 3
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_concurrent_builds_leave_one_consistent_store(template_folder):
+    with multiprocessing.get_context("fork").Pool(4) as pool:
+        results = pool.map(_rebuild, [template_folder] * 4)
+
+    # Every reader saw a complete store
+    assert {size for sizes in results for size in sizes} == {results[0][0]}
+    assert results[0][0][0] == 4
+
+    directory = Descriptor_Store.store_directory(template_folder, "sift")
+    with open(os.path.join(directory, "manifest.json")) as f:
+        token = json.load(f)["arrays"]
+    files = sorted(name for name in os.listdir(directory) if name != ".lock")
+    assert files == [f"descriptors-{token}.npy", f"keypoints-{token}.npy", "manifest.json"]
+
+
+def test_a_slow_build_only_blocks_its_own_store(template_folder, tmp_path, monkeypatch):
+    other = tmp_path / "OTHER"
+    other.mkdir()
+    shutil.copy(os.path.join(TEMPLATES, sorted(os.listdir(TEMPLATES))[5]), other / "(1).png")
+    other_store = Descriptor_Store.get_descriptor_store(str(other))
+
+    started, release, builds = threading.Event(), threading.Event(), []
+    update_store = Descriptor_Store._update_store
+
+    def slow_update(folder, *args):
+        if folder == template_folder:
+            builds.append(folder)
+            started.set()
+            release.wait(10)
+        return update_store(folder, *args)
+
+    monkeypatch.setattr(Descriptor_Store, "_update_store", slow_update)
+    results = []
+    waiters = [
+        threading.Thread(target=lambda: results.append(Descriptor_Store.get_descriptor_store(template_folder)))
+        for _ in range(2)
+    ]
+    for waiter in waiters:
+        waiter.start()
+    try:
+        assert started.wait(10)
+
+        # Another store is served from the cache while the build runs
+        lookup = threading.Thread(target=lambda: results.append(Descriptor_Store.get_descriptor_store(str(other))))
+        lookup.start()
+        lookup.join(5)
+        assert not lookup.is_alive() and results == [other_store]
+    finally:
+        release.set()
+        for waiter in waiters:
+            waiter.join(30)
+
+    # The second caller of the same store waited for the first build instead of running its own
+    assert builds == [template_folder]
+    assert results[1] is results[2] and len(results[1]) == 4
@@ -0,0 +1,41 @@
+import random
+import cv2
+from Feature_Extraction import select_keypoints
+
+
+def _keypoints(points):
+    return [cv2.KeyPoint(float(x), float(y), 3.0, -1, float(response)) for x, y, response in points]
+
+
+def test_keeps_everything_under_budget():
+    keypoints = _keypoints([(1, 1, 0.1), (2, 2, 0.3)])
+    assert [kp.response for kp in select_keypoints(keypoints, (10, 10), 5, grid=2)] == [
+        kp.response for kp in sorted(keypoints, key=lambda kp: -kp.response)
+    ]
+
+
+def test_without_grid_keeps_strongest():
+    rng = random.Random(1)
+    keypoints = _keypoints([(rng.uniform(0, 99), rng.uniform(0, 99), rng.random()) for _ in range(50)])
+    kept = select_keypoints(keypoints, (100, 100), 10)
+    assert [kp.response for kp in kept] == sorted((kp.response for kp in keypoints), reverse=True)[:10]
+
+
+def test_grid_spreads_budget_over_cells():
+    # 40 strong keypoints crowd the top-left cell, one weak keypoint sits in each other cell
+    crowded = [(x % 10, x // 10, 1.0 + x / 100) for x in range(40)]
+    sparse = [(75, 25, 0.1), (25, 75, 0.2), (75, 75, 0.3)]
+    keypoints = _keypoints(crowded + sparse)
+
+    kept = select_keypoints(keypoints, (100, 100), 8, grid=2)
+    assert len(kept) == 8
+    responses = [kp.response for kp in kept]
+    assert responses == sorted(responses, reverse=True)
+    # Every sparse cell is represented; the quota they left goes to the strongest crowded keypoints
+    assert {0.1, 0.2, 0.3} <= set(round(response, 2) for response in responses)
+    assert sum(kp.pt[0] < 50 and kp.pt[1] < 50 for kp in kept) == 5
+
+
+def test_grid_clamps_keypoints_on_the_border():
+    keypoints = _keypoints([(100, 100, 0.9), (0, 0, 0.5), (50, 50, 0.4)])
+    assert len(select_keypoints(keypoints, (100, 100), 2, grid=2)) == 2
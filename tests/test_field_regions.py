@@ -0,0 +1,80 @@
+import os
+import json
+import cv2
+import numpy as np
+import pytest
+import Field_Regions
+from Feature_Extraction import extract_features
+from Field_Regions import FIELD_REGIONS, crop_fields, estimate_homography, field_regions, region_area
+
+TEMPLATE = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "PRESCRIPTIONS", "(1).png"))
+
+
+def _features(image):
+    keypoints, descriptors = extract_features(image)
+    return np.float32([kp.pt for kp in keypoints]), descriptors
+
+
+@pytest.fixture
+def page():
+    image = cv2.imread(TEMPLATE, cv2.IMREAD_GRAYSCALE)
+    scale = 800 / max(image.shape)
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def test_field_regions_fall_back_from_template_to_folder_to_type(tmp_path):
+    folder = str(tmp_path)
+    assert field_regions("invoice", folder, "(1).png") == FIELD_REGIONS["invoice"]
+
+    regions = {"(1).png": {"total": [0.5, 0.8, 0.9, 0.9]}, "*": {"date": [0.6, 0.0, 1.0, 0.1]}}
+    with open(tmp_path / Field_Regions.FIELDS_FILE, "w") as f:
+        json.dump(regions, f)
+    assert field_regions("invoice", folder, "(1).png") == regions["(1).png"]
+    assert field_regions("invoice", folder, "(2).png") == regions["*"]
+
+    # The file is re-read when it changes
+    with open(tmp_path / Field_Regions.FIELDS_FILE, "w") as f:
+        json.dump({"*": {"name": [0, 0, 0.5, 0.1]}}, f)
+    os.utime(tmp_path / Field_Regions.FIELDS_FILE, ns=(1, 1))
+    assert field_regions("invoice", folder, "(1).png") == {"name": [0, 0, 0.5, 0.1]}
+
+
+def test_estimate_homography_recovers_a_warp(page):
+    height, width = page.shape
+    warp = np.array([[0.95, 0.03, 20.0], [-0.02, 1.02, 10.0], [1e-5, 0.0, 1.0]])
+    warped = cv2.warpPerspective(page, warp, (width, height), borderValue=255)
+
+    homography, inliers = estimate_homography(
+        *_features(warped), *_features(page), image_size=(width, height), template_size=(width, height)
+    )
+    assert homography is not None and inliers >= Field_Regions.MIN_INLIERS
+    # The estimate maps the upload back onto the template
+    points = np.float32([[100, 100], [width - 100, 150], [300, height - 100]]).reshape(-1, 1, 2)
+    back = cv2.perspectiveTransform(cv2.perspectiveTransform(points, warp), homography)
+    assert np.abs(back - points).max() < 3
+
+
+def test_estimate_homography_rejects_unrelated_pages(page):
+    noise = np.random.default_rng(0).integers(0, 255, page.shape, dtype=np.uint8)
+    homography, _ = estimate_homography(
+        *_features(noise), *_features(page), image_size=page.shape[::-1], template_size=page.shape[::-1]
+    )
+    assert homography is None
+
+
+def test_crop_fields_cuts_aligned_regions():
+    image = np.full((200, 100, 3), 255, dtype=np.uint8)
+    image[100:150, 50:100] = (0, 0, 255)
+    crops = crop_fields(
+        image, np.eye(3), {"stamp": [0.5, 0.5, 1.0, 0.75], "empty": [0.2, 0.2, 0.2, 0.2]},
+        image_size=(100, 200), template_size=(100, 200), margin=0,
+    )
+    assert list(crops) == ["stamp"]
+    assert crops["stamp"].shape == (50, 50, 3)
+    assert (crops["stamp"] == (0, 0, 255)).all()
+
+
+def test_region_area_counts_overlaps_once():
+    regions = {"a": [0.0, 0.0, 0.5, 0.5], "b": [0.25, 0.25, 0.5, 0.5]}
+    assert region_area(regions, margin=0) == pytest.approx(0.25)
+    assert region_area({}, margin=0) == 0
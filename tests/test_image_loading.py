@@ -0,0 +1,41 @@
+import io
+import struct
+import zlib
+import numpy as np
+from PIL import Image
+from Image_Loading import count_pages, iter_pages
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def bomb_png(width=30000, height=30000):
+    # A few bytes of PNG declaring a huge image
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n" + _chunk(b"IHDR", header)
+        + _chunk(b"IDAT", zlib.compress(b"\x00" * 64)) + _chunk(b"IEND", b"")
+    )
+
+
+def test_count_pages():
+    frames = [Image.new("L", (16, 16), color) for color in (0, 128, 255)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, "TIFF", save_all=True, append_images=frames[1:])
+    assert count_pages(buffer.getvalue()) == 3
+    assert count_pages(np.zeros((4, 4), dtype=np.uint8)) == 1
+    assert count_pages(b"not an image") == 1
+
+
+def test_count_pages_leaves_bombs_to_the_header_check():
+    assert count_pages(bomb_png()) == 1
+
+
+def test_iter_pages_decodes_frames_lazily():
+    frames = [Image.new("RGB", (16, 16), (color, 0, 0)) for color in (0, 128, 255)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, "TIFF", save_all=True, append_images=frames[1:])
+    pages = list(iter_pages(buffer.getvalue(), max_pages=2))
+    assert len(pages) == 2
+    assert [int(page[0, 0, 2]) for page in pages] == [0, 128]
@@ -0,0 +1,80 @@
+import threading
+import time
+import pytest
+from Job_Queue import JobQueue, QueueFull
+
+
+def _wait(queue, job_id, owner=None, seconds=5):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        status = queue.status(job_id, owner)
+        if status["status"] not in ("queued", "running"):
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_runs_jobs_and_reports_results():
+    queue = JobQueue(workers=2)
+    job_id = queue.submit(lambda a, b: a + b, 2, 3, owner="alice")
+    status = _wait(queue, job_id, "alice")
+    assert status["status"] == "done"
+    assert status["result"] == 5
+    assert status["error"] is None
+    assert status["started"] <= status["finished"]
+    assert "future" not in status
+
+
+def test_failures_are_reported():
+    queue = JobQueue()
+
+    def fail():
+        raise ValueError("bad page")
+
+    status = _wait(queue, queue.submit(fail))
+    assert status["status"] == "failed"
+    assert status["error"] == "ValueError: bad page"
+
+
+def test_jobs_are_private_to_their_owner():
+    queue = JobQueue()
+    job_id = queue.submit(lambda: 1, owner="alice")
+    _wait(queue, job_id, "alice")
+    assert queue.status(job_id, "mallory") is None
+    assert queue.status(job_id) is None
+    assert queue.status("unknown", "alice") is None
+
+
+def test_queue_is_bounded():
+    release = threading.Event()
+    queue = JobQueue(workers=1, max_pending=2)
+    first = queue.submit(release.wait)
+    queue.submit(release.wait)
+    with pytest.raises(QueueFull):
+        queue.submit(release.wait)
+    assert queue.depth() == 2
+
+    release.set()
+    _wait(queue, first)
+    deadline = time.time() + 5
+    while queue.depth() and time.time() < deadline:
+        time.sleep(0.01)
+    assert queue.depth() == 0
+    queue.submit(lambda: None)
+
+
+def test_timed_out_jobs_release_their_slot():
+    release = threading.Event()
+    queue = JobQueue(workers=1, max_pending=2, timeout=0.05)
+    running = queue.submit(release.wait)
+    queued = queue.submit(lambda: "never")
+    time.sleep(0.1)
+
+    # The queued job is cancelled and frees its slot; the running one keeps it until it returns
+    assert queue.status(queued)["status"] == "timeout"
+    assert queue.status(running)["status"] == "timeout"
+    assert queue.depth() == 1
+    release.set()
+    time.sleep(0.1)
+    assert queue.depth() == 0
+    assert queue.status(running)["result"] is None
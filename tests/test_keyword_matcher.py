@@ -0,0 +1,36 @@
+import pytest
+from Keyword_Matcher import KeywordMatcher, tokenize
+
+
+def test_tokenize_strips_punctuation_and_short_tokens():
+    assert tokenize("Patient Name: John  A. Doe, 42 x-ray") == ["patient", "name", "john", "doe"]
+
+
+def test_match_words_and_phrases():
+    matcher = KeywordMatcher(["Invoice", "total amount", "amount due", "tax"])
+    matched = matcher.match(tokenize("INVOICE no. 12 - total amount due: 40"))
+    assert matched == {"invoice": 1.0, "total amount": 1.0, "amount due": 1.0}
+
+
+def test_phrase_needs_consecutive_tokens():
+    matcher = KeywordMatcher(["total amount"])
+    assert matcher.match(tokenize("total of the amount")) == {}
+
+
+def test_overlapping_phrases_use_failure_links():
+    matcher = KeywordMatcher(["date of birth", "of birth place"])
+    matched = matcher.match(tokenize("date of birth place"))
+    assert set(matched) == {"date of birth", "of birth place"}
+
+
+def test_score_is_weighted_share():
+    matcher = KeywordMatcher(["invoice", "tax", "co2", "Invoice"], weights={"Invoice": 2.0})
+    # "co2" has no matchable token but still counts in the total; the duplicate is ignored
+    assert matcher.total_weight == 4.0
+    score, matched = matcher.score(tokenize("Invoice with tax"))
+    assert score == pytest.approx(0.75)
+    assert matched == {"invoice": 2.0, "tax": 1.0}
+
+
+def test_score_without_keywords():
+    assert KeywordMatcher([]).score(["anything"]) == (0.0, {})
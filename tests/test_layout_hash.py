@@ -0,0 +1,45 @@
+import random
+from Layout_Hash import BKTree, hamming_distance
+
+
+def _brute_force(values, query, radius):
+    return sorted(
+        (hamming_distance(value, query), item) for item, value in enumerate(values)
+        if hamming_distance(value, query) <= radius
+    )
+
+
+def test_empty_tree():
+    tree = BKTree()
+    assert tree.search(0, 64) == []
+    assert tree.nearest(0, 3) == []
+
+
+def test_identical_hashes_share_a_node():
+    tree = BKTree()
+    tree.add(0b1011, "a")
+    tree.add(0b1011, "b")
+    tree.add(0b1010, "c")
+    assert tree.root[1] == ["a", "b"]
+    assert tree.search(0b1011, 0) == [(0, "a"), (0, "b")]
+    assert tree.search(0b1011, 1) == [(0, "a"), (0, "b"), (1, "c")]
+
+
+def test_search_and_nearest_match_brute_force():
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    # A few near-duplicates so small radii find something
+    values += [value ^ (1 << rng.randrange(64)) for value in values[:30]]
+    tree = BKTree()
+    for item, value in enumerate(values):
+        tree.add(value, item)
+
+    for query in values[:10] + [rng.getrandbits(64) for _ in range(10)]:
+        for radius in (0, 3, 24):
+            found = tree.search(query, radius)
+            assert sorted(found) == _brute_force(values, query, radius)
+            assert [distance for distance, _ in found] == sorted(distance for distance, _ in found)
+
+        nearest = tree.nearest(query, 5)
+        expected = sorted(hamming_distance(value, query) for value in values)[:5]
+        assert [distance for distance, _ in nearest] == expected
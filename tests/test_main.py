@@ -0,0 +1,177 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("easyocr")
+
+import Main  # noqa: E402
+from test_image_loading import bomb_png  # noqa: E402
+
+
+def test_check_rejects_decompression_bomb_before_counting_pages():
+    expected = "REJECTED !!! REASON : IMAGE DIMENSIONS TOO LARGE !"
+    assert Main.CHECK("invoice", bomb_png()) == expected
+    assert Main.CHECK_PAGES("invoice", bomb_png())["result"] == expected
+
+
+def test_check_rejects_unknown_document_type():
+    assert Main.CHECK("passport", b"") == "REJECTED !!! REASON : UNKNOWN DOCUMENT TYPE !"
+
+
+@pytest.fixture
+def ocr_context(monkeypatch):
+    # The OCR gate of a page whose template matched, with OCR and keyword matching replaced by records
+    calls = []
+    monkeypatch.setattr(Main, "ROI_OCR_ENABLED", True)
+    monkeypatch.setattr(Main, "process_ocr", lambda image: calls.append("page") or "page text")
+
+    def field_gate(context, result):
+        calls.append("fields")
+        context["details"]["fields"] = {"total": "40"}
+        return result
+
+    context = {"document_type": "invoice", "image": None, "matched_template": "(1).png",
+               "cache": None, "details": {}}
+    return context, calls, field_gate
+
+
+@pytest.mark.parametrize("page_passes", [True, False])
+def test_full_page_decides_by_default(monkeypatch, ocr_context, page_passes):
+    context, calls, field_gate = ocr_context
+    monkeypatch.setattr(Main, "ROI_OCR_DECIDES", False)
+    monkeypatch.setattr(Main, "_field_gate", lambda context: field_gate(context, [True, "fields pass"]))
+    page_result = [page_passes, "page verdict"]
+    monkeypatch.setattr(Main, "OCR_MATCHING", lambda document_type, image, text: page_result)
+
+    assert Main._ocr_gate(context) == page_result
+    # Fields are only read for a page that passed, and go out with the verdict
+    assert calls == (["page", "fields"] if page_passes else ["page"])
+    assert ("fields" in context["details"]) == page_passes
+
+
+def test_fields_decide_with_roi_decides(monkeypatch, ocr_context):
+    context, calls, field_gate = ocr_context
+    monkeypatch.setattr(Main, "ROI_OCR_DECIDES", True)
+    monkeypatch.setattr(Main, "_field_gate", lambda context: field_gate(context, [True, "fields pass"]))
+    assert Main._ocr_gate(context) == [True, "fields pass"]
+    assert calls == ["fields"]
+
+    # Without a field pass the full page is read
+    calls.clear()
+    monkeypatch.setattr(Main, "_field_gate", lambda context: field_gate(context, None))
+    monkeypatch.setattr(Main, "OCR_MATCHING", lambda document_type, image, text: [False, "page verdict"])
+    assert Main._ocr_gate(context) == [False, "page verdict"]
+    assert calls == ["fields", "page"]
+
+
+def test_no_fields_without_matched_template(monkeypatch, ocr_context):
+    context, calls, field_gate = ocr_context
+    context["matched_template"] = None
+    monkeypatch.setattr(Main, "ROI_OCR_DECIDES", True)
+    monkeypatch.setattr(Main, "_field_gate", lambda context: field_gate(context, [True, "fields pass"]))
+    monkeypatch.setattr(Main, "OCR_MATCHING", lambda document_type, image, text: [True, "page verdict"])
+    assert Main._ocr_gate(context) == [True, "page verdict"]
+    assert calls == ["page"]
+
+
+@pytest.fixture
+def fake_gates(monkeypatch):
+    # Gates that record their calls; a gate named in `rejecting` rejects
+    calls, rejecting = [], set()
+
+    def gate(name):
+        def run(context):
+            calls.append(name)
+            return [False, f"REJECTED !!! REASON : {name.upper()} !"] if name in rejecting else [True, "ACCEPTED !!!"]
+        return run
+
+    gates = {name: dict(prior, run=gate(name)) for name, prior in Main.GATES.items()}
+    monkeypatch.setattr(Main, "GATES", gates)
+    monkeypatch.setattr(Main, "_stats", {name: dict(stats, calls=0, rejects=0, seconds=0.0, recent_seconds=None)
+                                         for name, stats in Main._stats.items()})
+    monkeypatch.setattr(Main, "get_result_cache", lambda: None)
+    monkeypatch.setattr(Main, "get_upload_history", lambda: None)
+    monkeypatch.setattr(Main, "find_duplicate_templates", lambda image, folder: [])
+    return calls, rejecting
+
+
+def test_gate_order_explicit_and_priors(fake_gates):
+    assert Main.gate_order("template, ocr,unknown") == ["template", "ocr"]
+    assert Main.gate_order(["ocr", "blur"]) == ["ocr", "blur"]
+    # Without measurements the gates are ordered by prior cost / reject rate
+    assert Main.gate_order("auto") == ["layout", "blur", "template", "ocr"]
+
+
+def test_gate_order_learns_from_measurements(fake_gates):
+    # The layout gate turns out slow and never rejects; the OCR gate fast and often rejecting
+    for _ in range(200):
+        Main._record("layout", 1.0, False)
+        Main._record("ocr", 0.01, True)
+    order = Main.gate_order("auto")
+    assert order.index("ocr") < order.index("layout")
+
+
+def test_first_rejection_short_circuits(fake_gates):
+    calls, rejecting = fake_gates
+    page = np.full((64, 64, 3), 255, dtype=np.uint8)
+    assert Main._run_check("invoice", page, order="blur,layout,ocr,template")[0] == "ACCEPTED !!! "
+    assert calls == ["blur", "layout", "ocr", "template"]
+
+    calls.clear()
+    rejecting.add("layout")
+    message, _ = Main._run_check("invoice", page, order="blur,layout,ocr,template")
+    assert message == "REJECTED !!! REASON : LAYOUT !"
+    assert calls == ["blur", "layout"]
+    assert Main.pipeline_stats()["layout"]["rejects"] == 1
+
+
+def _tiff(pages):
+    # A multi-page TIFF whose page n is filled with grey level n
+    frames = [Image.new("L", (32, 32), number) for number in range(pages)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, "TIFF", save_all=True, append_images=frames[1:])
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def page_verdicts(monkeypatch):
+    # Replaces the per-page pipeline: page n gets verdicts[n]
+    verdicts, checked = [], []
+
+    def run_check(document_type, page, order=None, engine="sift", source=None):
+        number = int(page[0, 0, 0])
+        checked.append(number + 1)
+        return verdicts[number], {"template": f"({number}).png"}
+
+    monkeypatch.setattr(Main, "_run_check", run_check)
+    return verdicts, checked
+
+
+ACCEPT, REJECT = "ACCEPTED !!! ", "REJECTED !!! REASON : IMAGE TOO BLURRY !"
+
+
+@pytest.mark.parametrize("policy, verdicts, result, decided_by, checked", [
+    ("first", [REJECT, ACCEPT, ACCEPT], REJECT, 1, [1]),
+    ("any", [REJECT, ACCEPT, REJECT], ACCEPT, 2, [1, 2]),
+    ("any", [REJECT, REJECT, REJECT], REJECT, None, [1, 2, 3]),
+    ("all", [ACCEPT, REJECT, ACCEPT], REJECT, 2, [1, 2]),
+    ("all", [ACCEPT, ACCEPT, ACCEPT], ACCEPT, None, [1, 2, 3]),
+])
+def test_page_policies(page_verdicts, policy, verdicts, result, decided_by, checked):
+    page_verdicts[0].extend(verdicts)
+    outcome = Main.CHECK_PAGES("invoice", _tiff(3), policy=policy)
+    assert outcome["result"] == result
+    assert outcome["decided_by"] == decided_by
+    # Reading stops at the deciding page
+    assert page_verdicts[1] == checked
+    assert [page["page"] for page in outcome["pages"]] == checked
+    assert outcome["pages"][0]["template"] == "(0).png"
+
+
+def test_check_applies_the_page_policy_to_multi_page_files(page_verdicts, monkeypatch):
+    page_verdicts[0].extend([REJECT, ACCEPT])
+    monkeypatch.setattr(Main, "PAGE_POLICY", "any")
+    assert Main.CHECK("invoice", _tiff(2)) == ACCEPT
+    with pytest.raises(ValueError):
+        Main.CHECK_PAGES("invoice", _tiff(2), policy="most")
@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+import pytest
+from Pre_Processing import estimate_skew, correct_skew
+
+
+def _page():
+    # A white page with lines of black text
+    page = np.full((1100, 850), 255, dtype=np.uint8)
+    for line in range(25):
+        cv2.putText(page, "Patient name and address 0123456789", (60, 80 + 38 * line),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, 0, 2)
+    return page
+
+
+def _rotate(image, angle):
+    h, w = image.shape[:2]
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    return cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+@pytest.mark.parametrize("angle", [-4.0, -1.5, 0.0, 2.5])
+def test_estimate_skew_undoes_the_rotation(angle):
+    estimate, confidence = estimate_skew(_rotate(_page(), angle))
+    assert estimate == pytest.approx(-angle, abs=0.3)
+    assert confidence >= 0.35
+
+
+def test_correct_skew_straightens_the_page():
+    skewed = cv2.cvtColor(_rotate(_page(), 3.0), cv2.COLOR_GRAY2BGR)
+    corrected, angle = correct_skew(skewed)
+    assert angle == pytest.approx(-3.0, abs=0.3)
+    assert corrected.shape == skewed.shape
+    assert abs(estimate_skew(corrected)[0]) <= 0.3
+
+
+def test_low_confidence_estimates_are_not_applied():
+    noise = np.random.default_rng(0).integers(0, 255, (400, 300), dtype=np.uint8)
+    assert estimate_skew(noise)[1] < 0.35
+    corrected, angle = correct_skew(noise)
+    assert angle == 0 and corrected is noise
+
+    skewed = _rotate(_page(), 3.0)
+    corrected, angle = correct_skew(skewed, min_confidence=1.01)
+    assert angle == 0 and corrected is skewed
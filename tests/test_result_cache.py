@@ -0,0 +1,107 @@
+import pickle
+import sqlite3
+import Result_Cache
+from Result_Cache import MISS, ResultCache, image_digest
+import numpy as np
+
+
+def test_image_digest_depends_on_content():
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    other = image.copy()
+    other[0, 0, 0] = 1
+    assert image_digest(image) == image_digest(image.copy())
+    assert image_digest(image) != image_digest(other)
+
+
+def test_memory_tier_hits_misses_and_versions():
+    cache = ResultCache(path=None, memory_entries=2)
+    assert cache.get("check", "a", "v1") is MISS
+    cache.put("check", "a", "v1", None)
+    # A cached None is a hit, not a miss
+    assert cache.get("check", "a", "v1") is None
+    assert cache.get("check", "a", "v2") is MISS
+
+    cache.put("check", "b", "v1", 2)
+    cache.put("check", "c", "v1", 3)
+    assert cache.get("check", "a", "v1") is MISS  # Evicted from the LRU
+    metrics = cache.metrics()
+    assert metrics["memory_hits"] == 1
+    assert metrics["stale"] == 1
+    assert metrics["memory_entries"] == 2
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    ResultCache(path=path).put("ocr", "digest", "v1", {"text": "invoice"})
+
+    cache = ResultCache(path=path)
+    assert cache.get("ocr", "digest", "v1") == {"text": "invoice"}
+    assert cache.get("ocr", "digest", "v2") is MISS
+    assert cache.metrics()["disk_hits"] == 1
+    cache.clear()
+    assert ResultCache(path=path).get("ocr", "digest", "v1") is MISS
+
+
+def test_disk_tier_is_capped_in_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(Result_Cache, "PRUNE_EVERY", 1)
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResultCache(path=path, memory_entries=1, disk_bytes=10_000)
+    for number in range(20):
+        cache.put("descriptors", str(number), "v1", b"x" * 1000)
+
+    with sqlite3.connect(path) as db:
+        total, = db.execute("SELECT SUM(size) FROM entries").fetchone()
+    assert total <= 10_000
+    # The most recently written entries are kept
+    assert cache.get("descriptors", "19", "v1") == b"x" * 1000
+    assert cache.get("descriptors", "0", "v1") is MISS
+
+
+def test_disk_tier_is_capped_in_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(Result_Cache, "PRUNE_EVERY", 1)
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResultCache(path=path, memory_entries=1, disk_entries=5)
+    for number in range(12):
+        cache.put("check", str(number), "v1", number)
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 5
+
+
+def test_files_without_size_column_are_migrated(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    with sqlite3.connect(path) as db:
+        db.execute(
+            "CREATE TABLE entries (kind TEXT, key TEXT, version TEXT, value BLOB, accessed REAL, "
+            "PRIMARY KEY (kind, key))"
+        )
+        db.execute("INSERT INTO entries VALUES ('check', 'a', 'v1', ?, 0)", (pickle.dumps("old"),))
+
+    cache = ResultCache(path=path)
+    assert cache.get("check", "a", "v1") == "old"
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT size FROM entries").fetchone()[0] == len(pickle.dumps("old"))
+
+
+def test_memory_tier_is_capped_in_bytes():
+    cache = ResultCache(path=None, memory_entries=100, memory_bytes=3500)
+    for number in range(5):
+        cache.put("descriptors", str(number), "v1", np.zeros(1000, dtype=np.uint8))
+    metrics = cache.metrics()
+    assert metrics["memory_entries"] == 3
+    assert metrics["memory_bytes"] == 3000
+    assert cache.get("descriptors", "1", "v1") is MISS
+    assert cache.get("descriptors", "4", "v1") is not MISS
+
+    # Replacing an entry does not count it twice; a value larger than the tier is not kept
+    cache.put("descriptors", "4", "v2", np.zeros(1000, dtype=np.uint8))
+    assert cache.metrics()["memory_bytes"] == 3000
+    cache.put("descriptors", "big", "v1", np.zeros(5000, dtype=np.uint8))
+    assert cache.metrics()["memory_entries"] == 0
+    cache.clear()
+    assert cache.metrics()["memory_bytes"] == 0
+
+
+def test_value_size_counts_arrays_in_containers():
+    points, descriptors = np.zeros((500, 2), dtype=np.float32), np.zeros((500, 128), dtype=np.float32)
+    assert Result_Cache.value_size((points, descriptors)) >= points.nbytes + descriptors.nbytes
+    assert Result_Cache.value_size({"result": "ACCEPTED", "details": {}}) > 0
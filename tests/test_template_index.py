@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+from Descriptor_Store import DescriptorStore
+from Template_Index import RATIO, TemplateIndex
+
+
+def _store(rows_per_template, dim=128, seed=0):
+    rng = np.random.default_rng(seed)
+    descriptors = rng.uniform(0, 255, (sum(rows_per_template), dim)).astype(np.float32)
+    templates, offset = [], 0
+    for number, count in enumerate(rows_per_template):
+        templates.append({"name": f"({number}).png", "offset": offset, "count": count, "prepared": [100, 100]})
+        offset += count
+    manifest = {"params": {"detector": "sift", "profile": None}, "templates": templates, "arrays": "test"}
+    return DescriptorStore("", manifest, descriptors, np.zeros((offset, 2), dtype=np.float32))
+
+
+def _exact_votes(store, queries):
+    # The per-template ratio test `votes` stands in for
+    votes = np.zeros(len(store), dtype=np.int64)
+    for number, name in enumerate(store.names):
+        distances = np.linalg.norm(queries[:, None, :] - store.descriptors_for(name)[None, :, :], axis=2)
+        nearest = np.sort(distances, axis=1)[:, :2]
+        votes[number] = int(np.sum(nearest[:, 0] < RATIO * nearest[:, 1]))
+    return votes
+
+
+def test_votes_match_the_per_template_ratio_test():
+    store = _store([4, 4, 4])
+    # A linear (exact) index, and few enough rows that every neighbour is retrieved
+    index = TemplateIndex(store, cv2.flann_Index(store.descriptors, dict(algorithm=0)))
+    rng = np.random.default_rng(1)
+    queries = store.descriptors[[0, 1, 5, 9, 10]] + rng.normal(0, 5, (5, 128)).astype(np.float32)
+    queries = np.vstack([queries, rng.uniform(0, 255, (20, 128)).astype(np.float32)])
+
+    votes = index.votes(queries)
+    assert votes.tolist() == _exact_votes(store, queries).tolist()
+    # Every noisy copy votes for its own template; the random descriptors are ambiguous
+    assert votes.tolist() == [2, 1, 2]
+
+
+def test_shortlist_ranks_templates_by_votes():
+    store = _store([6, 6, 6, 6])
+    index = TemplateIndex(store, cv2.flann_Index(store.descriptors, dict(algorithm=0)))
+    queries = store.descriptors[[12, 13, 14, 15, 0]] + 1.0
+    shortlist = index.shortlist(queries, top_k=3)
+    assert shortlist[0] == ("(2).png", 4)
+    assert [name for name, _ in shortlist] == ["(2).png", "(0).png"]
+
+
+def test_no_descriptors_no_votes():
+    store = _store([4, 4])
+    index = TemplateIndex(store, cv2.flann_Index(store.descriptors, dict(algorithm=0)))
+    assert index.votes(None).tolist() == [0, 0]
+    assert index.shortlist(np.empty((0, 128), dtype=np.float32)) == []
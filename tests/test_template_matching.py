@@ -0,0 +1,64 @@
+import os
+import shutil
+import cv2
+import numpy as np
+import pytest
+import Descriptor_Store
+import Template_Matching
+from Template_Matching import compare_image_with_templates
+
+TEMPLATES = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "PRESCRIPTIONS"))
+NAMES = sorted(os.listdir(TEMPLATES))[:6]
+
+
+@pytest.fixture
+def template_folder(tmp_path, monkeypatch):
+    # Spawned workers read the store root from the environment
+    monkeypatch.setenv("CHECK_STORE_ROOT", str(tmp_path / "store"))
+    monkeypatch.setattr(Descriptor_Store, "STORE_ROOT", str(tmp_path / "store"))
+    folder = tmp_path / "TEMPLATES"
+    folder.mkdir()
+    for name in NAMES:
+        shutil.copy(os.path.join(TEMPLATES, name), folder / name)
+    Descriptor_Store.build_descriptor_store(str(folder))
+    yield str(folder)
+    with Template_Matching._process_pools_lock:
+        for pool in Template_Matching._process_pools.values():
+            pool.shutdown()
+        Template_Matching._process_pools.clear()
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_finds_the_matching_template(template_folder, use_processes):
+    upload = cv2.imread(os.path.join(TEMPLATES, NAMES[3]))
+    matched = compare_image_with_templates(
+        upload, template_folder, 15, num_threads=2, batch_size=2, use_processes=use_processes
+    )
+    # Early stopping accepts the first template to reach the threshold, not necessarily the best
+    assert matched[0] is True
+    assert matched[2]["matched_template"] in NAMES
+    assert 1 <= matched[2]["templates_compared"] <= len(NAMES)
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_rejects_an_unrelated_image(template_folder, use_processes):
+    noise = np.random.default_rng(0).integers(0, 255, (600, 450, 3), dtype=np.uint8)
+    matched = compare_image_with_templates(
+        noise, template_folder, 15, num_threads=2, batch_size=2, use_processes=use_processes
+    )
+    assert matched[0] is False
+    assert matched[2]["matched_template"] is None
+
+
+def test_process_pool_scores_equal_thread_scores(template_folder):
+    upload = cv2.imread(os.path.join(TEMPLATES, NAMES[1]))
+    scores = [
+        compare_image_with_templates(
+            upload, template_folder, 15, num_threads=2, batch_size=2, use_processes=use_processes,
+            stop_on_match=False,
+        )[2]["scores"]
+        for use_processes in (False, True)
+    ]
+    assert scores[0] == scores[1]
+    assert sorted(scores[0]) == NAMES
+    assert Template_Matching._process_pools[2]._mp_context.get_start_method() == "spawn"
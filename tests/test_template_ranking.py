@@ -0,0 +1,42 @@
+import os
+import shutil
+import cv2
+import numpy as np
+import pytest
+import Descriptor_Store
+from Template_Ranking import rank_templates
+
+TEMPLATES = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "PRESCRIPTIONS"))
+NAMES = sorted(os.listdir(TEMPLATES))[:5]
+
+
+@pytest.fixture
+def template_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(Descriptor_Store, "STORE_ROOT", str(tmp_path / "store"))
+    folder = tmp_path / "TEMPLATES"
+    folder.mkdir()
+    for name in NAMES:
+        shutil.copy(os.path.join(TEMPLATES, name), folder / name)
+    return str(folder)
+
+
+def test_warped_template_ranks_first(template_folder):
+    page = cv2.imread(os.path.join(TEMPLATES, NAMES[2]))
+    height, width = page.shape[:2]
+    warp = np.array([[0.97, 0.02, 15.0], [-0.01, 0.98, 25.0], [0.0, 0.0, 1.0]])
+    upload = cv2.warpPerspective(page, warp, (width, height), borderValue=(255, 255, 255))
+
+    ranking = rank_templates(upload, template_folder, threshold=15, top_k=4, verify_top=2, num_threads=1)
+    assert len(ranking) == 4
+    assert ranking[0]["template"] == NAMES[2]
+    assert ranking[0]["passed"] and ranking[0]["inliers"] >= 12
+    # Only the verify_top best by match count get RANSAC
+    assert sum(result["inliers"] is not None for result in ranking) == 2
+    assert not any(result["passed"] for result in ranking[1:] if result["inliers"] is None)
+
+
+def test_unrelated_image_passes_nothing(template_folder):
+    noise = np.random.default_rng(0).integers(0, 255, (600, 450, 3), dtype=np.uint8)
+    ranking = rank_templates(noise, template_folder, threshold=15, top_k=5, num_threads=1)
+    assert len(ranking) == 5
+    assert not any(result["passed"] for result in ranking)
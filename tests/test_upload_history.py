@@ -0,0 +1,78 @@
+import time
+import importlib
+import numpy as np
+import pytest
+import Upload_History
+from Upload_History import UploadHistory
+
+
+def _page(seed):
+    # A blocky random page, so the perceptual hashes of different seeds are far apart
+    blocks = np.random.default_rng(seed).integers(0, 255, (16, 12), dtype=np.uint8)
+    return np.kron(blocks, np.ones((40, 40), dtype=np.uint8))
+
+
+def test_history_is_opt_in(monkeypatch):
+    monkeypatch.delenv("CHECK_UPLOAD_HISTORY", raising=False)
+    assert not importlib.reload(Upload_History).HISTORY_ENABLED
+    assert Upload_History.get_upload_history() is None
+
+
+def test_resubmission_signal(tmp_path):
+    path = str(tmp_path / "uploads.sqlite3")
+    history = UploadHistory(path)
+    assert history.check_and_record(_page(1), "invoice", "a") == []
+    assert history.check_and_record(_page(2), "invoice", "b") == []
+
+    again = history.check_and_record(_page(1), "invoice", "a")
+    assert [(item["digest"], item["distance"]) for item in again] == [("a", 0)]
+
+    # Another process sharing the file sees the uploads of the first one
+    other = UploadHistory(path)
+    rescanned = _page(2).copy()
+    rescanned[:4] = 0
+    found = other.check_and_record(rescanned, "invoice", "c")
+    assert found and found[0]["digest"] == "b"
+
+
+def test_same_source_is_not_its_own_resubmission():
+    history = UploadHistory(None)
+    assert history.check_and_record(_page(1), "invoice", "a", source="batch/1.png") == []
+    # A resumed batch re-checks the same file
+    assert history.check_and_record(_page(1), "invoice", "a", source="batch/1.png") == []
+    # The same scan under another name is still reported
+    found = history.check_and_record(_page(1), "invoice", "a", source="batch/copy.png")
+    assert [item["source"] for item in found] == ["batch/1.png"]
+
+
+def test_entry_cap_prunes_file_and_mirror(tmp_path, monkeypatch):
+    monkeypatch.setattr(Upload_History, "PRUNE_EVERY", 1)
+    path = str(tmp_path / "uploads.sqlite3")
+    history = UploadHistory(path, max_entries=3)
+    for seed in range(6):
+        history.check_and_record(_page(seed), "invoice", str(seed))
+
+    assert [key[0] for key in history._entries] == ["3", "4", "5"]
+    assert len(history.tree.search(0, 64)) == 3
+    assert history._db.execute("SELECT COUNT(*) FROM uploads").fetchone()[0] == 3
+    assert history.check_and_record(_page(0), "invoice", "0") == []
+    assert history.check_and_record(_page(5), "invoice", "5")[0]["digest"] == "5"
+
+
+def test_age_cap(monkeypatch):
+    monkeypatch.setattr(Upload_History, "PRUNE_EVERY", 1)
+    history = UploadHistory(None, max_age_days=1)
+    now = time.time()
+    monkeypatch.setattr(Upload_History.time, "time", lambda: now - 2 * 86400)
+    history.check_and_record(_page(1), "invoice", "old")
+    monkeypatch.setattr(Upload_History.time, "time", lambda: now)
+    assert history.check_and_record(_page(1), "invoice", "new") == []
+    assert list(history._entries) == [("new", "invoice")]
+
+
+@pytest.mark.parametrize("value", [0, (1 << 63) - 1, 1 << 63, (1 << 64) - 1])
+def test_hashes_round_trip_through_sqlite(tmp_path, value, monkeypatch):
+    monkeypatch.setattr(Upload_History, "perceptual_hash", lambda image: value)
+    path = str(tmp_path / "uploads.sqlite3")
+    UploadHistory(path).check_and_record(None, "invoice", "a")
+    assert UploadHistory(path).check_and_record(None, "invoice", "b")[0]["distance"] == 0
@@ -0,0 +1,65 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from Upload_Intake import sniff_format, inspect_image, read_upload
+
+
+def _encode(image, fmt, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **params)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("fmt, expected", [
+    ("PNG", ("png", ".png")),
+    ("JPEG", ("jpeg", ".jpg")),
+    ("GIF", ("gif", ".gif")),
+    ("BMP", ("bmp", ".bmp")),
+    ("TIFF", ("tiff", ".tif")),
+    ("WEBP", ("webp", ".webp")),
+])
+def test_sniff_format(fmt, expected):
+    assert sniff_format(_encode(Image.new("RGB", (8, 8)), fmt)[:16]) == expected
+
+
+@pytest.mark.parametrize("head", [b"", b"%PDF-1.7\n", b"RIFF\x00\x00\x00\x00WAVE", b"<html>"])
+def test_sniff_format_rejects_non_images(head):
+    assert sniff_format(head) is None
+
+
+def test_inspect_image_reads_header(tmp_path):
+    data = _encode(Image.new("RGB", (30, 20)), "PNG")
+    path = tmp_path / "upload.bin"
+    path.write_bytes(data)
+    for source in (data, str(path)):
+        result, info = inspect_image(source)
+        assert result[0]
+        assert info == {"format": "png", "extension": ".png", "width": 30, "height": 20, "pages": 1}
+
+
+def test_inspect_image_rejections(tmp_path):
+    assert inspect_image(b"not an image at all")[0][1] == "REJECTED !!! REASON : INVALID IMAGE FORMAT !"
+    # A valid signature followed by garbage
+    assert inspect_image(b"\x89PNG\r\n\x1a\n" + b"\x00" * 64)[0][1] == "REJECTED !!! REASON : INVALID IMAGE FORMAT !"
+    assert inspect_image(str(tmp_path / "missing.png"))[0][1] == "REJECTED !!! REASON : IMAGE DON'T EXIST !"
+
+    data = _encode(Image.new("L", (200, 100)), "PNG")
+    assert inspect_image(data, max_pixels=10000)[0][1] == "REJECTED !!! REASON : IMAGE DIMENSIONS TOO LARGE !"
+    assert inspect_image(data, max_dimension=150)[0][1] == "REJECTED !!! REASON : IMAGE DIMENSIONS TOO LARGE !"
+
+
+def test_inspect_image_counts_pages():
+    frames = [Image.new("L", (16, 16), color) for color in (0, 128, 255)]
+    data = _encode(frames[0], "TIFF", save_all=True, append_images=frames[1:])
+    result, info = inspect_image(data)
+    assert result[0] and info["pages"] == 3
+    assert inspect_image(data, max_pages=2)[0][1] == "REJECTED !!! REASON : TOO MANY PAGES !"
+
+
+def test_read_upload_limits():
+    data = _encode(Image.fromarray(np.random.default_rng(0).integers(0, 255, (64, 64), dtype=np.uint8)), "PNG")
+    assert read_upload(io.BytesIO(data)) == ([True, "ACCEPTED !!!"], data)
+    assert read_upload(io.BytesIO(data), max_bytes=len(data) - 1)[0][1] == "REJECTED !!! REASON : FILE TOO LARGE !"
+    assert read_upload(io.BytesIO(b"MZ\x90\x00"))[0][1] == "REJECTED !!! REASON : INVALID IMAGE FORMAT !"
+    assert read_upload(io.BytesIO(b""))[0][1] == "REJECTED !!! REASON : INVALID IMAGE FORMAT !"
@@ -0,0 +1,73 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from User_Store import UserStore  # noqa: E402
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.users
+
+
+@pytest.fixture
+def store(collection):
+    store = UserStore(collection, ttl=60, max_entries=2)
+    assert store.ensure_indexes()[0]
+    return store
+
+
+def _create(store, username):
+    assert store.create({"username": username, "email": f"{username}@example.com", "password": "hash"})[0]
+    return str(store.collection.find_one({"username": username})["_id"])
+
+
+def test_duplicates_are_rejected(store):
+    _create(store, "alice")
+    assert store.exists("alice", "other@example.com")
+    assert store.exists("bob", "alice@example.com")
+    assert not store.exists("bob", "bob@example.com")
+    assert store.create({"username": "alice", "email": "new@example.com"}) == [False, "User already exists."]
+
+
+def test_get_is_cached_until_invalidated(store, collection):
+    user_id = _create(store, "alice")
+    assert store.get(user_id)["username"] == "alice"
+
+    collection.update_one({"username": "alice"}, {"$set": {"password": "changed"}})
+    assert store.get(user_id)["password"] == "hash"  # Served from the cache
+    store.invalidate(user_id)
+    assert store.get(user_id)["password"] == "changed"
+
+    metrics = store.metrics()
+    assert (metrics["hits"], metrics["misses"], metrics["invalidations"]) == (1, 2, 1)
+
+
+def test_login_reads_database_and_warms_cache(store, collection):
+    user_id = _create(store, "alice")
+    store.get(user_id)
+    collection.update_one({"username": "alice"}, {"$set": {"password": "changed"}})
+    assert store.find_by_username("alice")["password"] == "changed"
+    assert store.get(user_id)["password"] == "changed"
+    assert store.find_by_username("nobody") is None
+
+
+def test_unknown_and_malformed_ids(store):
+    assert store.get("0123456789abcdef01234567") is None
+    assert store.get("not-an-object-id") is None
+    assert store.get(None) is None
+    assert store.metrics()["entries"] == 0
+
+
+def test_cache_is_bounded_and_can_be_disabled(store, collection):
+    ids = [_create(store, name) for name in ("alice", "bob", "carol")]
+    for user_id in ids:
+        store.get(user_id)
+    assert store.metrics()["entries"] == 2
+    store.invalidate()
+    assert store.metrics()["entries"] == 0
+
+    uncached = UserStore(collection, ttl=0)
+    uncached.get(ids[0])
+    uncached.get(ids[0])
+    assert uncached.metrics()["hits"] == 0